@@ -1,8 +1,10 @@
 import io
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends
+import logging
+import time
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from enum import Enum
 from pydantic import BaseModel, ConfigDict
 from typing import Optional, List
@@ -12,14 +14,21 @@ import uuid
 import easyocr
 from ultralytics import YOLO
 
-from backend.src.backend_base_services import upload_video_service, upload_product_service, \
+from backend.src.backend_base_services import upload_video_service, upload_video_stream_service, upload_product_service, \
     get_vid_by_id_service, get_vid_metadata_by_id_service, get_vids_by_genre_service, \
     get_product_by_id_service, get_product_metadata_by_id_service, get_products_by_category_service, \
-    update_user_interaction_service, get_feed_service, get_shop_service
-from backend.src.product_recommendation.personalized_recommendation import _products_recommendation_cache
+    update_user_interaction_service, get_feed_service, get_shop_service, refresh_shop_service, get_shop_cache_stats_service, \
+    get_cascade_stats_service, get_metrics_service
+from backend.src.instrumentation import start_request, finish_request
+from backend.src.product_recommendation.embedding_index import load_text_encoder, start_embedding_builds
+from backend.src.product_recommendation.co_engagement import start_co_engagement_build
+from backend.src.database.db_utils import DEFAULT_USER_ID
 from survey_framework import SurveyCollector, RecommendationSurveyResponse
 from datetime import datetime
 
+# root handler for the backend's module loggers, uvicorn only configures its own
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
@@ -34,10 +43,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """ Request latency histogram per route, and a JSON log line with the request's spans for a sampled share"""
+    sampled = start_request()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # the route template (/video/{video_id}), raw paths would make a series per id
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        finish_request(request.method, route, status, time.perf_counter() - start, sampled)
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
-    print(f"DEBUG: Validation error: {exc}")
-    print(f"DEBUG: Request body: {await request.body()}")
+    logger.debug("Validation error: %s", exc)
+    logger.debug("Request body: %s", await request.body())
     return JSONResponse(
         status_code=422,
         content={"detail": exc.errors(), "body": str(exc)},
@@ -104,12 +128,31 @@ def startup():
 
     app.state.object_detector = YOLO("yolo11n.pt")
 
-    print("main.py: Loaded models")
+    # product photos and sampled video frames are embedded once at upload for video -> product matching
+    app.state.image_embedder = pipeline(
+        task="image-feature-extraction",
+        model="facebook/dinov2-small",
+        device=-1  # CPU
+    )
+
+    # sentence model of the recommendation content embeddings, loaded here instead of on the first feed request
+    load_text_encoder()
+    # the co-engagement index replays the whole interaction log, feed requests skip it until it is ready
+    start_co_engagement_build()
+    # text rows of items without one are encoded there too, the first feed and shop requests skip the embeddings instead
+    start_embedding_builds()
+
+    logger.info("main.py: Loaded models")
 
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """ Latency histograms of detection stages, storage reads / writes, recommender steps and requests (Prometheus text format)"""
+    return PlainTextResponse(get_metrics_service(), media_type="text/plain; version=0.0.4")
+
 def get_genre_classifier():
     return app.state.genre_classifier
 
@@ -125,6 +168,9 @@ def get_caption_model():
 def get_object_detector():
     return app.state.object_detector
 
+def get_image_embedder():
+    return app.state.image_embedder
+
 @app.post("/upload/video")
 async def upload_video(
     video: UploadFile = File(...),
@@ -133,10 +179,11 @@ async def upload_video(
     ocr_reader = Depends(get_ocr_reader),
     bart_mnli = Depends(get_bart_mnli),
     caption_model = Depends(get_caption_model),
-    object_detector = Depends(get_object_detector)
+    object_detector = Depends(get_object_detector),
+    image_embedder = Depends(get_image_embedder)
 ):  
     vid_id = str(uuid.uuid4())
-    print(f"main.py: /upload/video id: {vid_id}")
+    logger.info("main.py: /upload/video id: %s", vid_id)
 
     if not video.filename.lower().endswith((".mp4", ".mov", ".mkv", ".webm", ".avi")):
         raise HTTPException(status_code=400, detail="Unsupported video format")
@@ -149,25 +196,74 @@ async def upload_video(
             object_detector,
             vid_id, 
             video, 
-            request_payload
+            request_payload,
+            image_embedder
+        )
+        logger.info("main.py: /upload/video/ uploaded video to database, applied classification and object detection: %s", vid_id)
+        return upload_payload
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/upload/video/stream")
+async def upload_video_stream(
+    request: Request,
+    description: str,
+    filename: str = "video.mp4",
+    genre_clf_model= Depends(get_genre_classifier),
+    ocr_reader = Depends(get_ocr_reader),
+    bart_mnli = Depends(get_bart_mnli),
+    caption_model = Depends(get_caption_model),
+    object_detector = Depends(get_object_detector),
+    image_embedder = Depends(get_image_embedder)
+):
+    """
+    Raw body upload (Content-Type: video/*), description and filename go in the query string.
+    The body is written to disk chunk by chunk as it arrives instead of being spooled by multipart parsing first,
+    and duration probing starts once the container header is on disk.
+    """
+    vid_id = str(uuid.uuid4())
+    logger.info("main.py: /upload/video/stream id: %s", vid_id)
+
+    if not filename.lower().endswith((".mp4", ".mov", ".mkv", ".webm", ".avi")):
+        raise HTTPException(status_code=400, detail="Unsupported video format")
+    try:
+        upload_payload = await upload_video_stream_service(
+            genre_clf_model,
+            ocr_reader,
+            bart_mnli,
+            caption_model,
+            object_detector,
+            vid_id,
+            filename,
+            request.stream(),
+            description,
+            image_embedder
         )
-        print(f"main.py: /upload/video/ uploaded video to database, applied classification and object detection: {vid_id}")
+        logger.info("main.py: /upload/video/stream uploaded video to database, applied classification and object detection: %s", vid_id)
         return upload_payload
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/upload/video/cascade_stats")
+def get_cascade_stats():
+    """ How often the categorization cascade skipped OCR / captioning / object detection"""
+    return get_cascade_stats_service()
+
 @app.post("/upload/product")
 async def upload_product(
     image: UploadFile = File(...),
-    request_payload: ProductUploadRequest = Depends(ProductUploadRequest.as_form)
+    request_payload: ProductUploadRequest = Depends(ProductUploadRequest.as_form),
+    image_embedder = Depends(get_image_embedder)
 ):
     prod_id = str(uuid.uuid4())
-    print(f"main.py: /upload/product/ id: {prod_id}")
+    logger.info("main.py: /upload/product/ id: %s", prod_id)
     try:
         img_bytes = await image.read()
         img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-        upload_payload = upload_product_service(prod_id, img, request_payload)
-        print(f"main.py: /upload/product/ uploaded product to database, applied classification and object detection: {prod_id}")
+        upload_payload = upload_product_service(prod_id, img, request_payload, image_embedder)
+        logger.info("main.py: /upload/product/ uploaded product to database, applied classification and object detection: %s", prod_id)
         return upload_payload
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -206,6 +302,7 @@ def get_product_metadata_by_id(product_id: str):
 
 class InteractionPayload(BaseModel):
     video_id: str
+    user_id: str = DEFAULT_USER_ID
     watch_time_ms: int
     skipped_quickly: bool = False
     watched_50_pct: bool = False
@@ -218,6 +315,7 @@ async def update_video_interactions(payload: InteractionPayload):
             payload.watch_time_ms,
             payload.skipped_quickly,
             payload.watched_50_pct,
+            payload.user_id,
         )
         return return_payload
     except Exception as e:
@@ -226,42 +324,50 @@ async def update_video_interactions(payload: InteractionPayload):
 # return 10 video paths randomly selected from DB.
 
 @app.get("/feed/videos")
-def get_feed_videos(vids_num: int = 10):
+def get_feed_videos(vids_num: int = 10, user_id: str = DEFAULT_USER_ID, cursor: Optional[str] = None):
     """
-    No cache, everytime you call this API it will recommend new videos.
+    Cursor based infinite feed. Call without cursor to start a new feed session, then pass the returned next_cursor
+    to get the following page of the same candidate list (videos watched in the meantime are skipped).
+    user_id: recommendations come from this user's interactions (same id the frontend sends with interactions and surveys)
     """
     try:
-        return_payload = get_feed_service(vids_num)
+        return_payload = get_feed_service(vids_num, user_id, cursor)
         return return_payload
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"get_feed_videos failed: {str(e)}")
 
 # Recommendation portion; return top 20 products (its metadata) after calling recommendation system and product selections
 @app.get("/shop/products")
-def get_shop_products(num_products: int = 20):
+def get_shop_products(num_products: int = 20, user_id: str = DEFAULT_USER_ID):
     """
     Cached. if you call this API multiple times with same num_products for 5 minutes it will return the same products. 
 
     If you want different products recommended:
     a) call the refresh_shop API below.
-    b) call this API with a different num_products.
-    c) wait 5 minutes (Configurable inside get_shop_service function).
+    b) log a video interaction (clears this user's cached pages).
+    c) wait 5 minutes (Configurable in personalized_recommendation._products_recommendation_cache).
+
+    Cached per (user_id, num_products, product catalog version), product uploads clear the cache.
     """
     try:
-        return_payload = get_shop_service(num_products)
+        return_payload = get_shop_service(num_products, user_id)
         return return_payload
     except Exception as e:
         raise HTTPException(status_code = 500, detail = f"get_shop_products failed: {str(e)}")
 
 
+@app.get("/shop/cache_stats")
+def get_shop_cache_stats():
+    """ Hit / miss / eviction counters of the shop recommendation cache, for tuning its size and TTL"""
+    return get_shop_cache_stats_service()
+
+
 # for refresh button that clears the products cache
 # in frontend when refresh button is pressed we can call this API then call the get_shop_products API above 
 @app.post("/shop/refresh")
-def refresh_shop():
+def refresh_shop(user_id: str = DEFAULT_USER_ID):
     try:
-        _products_recommendation_cache["data"] = None
-        _products_recommendation_cache["timestamp"] = 0
-        return {"status": "completed"}
+        return refresh_shop_service(user_id)
     except Exception as e:
         raise HTTPException(status_code = 500, detail = f"refresh shop failed {str(e)}")
 
@@ -290,7 +396,7 @@ def submit_survey(survey_data: SurveySubmission):
     Called by frontend after user rates recommendations.
     """
     try:
-        print(f"DEBUG: Received survey data: {survey_data}")
+        logger.debug("Received survey data: %s", survey_data)
         response = RecommendationSurveyResponse(
             user_id=survey_data.user_id,
             recommendation_id=survey_data.recommendation_id,
@@ -307,14 +413,12 @@ def submit_survey(survey_data: SurveySubmission):
         # Get updated statistics
         stats = _survey_collector.get_summary_stats()
         
-        print(f"DEBUG: Survey submitted successfully. Stats: {stats}")
+        logger.debug("Survey submitted successfully. Stats: %s", stats)
         return {
             "status": "success",
             "message": "Survey response recorded",
             "stats": stats
         }
     except Exception as e:
-        print(f"DEBUG: Survey submission error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Survey submission error: %s", e)
         raise HTTPException(status_code=500, detail=f"Survey submission failed: {str(e)}")
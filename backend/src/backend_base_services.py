@@ -1,43 +1,227 @@
 import os
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException
-from backend.src.database.db_utils import upload_video_database, upload_product_database, update_parquet_table, \
-    download_video, download_video_metadata, download_product, download_product_metadata, download_all_videos_metadata, download_user_interactions
-from backend.src.detection.detect_modules import classify_video_genre, ocr_read_frames, zero_shot_classification, capping_video, detect_objects_from_frames
-from backend.src.detection.detect_utils import load_json, get_video_duration_ms_from_path, get_base_frames, weighted_fusion, get_top3_objects_min_conf
+from starlette.concurrency import run_in_threadpool
+from backend.src.database.db_utils import upload_video_database, stream_video_database, upload_product_database, update_parquet_table, \
+    download_video, download_video_metadata, download_product, download_product_metadata, download_all_videos_metadata, download_user_interactions, \
+    DEFAULT_USER_ID
+from backend.src.detection.detect_modules import classify_video_genre, ocr_read_frames, zero_shot_classification, capping_video, detect_objects_from_frames, \
+    embed_images, embed_video_frames
+from backend.src.detection.detect_utils import load_json, get_video_duration_ms_from_path, get_base_frames, weighted_fusion, fusion_leader_is_final, get_top3_objects_min_conf
 import logging
 logger = logging.getLogger(__name__)
-from backend.src.product_recommendation.personalized_recommendation import video_recommendation, product_recommendation
+from backend.src.product_recommendation.personalized_recommendation import \
+    invalidate_user_products_cache, invalidate_products_cache, get_products_cache_stats
+from backend.src.product_recommendation.user_state import record_interaction
+from backend.src.product_recommendation.co_engagement import record_co_engagement
+from backend.src.product_recommendation.recommendation_pool import get_feed_page, get_shop_page, refresh_shop_pages, on_interaction
+from backend.src.product_recommendation.catalog_index import add_to_catalog_index
+from backend.src.product_recommendation.embedding_index import add_visual_embedding
+from backend.src.instrumentation import instrumented, span, render_prometheus
 from datetime import datetime
 MAPPED_LABELS = load_json("./backend/configs/mapped_labels_buckets.json")
 BUCKETS = load_json("./backend/configs/buckets.json")
 
+# background workers for upload analysis: header probing runs here while the request body is still streaming in,
+# frame decoding once the file is complete, next to VideoMAE inference.
+_ANALYSIS_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="video-analysis")
+# visual embedding of the sampled frames runs next to the signals; its own worker waits on the frame decoding so it can
+# never occupy the analysis workers the decoding needs
+_EMBEDDING_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="visual-embedding")
+
+# "uniform" is the original 10 evenly spaced frames. "scene" (opt-in) spends the OCR / BLIP / YOLO frame budget on
+# distinct shots, at the cost of a full decode pass for the scene scores; compare both with
+# benchmarks/bench_video_pipeline.py --sampling before switching
+FRAME_SAMPLING_MODE = "uniform"
+
+# early-exit cascade: the most weight each frame based stage can still add to a single bucket in weighted_fusion.
+# OCR and captioning emit one signal with conf <= 1, object detection up to 3 (top 3 objects).
+# A skipped stage could still have put another bucket over weighted_fusion's 0.1 multi-label threshold, so the cascade
+# only settles the leading bucket: with it on, videos are stored with that single bucket instead of the multi-label list
+CATEGORIZATION_CASCADE = False
+CASCADE_STAGE_MAX_WEIGHT = {"object_detection": 3.0, "ocr": 1.0, "vid_caption": 1.0}
+_cascade_stats = {"videos": 0, "early_exits": 0, "skipped": {stage: 0 for stage in CASCADE_STAGE_MAX_WEIGHT}}
+# uploads are categorized on several threads at once
+_cascade_stats_lock = threading.Lock()
+
 
 def upload_video_service(
-    genre_clf_model, ocr_reader, bart_mnli, caption_model, object_detector, vid_id, video, request_payload
+    genre_clf_model, ocr_reader, bart_mnli, caption_model, object_detector, vid_id, video, request_payload,
+    image_embedder=None
 ):
-    status = "process"
+    try:
+        video_path = upload_video_database(vid_id, video)
+        duration_ms = get_video_duration_ms_from_path(video_path)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"failed_upload: {e}")
+
+    return categorize_video_service(
+        genre_clf_model, ocr_reader, bart_mnli, caption_model, object_detector,
+        vid_id, video_path, duration_ms, request_payload.description, image_embedder=image_embedder
+    )
+
+
+async def upload_video_stream_service(
+    genre_clf_model, ocr_reader, bart_mnli, caption_model, object_detector, vid_id, filename, chunks, description,
+    image_embedder=None
+):
+    """
+    Streaming variant of upload_video_service: chunks are written straight to the final path while hashing,
+    and duration probing starts on a worker as soon as the container header has landed on disk. Only that
+    validation overlaps the upload: frame sampling and categorization start once the whole file is written, since
+    the sampled frames (uniform or scene) are spread over all of it.
+    """
+    header_probe = {}
+
+    def on_header(video_path):
+        header_probe["duration_ms"] = _ANALYSIS_EXECUTOR.submit(
+            contextvars.copy_context().run, get_video_duration_ms_from_path, video_path
+        )
+
+    try:
+        video_path, content_hash, n_bytes = await stream_video_database(vid_id, filename, chunks, on_header)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"failed_upload: {e}")
+
+    duration_ms = None
+    try:
+        duration_ms = header_probe["duration_ms"].result()
+    except Exception:
+        # header was not readable from the partial file (e.g. mp4 with moov atom at the end)
+        duration_ms = None
+
+    try:
+        if not duration_ms:
+            duration_ms = await run_in_threadpool(get_video_duration_ms_from_path, video_path)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"failed_upload: {e}")
+
+    upload_payload = await run_in_threadpool(
+        categorize_video_service,
+        genre_clf_model, ocr_reader, bart_mnli, caption_model, object_detector,
+        vid_id, video_path, duration_ms, description, image_embedder=image_embedder
+    )
+    return {**upload_payload, "content_sha256": content_hash, "size_bytes": n_bytes}
+
+
+def _ocr_signals(base_frames, ocr_reader, bart_mnli, video_metadata):
+    # SIGNAL 2: OCR
+    ocr_text, ocr_quality = ocr_read_frames(base_frames, ocr_reader)
+    logger.debug("Raw_OCR: %s", ocr_text)
+    video_metadata["ocr_text"] = ocr_text
+
+    # SIGNAL 2: zero shot classfication OCR signal to ecom bucket
+    ocr_signal_bucket, zeroshot_conf = zero_shot_classification(bart_mnli, list(BUCKETS["buckets"].keys()), ocr_text)
+    ocr_conf = ocr_quality * zeroshot_conf
+    return [("ocr", ocr_signal_bucket, ocr_conf)]
+
+
+def _vid_caption_signals(vid_id, base_frames, caption_model, bart_mnli, video_metadata):
+    # SIGNAL 4: Captioning video.
+    try:
+        vid_caption = capping_video(base_frames, caption_model)
+        logger.debug("Raw_vid_caption: %s", vid_caption)
+        video_metadata["vid_caption"] = vid_caption
+        vid_caption_bucket, vid_caption_conf = zero_shot_classification(
+            bart_mnli,
+            list(BUCKETS["buckets"].keys()),
+            vid_caption,
+        )
+        return [("vid_caption", vid_caption_bucket, vid_caption_conf)]
+    except Exception as caption_error:
+        logger.warning("Video captioning skipped for %s: %s", vid_id, caption_error)
+        return []
+
+
+def _object_detection_signals(base_frames, object_detector, bart_mnli, video_metadata):
+    # SIGNAL 5: Object Detection
+    detected_objects = detect_objects_from_frames(base_frames, object_detector)
+    logger.debug("Raw_detected_objects: %s", detected_objects)
+    top_objects = get_top3_objects_min_conf(detected_objects)
+    video_metadata["detected_objects"] = [detected_object[0] for detected_object in top_objects]
+
+    signals = []
+    for detected_object in top_objects:
+        object_detection_bucket, object_detection_conf = zero_shot_classification(bart_mnli, list(BUCKETS["buckets"].keys()), detected_object[0])
+        signals.append(("object_detection", object_detection_bucket, detected_object[1] * object_detection_conf))
+    return signals
+
+
+def _store_visual_embedding(item_type, item_id, compute_vector):
+    """ Adds the item's image embedding to the visual index, a failure only costs the item its visual matches"""
+    try:
+        vector = compute_vector()
+        if vector is not None:
+            add_visual_embedding(item_type, item_id, vector)
+    except Exception as embedding_error:
+        logger.warning("Visual embedding skipped for %s: %s", item_id, embedding_error)
+
+
+def get_cascade_stats_service():
+    """ How often each expensive stage was skipped by the early-exit cascade since startup"""
+    with _cascade_stats_lock:
+        videos = _cascade_stats["videos"]
+        early_exits = _cascade_stats["early_exits"]
+        skipped = dict(_cascade_stats["skipped"])
+    return {
+        "videos": videos,
+        "early_exits": early_exits,
+        "skipped": skipped,
+        "skip_rate": {stage: (count / videos if videos else 0.0) for stage, count in skipped.items()},
+    }
+
+
+@instrumented("detection.categorize_video")
+def categorize_video_service(
+    genre_clf_model, ocr_reader, bart_mnli, caption_model, object_detector, vid_id, video_path, duration_ms, description,
+    cascade=None, image_embedder=None
+):
+    """
+    Runs the 5 signal categorization on a video that is already on disk and stores its metadata
+
+    Cheap signals (VideoMAE classification, description zero shot) run first. With cascade enabled the frame based
+    stages (YOLO -> BART, OCR, BLIP captioning) run in that order and the rest are skipped as soon as the
+    leading bucket cannot be overtaken by the maximum weight those stages could still add. The video then gets the
+    leading bucket only (single label), without cascade every bucket weighted_fusion returns (multi label).
+    With an image_embedder the sampled frames are also embedded once for the shop's video -> product matching.
+    """
+    if cascade is None:
+        cascade = CATEGORIZATION_CASCADE
+
+    status = "uploaded"
     out_path = None
+    skipped_stages = []
 
     video_metadata = {
         "video_id": vid_id,
-        "video_path": None,
-        "duration_ms": None,
-        "caption": request_payload.description,
+        "video_path": video_path,
+        "duration_ms": duration_ms,
+        "caption": description,
         "bucket_num": None,
-        "bucket_name": None
+        "bucket_name": None,
+        # raw text of the frame based stages, kept for the content embeddings (None when the cascade skipped the stage)
+        "ocr_text": None,
+        "vid_caption": None,
+        "detected_objects": None,
     }
 
-    try:
-        video_path = upload_video_database(vid_id, video)
-        video_metadata["video_path"] = video_path
-        video_metadata["duration_ms"] = get_video_duration_ms_from_path(video_path)
-        status = "uploaded"
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"failed_upload: {e}")
-
     try:
         all_signal_outputs_list = []
 
+        # Get base frames to extract extra signals from vid, decoded on a worker while VideoMAE runs
+        # Per frame: (element has H x W x RGB(3))  
+        # (the workers run in a copy of this context so their spans land in a sampled request's log too)
+        base_frames_future = _ANALYSIS_EXECUTOR.submit(
+            contextvars.copy_context().run, get_base_frames, video_path, 10, FRAME_SAMPLING_MODE
+        )
+        embedding_future = None
+        if image_embedder is not None:
+            embedding_future = _EMBEDDING_EXECUTOR.submit(
+                contextvars.copy_context().run, lambda: embed_video_frames(base_frames_future.result(), image_embedder)
+            )
+
         # SIGNAL 1: classification
         top_k = 3
         classify_payload = classify_video_genre(genre_clf_model, video_path, top_k)
@@ -47,50 +231,48 @@ def upload_video_service(
             bucket_info = MAPPED_LABELS.get(prediction["label"], ["13", "other"])
             all_signal_outputs_list.append(("classification", bucket_info[1], float(prediction.get("score", 0.0))))
 
-        # Get base frames to extract extra signals from vid
-        # Per frame: (element has H x W x RGB(3))  
-        base_frames = get_base_frames(video_path)
-
-        # SIGNAL 2: OCR
-        ocr_text, ocr_quality = ocr_read_frames(base_frames, ocr_reader)
-        print(f"Raw_OCR: {ocr_text}")  
-
-        # SIGNAL 2: zero shot classfication OCR signal to ecom bucket
-        ocr_signal_bucket, zeroshot_conf = zero_shot_classification(bart_mnli, list(BUCKETS["buckets"].keys()), ocr_text)
-        ocr_conf = ocr_quality * zeroshot_conf
-        all_signal_outputs_list.append(("ocr", ocr_signal_bucket, ocr_conf))
-
         # SIGNAL 3: Video description and scaled conf since description conf could be wrong
-        print(f"Raw_description: {video_metadata['caption']}")   
+        logger.debug("Raw_description: %s", video_metadata["caption"])
         description_signal_bucket, description_zeroshot_conf = zero_shot_classification(bart_mnli, list(BUCKETS["buckets"].keys()), video_metadata["caption"])
         all_signal_outputs_list.append(("description", description_signal_bucket, description_zeroshot_conf))
 
-        # SIGNAL 4: Captioning video.
-        try:
-            vid_caption = capping_video(base_frames, caption_model)
-            print(f"Raw_vid_caption: {vid_caption}")
-            vid_caption_bucket, vid_caption_conf = zero_shot_classification(
-                bart_mnli,
-                list(BUCKETS["buckets"].keys()),
-                vid_caption,
-            )
-            all_signal_outputs_list.append(("vid_caption", vid_caption_bucket, vid_caption_conf))
-        except Exception as caption_error:
-            logger.warning("Video captioning skipped for %s: %s", vid_id, caption_error)
-
-        # SIGNAL 5: Object Detection
-        detected_objects = detect_objects_from_frames(base_frames, object_detector)
-        print(f"Raw_detected_objects: {detected_objects}") 
-        top_objects = get_top3_objects_min_conf(detected_objects)
-
-        for detected_object in top_objects:
-            object_detection_bucket, object_detection_conf = zero_shot_classification(bart_mnli, list(BUCKETS["buckets"].keys()), detected_object[0])
-            all_signal_outputs_list.append(("object_detection", object_detection_bucket, detected_object[1] * object_detection_conf))
+        # SIGNALS 2, 4, 5: frame based stages, cheapest first
+        # YOLO11n + a few short BART calls is far cheaper than EasyOCR or BLIP generation over every frame,
+        # and it can add the most weight, so running it first gives the cascade the best chance to stop early
+        frame_stages = [
+            ("object_detection", lambda frames: _object_detection_signals(frames, object_detector, bart_mnli, video_metadata)),
+            ("ocr", lambda frames: _ocr_signals(frames, ocr_reader, bart_mnli, video_metadata)),
+            ("vid_caption", lambda frames: _vid_caption_signals(vid_id, frames, caption_model, bart_mnli, video_metadata)),
+        ]
+
+        for i, (stage, run_stage) in enumerate(frame_stages):
+            if cascade:
+                remaining_max_weight = sum(CASCADE_STAGE_MAX_WEIGHT[name] for name, _ in frame_stages[i:])
+                if fusion_leader_is_final(all_signal_outputs_list, remaining_max_weight):
+                    skipped_stages = [name for name, _ in frame_stages[i:]]
+                    break
+            base_frames = base_frames_future.result()
+            with span(f"detection.signal.{stage}"):
+                all_signal_outputs_list.extend(run_stage(base_frames))
+
+        if skipped_stages:
+            if embedding_future is None:
+                base_frames_future.cancel()
+            logger.info("Cascade early exit for %s, skipped: %s", vid_id, skipped_stages)
+
+        with _cascade_stats_lock:
+            _cascade_stats["videos"] += 1
+            _cascade_stats["early_exits"] += 1 if skipped_stages else 0
+            for stage in skipped_stages:
+                _cascade_stats["skipped"][stage] += 1
 
         # Combine all signals outputs and weights fusion to pick best bucket
-        print(f"all_signal_outputs_list: {all_signal_outputs_list}")
+        logger.debug("all_signal_outputs_list: %s", all_signal_outputs_list)
         final_buckets_list = weighted_fusion(all_signal_outputs_list)
-        print(f"Final Bucket Selection: {final_buckets_list}")
+        if cascade:
+            # the early exit only guarantees the leader, keep the output the same whether or not it fired
+            final_buckets_list = final_buckets_list[:1]
+        logger.debug("Final Bucket Selection: %s", final_buckets_list)
 
         video_metadata["bucket_num"] = [BUCKETS["buckets"][b] for b in final_buckets_list] 
         video_metadata["bucket_name"] = final_buckets_list
@@ -98,17 +280,20 @@ def upload_video_service(
 
         # update parquet table
         out_path = update_parquet_table(video_metadata, "video")
+        add_to_catalog_index("video", dict(video_metadata))
+        if embedding_future is not None:
+            _store_visual_embedding("video", vid_id, embedding_future.result)
 
         status = "completed"
     except Exception as e:
-        print(f"Error during video analysis: {e}")
+        logger.exception("Error during video analysis of %s: %s", vid_id, e)
         status = "uploaded_successful_but_failed_detect_classify"
         out_path = None
 
-    return {**video_metadata, "status": status, "parquet_path": out_path}
+    return {**video_metadata, "status": status, "parquet_path": out_path, "skipped_stages": skipped_stages}
 
 def upload_product_service(
-    product_id, image, request_payload
+    product_id, image, request_payload, image_embedder=None
 ):
     status = "process"
 
@@ -128,6 +313,11 @@ def upload_product_service(
         product_path = upload_product_database(product_id, image)
         product_metadata["product_path"] = product_path
         out_path = update_parquet_table(product_metadata, "product")
+        add_to_catalog_index("product", dict(product_metadata))
+        if image_embedder is not None:
+            # the photo is embedded once here, the shop matches it against the frames of watched videos
+            _store_visual_embedding("product", product_id, lambda: embed_images([image], image_embedder)[0])
+        invalidate_products_cache()
         status = "completed"
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"failed_upload: {e}")
@@ -157,10 +347,12 @@ def update_user_interaction_service(
     watch_time_ms: int,
     skipped_quickly: bool = False,
     watched_50_pct: bool = False,
+    user_id: str = DEFAULT_USER_ID,
 ):
     
     
     user_interaction = {
+        "user_id": user_id,
         "video_id": video_id,
         "watch_time_ms": watch_time_ms,
         "skipped_quickly": skipped_quickly,
@@ -168,14 +360,31 @@ def update_user_interaction_service(
         "interaction_timestamp": datetime.now().isoformat(),
     }
     out_path = update_parquet_table(user_interaction, "user")
+    record_interaction(user_interaction)
+    record_co_engagement(user_interaction)
+    invalidate_user_products_cache(user_id)
+    on_interaction(user_id, video_id)
     return {**user_interaction, "parquet_path": out_path}
 
-def get_feed_service(n_recommended = 10):
-    """ Wrapper to get recommended video metadata dataframe and return as serialized list of dict"""
-    recommended_videos = video_recommendation(n_recommended)
-    return {"videos": recommended_videos}
+def get_feed_service(n_recommended = 10, user_id = DEFAULT_USER_ID, cursor = None):
+    """ Wrapper to get the next page of recommended video metadata as serialized list of dict plus the cursor of the page after it"""
+    return get_feed_page(n_recommended, user_id, cursor)
 
-def get_shop_service(n_recommended = 10):
+def get_shop_service(n_recommended = 10, user_id = DEFAULT_USER_ID):
     """ Wrapper to get recommended video metadata dataframe and return as serialized list of dict"""
-    recommended_products = product_recommendation(n_recommended)
+    recommended_products = get_shop_page(n_recommended, user_id)
     return {"products": recommended_products}
+
+def refresh_shop_service(user_id = DEFAULT_USER_ID):
+    """ Clears the user's cached shop page so the next get_shop_service call recommends new products"""
+    invalidate_user_products_cache(user_id)
+    refresh_shop_pages(user_id)
+    return {"status": "completed"}
+
+def get_shop_cache_stats_service():
+    """ Hit / miss / eviction counters of the shop recommendation cache"""
+    return get_products_cache_stats()
+
+def get_metrics_service():
+    """ Latency histograms of the instrumented steps and requests in the Prometheus text format"""
+    return render_prometheus()
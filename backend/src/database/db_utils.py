@@ -1,18 +1,33 @@
 import os
+import hashlib
 import pandas as pd
 import shutil
 import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
 import time
+import logging
 from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+from backend.src.instrumentation import instrumented
+
+logger = logging.getLogger(__name__)
 
 VIDEO_DIR = "data/videos"
 PRODUCT_DIR = "data/products"
 VIDEO_PARQUET_DIR = "data/video_parquet"
 PRODUCT_PARQUET_DIR = "data/product_parquet"
 USER_INTERACTION_PARQUET_DIR = "data/user_interaction_parquet"
+EMBEDDING_DIR = "data/embeddings"
+
+# streamed uploads are written in 1MB chunks (received chunks are buffered up to that size, each write is one
+# worker thread hop off the event loop); the header probe fires once this many bytes are on disk
+STREAM_CHUNK_SIZE = 1024 * 1024
+STREAM_HEADER_MIN_BYTES = 2 * 1024 * 1024
 
 
 ########################################## Upload and Update ##########################################
+@instrumented("storage.upload_video")
 def upload_video_database(vid_id, video):
     os.makedirs(VIDEO_DIR, exist_ok=True)
 
@@ -22,11 +37,101 @@ def upload_video_database(vid_id, video):
     video.file.seek(0)
 
     with open(video_path, "wb") as f:
-        shutil.copyfileobj(video.file, f)
+        shutil.copyfileobj(video.file, f, STREAM_CHUNK_SIZE)
+
+    return video_path
+
+
+def store_video_file(vid_id, source_path):
+    """
+    Stores a video file from local disk as VIDEO_DIR/<vid_id><ext>, the same path upload_video_database writes.
+    Hardlinked when source and VIDEO_DIR share a filesystem, copied otherwise. Used by offline backfills.
+    """
+    os.makedirs(VIDEO_DIR, exist_ok=True)
+
+    ext = os.path.splitext(source_path)[1].lower() or ".mp4"
+    video_path = os.path.join(VIDEO_DIR, f"{vid_id}{ext}")
+
+    if os.path.exists(video_path):
+        if os.path.samefile(source_path, video_path):
+            return video_path
+        # left over from an interrupted run
+        os.remove(video_path)
+    try:
+        os.link(source_path, video_path)
+    except OSError:
+        shutil.copyfile(source_path, video_path)
 
     return video_path
 
 
+def _write_chunk(f, hasher, data, flush):
+    """ Blocking part of stream_video_database, runs on a worker thread"""
+    f.write(data)
+    hasher.update(data)
+    if flush:
+        f.flush()
+
+
+async def stream_video_database(vid_id, filename, chunks, on_header=None):
+    """
+    Writes an async stream of byte chunks straight to the final video path as they arrive.
+    The sha256 content hash is computed in the same pass so the file is never re-read. Writes and hashing run on
+    the threadpool so a slow disk never blocks the event loop.
+
+    :param chunks: async iterator of bytes (e.g. starlette Request.stream()).
+    :param on_header: optional callback(video_path) fired once STREAM_HEADER_MIN_BYTES are flushed,
+                      so duration probing can start while the rest of the body is still uploading.
+    :return: (video_path, sha256 hex digest, total bytes written)
+    """
+    os.makedirs(VIDEO_DIR, exist_ok=True)
+
+    ext = os.path.splitext(filename or "")[1].lower() or ".mp4"
+    video_path = os.path.join(VIDEO_DIR, f"{vid_id}{ext}")
+
+    hasher = hashlib.sha256()
+    n_bytes = 0
+    header_fired = on_header is None
+    buffer = bytearray()
+
+    try:
+        with open(video_path, "wb") as f:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                buffer += chunk
+                n_bytes += len(chunk)
+                header_due = not header_fired and n_bytes >= STREAM_HEADER_MIN_BYTES
+                if len(buffer) < STREAM_CHUNK_SIZE and not header_due:
+                    continue
+
+                data, buffer = buffer, bytearray()
+                # write and hash on a worker thread, flushed when the probe is due so it sees everything received so far
+                await run_in_threadpool(_write_chunk, f, hasher, data, header_due)
+                if header_due:
+                    on_header(video_path)
+                    header_fired = True
+
+            if buffer:
+                await run_in_threadpool(_write_chunk, f, hasher, buffer, False)
+    except Exception:
+        # never leave a truncated video behind
+        if os.path.exists(video_path):
+            os.remove(video_path)
+        raise
+
+    if n_bytes == 0:
+        os.remove(video_path)
+        raise ValueError("Empty video upload")
+
+    # small uploads never reach the threshold, probe them now that the file is complete
+    if not header_fired:
+        on_header(video_path)
+
+    return video_path, hasher.hexdigest(), n_bytes
+
+
+@instrumented("storage.upload_product")
 def upload_product_database(product_id, image):
     os.makedirs(PRODUCT_DIR, exist_ok=True)
 
@@ -39,6 +144,7 @@ def upload_product_database(product_id, image):
     return product_path
 
 
+@instrumented("storage.update_parquet_table")
 def update_parquet_table(data_dict: dict, item_type: str) -> str:
     """
     Inserts a parquet file into its corresponding directory
@@ -69,6 +175,36 @@ def update_parquet_table(data_dict: dict, item_type: str) -> str:
     return out_path
 
 
+@instrumented("storage.update_parquet_table_batch")
+def update_parquet_table_batch(rows, item_type: str) -> str:
+    """
+    Inserts many rows as a single parquet file into its corresponding directory.
+    Used by offline backfills so thousands of items do not turn into thousands of tiny files.
+
+    :param rows: list of data dicts with the same keys update_parquet_table takes, or a DataFrame of them
+                 (generators writing millions of rows skip the per row dicts).
+    :param item_type: database type to be updated.
+    """
+    path_map = {
+        "video": VIDEO_PARQUET_DIR,
+        "product": PRODUCT_PARQUET_DIR,
+        "user": USER_INTERACTION_PARQUET_DIR,
+    }
+    path = path_map[item_type]
+
+    os.makedirs(path, exist_ok=True)
+    df = pd.DataFrame(rows)
+
+    file_name = f"part-batch-{time.time_ns()}.parquet"
+    out_path = os.path.join(path, file_name)
+    # write to a hidden temp name first (skipped by directory reads) so a crashed run never leaves a half written part behind
+    tmp_path = os.path.join(path, f".{file_name}.tmp")
+    df.to_parquet(tmp_path, engine="pyarrow", index=False)
+    os.replace(tmp_path, out_path)
+
+    return out_path
+
+
 ########################################## Download ##########################################
 def download_video(video_id: str):
     for fname in os.listdir(VIDEO_DIR):
@@ -77,6 +213,7 @@ def download_video(video_id: str):
     raise FileNotFoundError(f"Video {video_id} not found")
 
 
+@instrumented("storage.download_video_metadata")
 def download_video_metadata(video_id: str):
     df = download_all_videos_metadata()
     row = df[df["video_id"] == video_id]
@@ -97,15 +234,17 @@ def download_product(product_id: str):
     return path
 
 
+@instrumented("storage.download_product_metadata")
 def download_product_metadata(product_id: str):
     df = pd.read_parquet(PRODUCT_PARQUET_DIR)
     row = df[df["product_id"] == product_id]
-    print(row)
+    logger.debug("product metadata %s: %s", product_id, row)
     if row.empty:
         raise FileNotFoundError(f"Product metadata {product_id} not found")
     return row.iloc[0].to_dict()
 
 
+@instrumented("storage.download_all_videos_metadata")
 def download_all_videos_metadata():
     parquet_dir = VIDEO_PARQUET_DIR
     dfs = []
@@ -132,7 +271,11 @@ def download_all_videos_metadata():
     return combined
 
 
+# interactions logged before per-user state have no user_id, they belong to this user
+DEFAULT_USER_ID = "default"
+
 _INTERACTION_COLUMNS = [
+    "user_id",
     "video_id",
     "watch_time_ms",
     "skipped_quickly",
@@ -141,23 +284,87 @@ _INTERACTION_COLUMNS = [
 ]
 
 
-def download_user_interactions() -> pd.DataFrame:
+@instrumented("storage.download_user_interactions")
+def download_user_interactions(user_id: str = None) -> pd.DataFrame:
+    """
+    Interaction log, all users or only user_id's rows.
+
+    :param user_id: if given only this user's interactions are returned (rows without user_id count as DEFAULT_USER_ID)
+    """
     if not os.path.exists(USER_INTERACTION_PARQUET_DIR):
         return pd.DataFrame(columns=_INTERACTION_COLUMNS)
 
-    df = pd.read_parquet(USER_INTERACTION_PARQUET_DIR)
+    # files written before user_id existed lack the column, without the unified schema
+    # read_parquet would take the first file's schema and silently drop user_id everywhere
+    fragments = list(ds.dataset(USER_INTERACTION_PARQUET_DIR, format="parquet").get_fragments())
+    if not fragments:
+        return pd.DataFrame(columns=_INTERACTION_COLUMNS)
+    schema = pa.unify_schemas([fragment.physical_schema for fragment in fragments])
+
+    df = pd.read_parquet(USER_INTERACTION_PARQUET_DIR, schema=schema)
     if df.empty:
         return pd.DataFrame(columns=_INTERACTION_COLUMNS)
 
-    for col, default in [("skipped_quickly", False), ("watched_50_pct", False)]:
+    for col, default in [("user_id", DEFAULT_USER_ID), ("skipped_quickly", False), ("watched_50_pct", False)]:
         if col not in df.columns:
             df[col] = default
+    df["user_id"] = df["user_id"].fillna(DEFAULT_USER_ID)
+
+    if user_id is not None:
+        df = df[df["user_id"] == user_id].reset_index(drop=True)
 
     return df
 
 
+@instrumented("storage.download_all_products_metadata")
 def download_all_products_metadata() -> pd.DataFrame:
     df = pd.read_parquet(PRODUCT_PARQUET_DIR)
     if df.empty:
         raise FileNotFoundError(f"Product metadata not found")
     return df
+
+
+########################################## Embeddings ##########################################
+def _embedding_paths(index_name: str, dim: int):
+    # the dimension is part of the name so a changed encoder never reads rows of the old width
+    base = os.path.join(EMBEDDING_DIR, f"{index_name}-{dim}d")
+    return f"{base}.f32", f"{base}_ids.txt"
+
+
+def download_embedding_ids(index_name: str, dim: int) -> list[str]:
+    """ Ids of the stored rows of an embedding index ("video", "product-visual", ...), in row order"""
+    matrix_path, ids_path = _embedding_paths(index_name, dim)
+    if not os.path.exists(ids_path) or not os.path.exists(matrix_path):
+        return []
+    with open(ids_path, "r", encoding="utf-8") as f:
+        ids = f.read().splitlines()
+    # rows are written before their ids, a row without an id is an interrupted append and is ignored
+    return ids[: os.path.getsize(matrix_path) // (4 * dim)]
+
+
+def open_embedding_matrix(index_name: str, dim: int, n_rows: int) -> np.ndarray:
+    """ Read only memory map over the first n_rows stored embeddings (float32, n_rows x dim)"""
+    if n_rows == 0:
+        return np.empty((0, dim), dtype=np.float32)
+    matrix_path, _ = _embedding_paths(index_name, dim)
+    return np.memmap(matrix_path, dtype=np.float32, mode="r", shape=(n_rows, dim))
+
+
+@instrumented("storage.update_embeddings")
+def update_embeddings(index_name: str, ids: list[str], vectors: np.ndarray, n_rows: int):
+    """
+    Appends embedding rows and their ids.
+
+    :param n_rows: rows already stored (from download_embedding_ids), bytes past them left by an interrupted append are cut off first
+    """
+    matrix_path, ids_path = _embedding_paths(index_name, vectors.shape[1])
+    os.makedirs(EMBEDDING_DIR, exist_ok=True)
+
+    row_bytes = 4 * vectors.shape[1]
+    with open(matrix_path, "ab") as f:
+        f.truncate(n_rows * row_bytes)
+        f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+    if os.path.exists(ids_path) and n_rows == 0:
+        os.remove(ids_path)
+    with open(ids_path, "a", encoding="utf-8") as f:
+        f.write("".join(f"{item_id}\n" for item_id in ids))
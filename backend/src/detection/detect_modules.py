@@ -1,15 +1,27 @@
+import logging
+import numpy as np
 from PIL import Image
 from backend.src.detection.detect_utils import clean_input
+from backend.src.instrumentation import instrumented
 
+logger = logging.getLogger(__name__)
 
+# YOLO11n object stage: input size (down from the 640 default), confidence floor and max detections per frame
+YOLO_IMGSZ = 320
+YOLO_CONF = 0.25
+YOLO_MAX_DET = 50
+
+
+@instrumented("detection.classification")
 def classify_video_genre(genre_clf, video_path, top_k: int = 5):
     if not video_path:
         raise ValueError("video_path is required")
     preds = genre_clf(video_path, top_k=top_k)
-    print(f"classification_prediction: {preds}")
+    logger.debug("classification_prediction: %s", preds)
     return preds
 
 
+@instrumented("detection.ocr")
 def ocr_read_frames(base_frames, reader, min_conf=0.4):
     texts = []
     confs = []
@@ -31,13 +43,50 @@ def ocr_read_frames(base_frames, reader, min_conf=0.4):
     return ocr_text, ocr_quality
 
 
+@instrumented("detection.ocr_batched")
+def ocr_read_frames_batched(frames, reader, batch_size=8):
+    """
+    OCR over frames from many videos. EasyOCR only batches equally sized images,
+    so frames are grouped by shape and each group goes through readtext_batched.
+
+    :return: list of raw readtext results, one per frame in input order
+    """
+    results = [None] * len(frames)
+    by_shape = {}
+    for i, frame in enumerate(frames):
+        by_shape.setdefault(frame.shape, []).append(i)
+
+    for idxs in by_shape.values():
+        group_results = reader.readtext_batched([frames[i] for i in idxs], batch_size=batch_size)
+        for i, frame_results in zip(idxs, group_results):
+            results[i] = frame_results
+
+    return results
+
+
+def combine_ocr_results(frame_results, min_conf=0.4):
+    """ Same text / quality reduction as ocr_read_frames over already computed readtext results"""
+    texts = []
+    confs = []
+    for results in frame_results:
+        for _, text, conf in results:
+            if conf >= min_conf and text.strip():
+                texts.append(text.strip())
+                confs.append(float(conf))
+
+    ocr_text = " ".join(texts)
+    ocr_quality = sum(confs) / len(confs) if confs else 0.0
+    return ocr_text, ocr_quality
+
+
+@instrumented("detection.zero_shot")
 def zero_shot_classification(bart_mnli, buckets, input_txt):
 
     if not input_txt or not input_txt.strip():
         return ("other", 0.0)
 
     cleaned_input = clean_input(input_txt)
-    print(f"Raw input before zeroshot: {input_txt}, cleaned_input: {cleaned_input}")
+    logger.debug("Raw input before zeroshot: %s, cleaned_input: %s", input_txt, cleaned_input)
 
     if not cleaned_input:
         return ("other", 0.0)
@@ -57,6 +106,39 @@ def zero_shot_classification(bart_mnli, buckets, input_txt):
     return (bucket_key, confidence)
 
 
+@instrumented("detection.zero_shot_batched")
+def zero_shot_classification_batched(bart_mnli, buckets, input_txts, batch_size=16):
+    """
+    zero_shot_classification over many texts with a single pipeline call.
+    Empty texts and texts with no real words get ("other", 0.0) without reaching the model.
+    """
+    outputs = [("other", 0.0)] * len(input_txts)
+    to_classify = [
+        i for i, input_txt in enumerate(input_txts)
+        if input_txt and input_txt.strip() and clean_input(input_txt)
+    ]
+    if not to_classify:
+        return outputs
+
+    results = bart_mnli(
+        [input_txts[i] for i in to_classify],
+        buckets,
+        multi_label=True,
+        hypothesis_template="This item belongs to the shopping category: {}",
+        batch_size=batch_size,
+    )
+    if isinstance(results, dict):
+        results = [results]
+
+    for i, result in zip(to_classify, results):
+        bucket_key = result["labels"][0]
+        if bucket_key in buckets:
+            outputs[i] = (bucket_key, float(result["scores"][0]))
+
+    return outputs
+
+
+@instrumented("detection.caption")
 def capping_video(base_frames, caption_model, caption_mode="best"):
     if len(base_frames) == 0:
         return ""
@@ -88,20 +170,84 @@ def capping_video(base_frames, caption_model, caption_mode="best"):
     raise ValueError("Invalid caption_mode")
 
 
-def detect_objects_from_frames(frames, object_detector):
-    if not frames:
+@instrumented("detection.caption_batched")
+def caption_frames_batched(frames, caption_model, batch_size=8):
+    """ BLIP captions for frames from many videos in one pipeline call, one caption per frame"""
+    if len(frames) == 0:
         return []
 
-    results = object_detector(frames, verbose=False)
+    images = [Image.fromarray(frame) for frame in frames]
+    results = caption_model(images=images, text=[""] * len(images), batch_size=batch_size)
 
-    detected = []
+    return [result[0]["generated_text"].strip() for result in results]
 
-    for r in results:
-        for box in r.boxes:
-            cls_id = int(box.cls[0])
-            label = r.names[cls_id]
-            conf = float(box.conf[0])
 
-            detected.append((label, conf))
+@instrumented("detection.embed_images")
+def embed_images(images, image_embedder, batch_size=8):
+    """
+    L2 normalized pooled embeddings (n x dim float32) of numpy RGB frames or PIL images, e.g. a product photo
+    and the sampled frames of a video land in the same space
+    """
+    if len(images) == 0:
+        return np.empty((0, 0), dtype=np.float32)
+
+    pil_images = [Image.fromarray(image) if isinstance(image, np.ndarray) else image.convert("RGB") for image in images]
+    outputs = image_embedder(pil_images, pool=True, batch_size=batch_size)
+
+    vectors = np.array([np.asarray(output, dtype=np.float32).reshape(-1) for output in outputs])
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
 
-    return detected
+def embed_video_frames(frames, image_embedder, batch_size=8):
+    """ One embedding for a video: the normalized mean of its frame embeddings, None without frames"""
+    frame_vectors = embed_images(frames, image_embedder, batch_size)
+    if len(frame_vectors) == 0:
+        return None
+    mean = frame_vectors.mean(axis=0)
+    norm = np.linalg.norm(mean)
+    return mean / norm if norm > 0 else None
+
+
+@instrumented("detection.objects")
+def detect_objects_per_frame(frames, object_detector, imgsz=YOLO_IMGSZ, conf=YOLO_CONF, max_det=YOLO_MAX_DET):
+    """
+    Runs YOLO on all frames in one batched call.
+
+    :return: list with one (labels, confs) numpy array pair per frame
+    """
+    if not frames:
+        return []
+
+    results = object_detector(frames, verbose=False, imgsz=imgsz, conf=conf, max_det=max_det)
+
+    per_frame = []
+
+    for r in results:
+        if r.boxes is None or len(r.boxes) == 0:
+            per_frame.append((np.empty(0, dtype=object), np.empty(0, dtype=np.float32)))
+            continue
+        # whole tensors per result instead of converting box by box
+        cls_ids = r.boxes.cls.cpu().numpy().astype(np.int64)
+        # name lookup only once per distinct class in this frame
+        unique_ids, inverse = np.unique(cls_ids, return_inverse=True)
+        labels = np.array([r.names[int(i)] for i in unique_ids], dtype=object)[inverse]
+        per_frame.append((labels, r.boxes.conf.cpu().numpy().astype(np.float32)))
+
+    return per_frame
+
+
+def detect_objects_from_frames(frames, object_detector, imgsz=YOLO_IMGSZ, conf=YOLO_CONF, max_det=YOLO_MAX_DET):
+    """
+    Runs YOLO on all frames in one batched call.
+
+    :return: (labels, confs) numpy arrays with one entry per detection across all frames
+    """
+    per_frame = detect_objects_per_frame(frames, object_detector, imgsz, conf, max_det)
+    if not per_frame:
+        return np.empty(0, dtype=object), np.empty(0, dtype=np.float32)
+
+    return (
+        np.concatenate([labels for labels, _ in per_frame]),
+        np.concatenate([confs for _, confs in per_frame]),
+    )
@@ -1,9 +1,13 @@
 import json
+import logging
 import subprocess
 import numpy as np
 import cv2
 import nltk
 from nltk.corpus import words
+from backend.src.instrumentation import instrumented
+
+logger = logging.getLogger(__name__)
 
 try:
     words.words()
@@ -15,6 +19,7 @@ def load_json(filepath: str):
     with open(filepath, 'r', encoding='utf-8') as file:
         return json.load(file)
 
+@instrumented("detection.duration_probe")
 def get_video_duration_ms_from_path(video_path: str) -> int:
     cap = cv2.VideoCapture(video_path)
 
@@ -105,8 +110,116 @@ def _get_base_frames_with_ffmpeg(video_path: str, num_frames: int):
 
     return frames
 
-# extract n frames for uniform sampling
-def get_base_frames(video_path: str, num_frames: int = 10):
+# scene sampling: how many frames per second are scored, the size they are scored at and the score counted as a cut
+SCENE_ANALYSIS_FPS = 4.0
+SCENE_ANALYSIS_SIZE = (64, 36)
+SCENE_CHANGE_THRESHOLD = 0.25
+
+
+def _frame_signature(frame_bgr):
+    # tiny grayscale thumbnail + normalized 32 bin histogram, cheap enough to run on every analysed frame
+    small = cv2.resize(frame_bgr, SCENE_ANALYSIS_SIZE, interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    hist = cv2.calcHist([gray], [0], None, [32], [0, 256]).ravel()
+    hist /= max(hist.sum(), 1.0)
+    return gray.astype(np.float32), hist
+
+
+def get_scene_change_scores(video_path: str, analysis_fps: float = SCENE_ANALYSIS_FPS):
+    """
+    Low resolution decode pass that scores how different each analysed frame is from the previous one.
+
+    Frames in between analysed ones are only grabbed (no retrieve / colour conversion).
+    Score is the max of histogram distance and mean absolute pixel difference, both in [0, 1].
+
+    :return: (frame_idxs, scores) int and float32 arrays of the same length, scores[0] is always 0
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError("Could not open video")
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    stride = max(1, int(round(fps / analysis_fps)))
+
+    frame_idxs = []
+    scores = []
+    prev = None
+    idx = 0
+
+    while True:
+        if idx % stride == 0:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            gray, hist = _frame_signature(frame)
+            if prev is None:
+                score = 0.0
+            else:
+                hist_dist = 0.5 * float(np.abs(hist - prev[1]).sum())
+                pixel_dist = float(np.mean(np.abs(gray - prev[0]))) / 255.0
+                score = max(hist_dist, pixel_dist)
+            prev = (gray, hist)
+            frame_idxs.append(idx)
+            scores.append(score)
+        elif not cap.grab():
+            break
+        idx += 1
+
+    cap.release()
+    return np.asarray(frame_idxs, dtype=np.int64), np.asarray(scores, dtype=np.float32)
+
+
+def select_scene_frame_idxs(frame_idxs, scores, num_frames: int, threshold: float = SCENE_CHANGE_THRESHOLD):
+    """
+    Picks up to num_frames representative frame idxs: the strongest cuts above threshold split the video
+    into scenes and the middle frame of each scene is used (cut frames themselves are often transition blur).
+    A static video therefore yields a single frame and a fast cut video spends all num_frames on distinct scenes.
+    """
+    if len(frame_idxs) == 0 or num_frames <= 0:
+        return []
+
+    cut_positions = np.flatnonzero(scores >= threshold)
+    if len(cut_positions) > num_frames - 1:
+        # keep only the strongest cuts, then restore time order
+        strongest = np.argsort(scores[cut_positions], kind="stable")[::-1][: num_frames - 1]
+        cut_positions = np.sort(cut_positions[strongest])
+
+    # scene i spans analysed positions [starts[i], ends[i])
+    starts = np.concatenate(([0], cut_positions))
+    ends = np.concatenate((cut_positions, [len(frame_idxs)]))
+    mids = (starts + ends - 1) // 2
+
+    return frame_idxs[mids].astype(int).tolist()
+
+
+def _read_frames_at(video_path: str, idxs):
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError("Could not open video")
+
+    frames = []
+    for idx in idxs:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+        ok, frame = cap.read()
+        if ok:
+            frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+    cap.release()
+    return frames
+
+
+# extract n frames for uniform sampling, or up to n frames at scene boundaries with mode="scene"
+@instrumented("detection.decode_frames")
+def get_base_frames(video_path: str, num_frames: int = 10, mode: str = "uniform"):
+
+    if mode == "scene":
+        frame_idxs, scores = get_scene_change_scores(video_path)
+        scene_frames = _read_frames_at(video_path, select_scene_frame_idxs(frame_idxs, scores, num_frames))
+        if scene_frames:
+            return scene_frames
+        # decode pass found nothing usable, fall through to uniform / ffmpeg sampling
+    elif mode != "uniform":
+        raise ValueError("Invalid frame sampling mode")
 
     # open vid
     cap = cv2.VideoCapture(video_path)
@@ -144,7 +257,7 @@ def get_base_frames(video_path: str, num_frames: int = 10):
 
     return _get_base_frames_with_ffmpeg(video_path, num_frames)
 
-def weighted_fusion(all_signal_outputs):
+def _fusion_scores(all_signal_outputs):
     scores = {}
     
     for signal_name, bucket_name, confidence in all_signal_outputs:
@@ -154,10 +267,29 @@ def weighted_fusion(all_signal_outputs):
         weight = confidence if confidence else 0.1
         scores[bucket_name] = scores.get(bucket_name, 0) + weight
 
+    return scores
+
+def fusion_leader_is_final(all_signal_outputs, remaining_max_weight):
+    """
+    True when the bucket leading weighted_fusion so far cannot be overtaken: even if every remaining
+    signal put its maximum weight on the runner up (or on a bucket not scored yet) it would still be behind.
+    Only the leader is settled, the remaining signals can still add buckets to weighted_fusion's multi-label list.
+    """
+    scores = _fusion_scores(all_signal_outputs)
+    if not scores:
+        return False
+
+    ranked = sorted(scores.values(), reverse=True)
+    runner_up = ranked[1] if len(ranked) > 1 else 0.0
+    return ranked[0] - runner_up > remaining_max_weight
+
+def weighted_fusion(all_signal_outputs):
+    scores = _fusion_scores(all_signal_outputs)
+
     if not scores:
         return ["other"]
 
-    print(f"Fusion Result: {scores}")
+    logger.debug("Fusion Result: %s", scores)
 
     # Multi labels 
     
@@ -200,14 +332,28 @@ def clean_input(text):
 
 def get_top3_objects_min_conf(detected, min_conf=0.0):
     # group by label and pick max conf of each label then pick BEST 3 LABELS
-    IGNORE = {
+    IGNORE = [
         "person", "face", "hand", "foot",
         "wall", "floor", "ceiling",
-    }
-
-    result = {}
-    for label, conf in detected:
-        if label not in IGNORE and conf >= min_conf:
-            result[label] = max(result.get(label, 0.0), conf)
-
-    return sorted(result.items(), key=lambda x: x[1], reverse=True)[:3]
+    ]
+
+    # detected is (labels, confs) arrays from detect_objects_from_frames, a list of (label, conf) also works
+    if isinstance(detected, tuple):
+        labels, confs = detected
+    else:
+        labels = [label for label, _ in detected]
+        confs = [conf for _, conf in detected]
+    labels = np.asarray(labels, dtype=object)
+    confs = np.asarray(confs, dtype=np.float32)
+
+    keep = ~np.isin(labels, IGNORE) & (confs >= min_conf)
+    labels, confs = labels[keep], confs[keep]
+    if labels.size == 0:
+        return []
+
+    unique_labels, label_idx = np.unique(labels.astype(str), return_inverse=True)
+    best_conf = np.full(len(unique_labels), -np.inf, dtype=np.float32)
+    np.maximum.at(best_conf, label_idx, confs)
+
+    top = np.argsort(-best_conf, kind="stable")[:3]
+    return [(str(unique_labels[i]), float(best_conf[i])) for i in top]
@@ -0,0 +1,199 @@
+"""
+Latency instrumentation: timing spans around detection stages, storage reads / writes and recommender steps.
+
+Every finished span is counted into an in-process histogram (one per span name), and every HTTP request into one per
+method / route / status; GET /metrics serves them in the Prometheus text format. A sampled share of requests
+(REQUEST_LOG_SAMPLE_RATE) is additionally logged as one JSON line with the spans that ran inside it.
+
+With METRICS_ENABLED off a span is a flag check: span() hands back a shared no-op context manager and an
+@instrumented function calls straight through.
+"""
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import random
+import threading
+import time
+
+METRICS_ENABLED = True
+# share of requests logged as JSON with their spans, 0 = none
+REQUEST_LOG_SAMPLE_RATE = 0.01
+
+# histogram upper bounds in seconds: sub-millisecond storage and cache hits up to a minute long video categorization
+LATENCY_BUCKETS_S = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+SPAN_METRIC = "viscart_span_duration_seconds"
+REQUEST_METRIC = "viscart_request_duration_seconds"
+_METRIC_HELP = {
+    SPAN_METRIC: "Duration of instrumented detection, storage and recommendation steps",
+    REQUEST_METRIC: "Duration of HTTP requests by route",
+}
+
+# (metric, labels) -> [per bucket counts (last one is +Inf), sum of seconds]
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+# spans of the current sampled request (None outside one); lists are shared with threads that copy the context
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+# sampled requests go to stderr as bare JSON lines, whatever the root logging configuration is
+request_logger = logging.getLogger("backend.requests")
+if not request_logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    request_logger.addHandler(_handler)
+    request_logger.setLevel(logging.INFO)
+    request_logger.propagate = False
+
+
+def _observe(metric: str, labels: tuple, seconds: float):
+    key = (metric, labels)
+    with _histograms_lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(LATENCY_BUCKETS_S) + 1), 0.0]
+        histogram[0][bisect.bisect_left(LATENCY_BUCKETS_S, seconds)] += 1
+        histogram[1] += seconds
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        _observe(SPAN_METRIC, (("span", self.name),), seconds)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append({"span": self.name, "ms": round(seconds * 1e3, 3), "error": exc_type is not None})
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str):
+    """
+    Times the with block into the histogram of `name`
+
+    :param name: dotted step name, e.g. "detection.ocr" or "storage.download_user_interactions"
+    """
+    if not METRICS_ENABLED:
+        return _NOOP_SPAN
+    return _Span(name)
+
+
+def instrumented(name: str):
+    """ Decorator form of span(): every call of the function is one span"""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not METRICS_ENABLED:
+                return fn(*args, **kwargs)
+            with _Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def start_request():
+    """
+    Called when a request comes in. Decides whether the request is sampled for the JSON log and,
+    if so, starts collecting its spans.
+
+    :return: handle for finish_request (None when the request is not sampled)
+    """
+    if not METRICS_ENABLED or REQUEST_LOG_SAMPLE_RATE <= 0 or random.random() >= REQUEST_LOG_SAMPLE_RATE:
+        return None
+    spans = []
+    return spans, _request_spans.set(spans)
+
+
+def finish_request(method: str, route: str, status: int, seconds: float, sampled=None):
+    """
+    Counts a finished request into the request histogram and logs it with its spans if it was sampled
+
+    :param route: route template (e.g. /video/{video_id}), not the raw path, so the label set stays small
+    :param sampled: the handle start_request returned
+    """
+    if not METRICS_ENABLED:
+        return
+    _observe(REQUEST_METRIC, (("method", method), ("route", route), ("status", str(status))), seconds)
+    if sampled is None:
+        return
+    spans, token = sampled
+    _request_spans.reset(token)
+    request_logger.info(json.dumps({
+        "method": method,
+        "route": route,
+        "status": status,
+        "ms": round(seconds * 1e3, 3),
+        "spans": spans,
+    }))
+
+
+def _format_labels(labels: tuple, le: str = None) -> str:
+    pairs = [f'{key}="{_escape(value)}"' for key, value in labels]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_prometheus() -> str:
+    """ All histograms in the Prometheus text exposition format (version 0.0.4)"""
+    with _histograms_lock:
+        snapshot = {key: (list(counts), total) for key, (counts, total) in _histograms.items()}
+
+    lines = []
+    for metric, help_text in _METRIC_HELP.items():
+        series = sorted((labels, value) for (name, labels), value in snapshot.items() if name == metric)
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} histogram")
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS_S + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{metric}_bucket{_format_labels(labels, le)} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {total!r}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def get_span_stats() -> dict:
+    """ Call count and mean milliseconds per span name since startup (or the last reset)"""
+    with _histograms_lock:
+        return {
+            dict(labels)["span"]: {"calls": sum(counts), "mean_ms": total * 1e3 / max(sum(counts), 1)}
+            for (metric, labels), (counts, total) in _histograms.items()
+            if metric == SPAN_METRIC
+        }
+
+
+def reset_metrics():
+    with _histograms_lock:
+        _histograms.clear()
@@ -0,0 +1,115 @@
+import numpy as np
+from backend.src.product_recommendation.scoring import explode_buckets
+
+# Beta(1, 1) prior of every arm
+BANDIT_PRIOR = (1.0, 1.0)
+
+
+def interaction_outcomes(skipped_quickly, watched_50_pct) -> np.ndarray:
+    """ Bandit reward of every interaction: watched past 50% without a quick skip"""
+    return np.asarray(watched_50_pct, dtype=bool) & ~np.asarray(skipped_quickly, dtype=bool)
+
+
+class BucketBandit:
+    """
+    Thompson sampling over the buckets of one user. Every bucket is an arm with a Beta posterior over the chance
+    that a video of it is watched past 50% (successes / failures from the interaction log), plus one exploration arm
+    whose outcomes are the interactions with a bucket the user had never seen before, i.e. how well exploring
+    works for this user.
+
+    Per page slot the exploration arm draw competes with the best draw of the buckets the user has seen; slots it
+    wins are explored, in the bucket with the highest draw among all the others (seen or not, a bucket never seen
+    draws from the prior). Few or mixed outcomes give wide posteriors and more exploration, it shrinks as the seen
+    buckets collect consistent outcomes but never stops: any bucket keeps a chance to beat the slot's best one.
+    """
+
+    def __init__(self, successes=None, failures=None, explore_successes: float = 0.0, explore_failures: float = 0.0):
+        # replaced as a whole on update so a request sampling meanwhile sees one consistent posterior
+        self._posterior = (
+            np.zeros(0) if successes is None else np.asarray(successes, dtype=np.float64),
+            np.zeros(0) if failures is None else np.asarray(failures, dtype=np.float64),
+            float(explore_successes),
+            float(explore_failures),
+        )
+
+    @classmethod
+    def from_interactions(cls, video_idx, skipped_quickly, watched_50_pct, interaction_epoch_s, bucket_ptr, bucket_ids,
+                          **_) -> "BucketBandit":
+        """ Posterior after the whole coded interaction log, same as update() for every row in time order"""
+        video_idx = np.asarray(video_idx, dtype=np.int64)
+        epoch_s = np.asarray(interaction_epoch_s, dtype=np.float64)
+        reward = interaction_outcomes(skipped_quickly, watched_50_pct)
+
+        # time order, rows without a timestamp first
+        order = np.argsort(np.nan_to_num(epoch_s, nan=-np.inf), kind="stable")
+        order = order[video_idx[order] >= 0]
+        entry_row, entry_bucket = explode_buckets(video_idx[order], bucket_ptr, bucket_ids)
+        if len(entry_bucket) == 0:
+            return cls()
+
+        n_buckets = int(entry_bucket.max()) + 1
+        entry_reward = reward[order][entry_row]
+        successes = np.bincount(entry_bucket, weights=entry_reward, minlength=n_buckets)
+        failures = np.bincount(entry_bucket, weights=~entry_reward, minlength=n_buckets)
+
+        # a row explores when it is the first row of every one of its buckets
+        first_row = np.full(n_buckets, len(order), dtype=np.int64)
+        np.minimum.at(first_row, entry_bucket, entry_row)
+        seen_before = np.bincount(entry_row, weights=first_row[entry_bucket] != entry_row, minlength=len(order))
+        explored = (seen_before == 0) & (np.bincount(entry_row, minlength=len(order)) > 0)
+        explore_successes = float(np.count_nonzero(explored & reward[order]))
+        return cls(successes, failures, explore_successes, float(np.count_nonzero(explored)) - explore_successes)
+
+    def update(self, buckets, reward: bool):
+        """ One interaction on a video in buckets"""
+        buckets = np.asarray(buckets, dtype=np.int64)
+        if len(buckets) == 0:
+            return
+        successes, failures, explore_successes, explore_failures = self._posterior
+        n_buckets = int(buckets.max()) + 1
+        if n_buckets > len(successes):
+            successes = np.pad(successes, (0, n_buckets - len(successes)))
+            failures = np.pad(failures, (0, n_buckets - len(failures)))
+        else:
+            # copied, the posterior tuple a request may be sampling from is never changed in place
+            successes, failures = successes.copy(), failures.copy()
+
+        if not np.any(successes[buckets] + failures[buckets]):
+            explore_successes += float(reward)
+            explore_failures += float(not reward)
+        np.add.at(successes if reward else failures, buckets, 1.0)
+        self._posterior = (successes, failures, explore_successes, explore_failures)
+
+    def explore_slots(self, n: int, available_buckets, rng) -> np.ndarray:
+        """
+        Thompson draw for a page of n slots
+
+        :param available_buckets: buckets the catalog can serve
+        :return: the bucket of every exploration slot (its length is the exploration budget)
+        """
+        available_buckets = np.asarray(available_buckets, dtype=np.int64)
+        if n <= 0 or len(available_buckets) == 0:
+            return np.empty(0, dtype=np.int64)
+        successes, failures, explore_successes, explore_failures = self._posterior
+        n_buckets = max(len(successes), int(available_buckets.max()) + 1)
+        successes = np.pad(successes, (0, n_buckets - len(successes)))
+        failures = np.pad(failures, (0, n_buckets - len(failures)))
+        seen = (successes + failures)[available_buckets] > 0
+        prior_a, prior_b = BANDIT_PRIOR
+
+        # one draw per slot and bucket
+        draws = rng.beta(
+            prior_a + successes[available_buckets], prior_b + failures[available_buckets], size=(n, len(available_buckets))
+        )
+        if not seen.any():
+            return available_buckets[draws.argmax(axis=1)]
+        if len(available_buckets) == 1:
+            # nothing to explore besides the one bucket the user knows
+            return np.empty(0, dtype=np.int64)
+
+        best_seen = np.where(seen, draws, -np.inf).argmax(axis=1)
+        explored = rng.beta(prior_a + explore_successes, prior_b + explore_failures, size=n) > draws[np.arange(n), best_seen]
+        # an explored slot goes to the best draw of every bucket but the slot's best seen one
+        draws = draws[explored]
+        draws[np.arange(len(draws)), best_seen[explored]] = -np.inf
+        return available_buckets[draws.argmax(axis=1)]
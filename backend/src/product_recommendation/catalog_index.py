@@ -0,0 +1,378 @@
+import itertools
+import threading
+import numpy as np
+import pandas as pd
+from backend.src.database.db_utils import download_all_videos_metadata, download_all_products_metadata
+from backend.src.product_recommendation.sampling import AliasSampler
+
+# rejection draws per requested item before sample_weighted switches to the exhaustive walk
+REJECTION_ATTEMPTS_FACTOR = 4
+
+
+def _json_safe(value):
+    # list columns (bucket_num, bucket_name, detected_objects) come back from parquet as numpy arrays
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return None
+    return value
+
+
+def _df_to_records(df: pd.DataFrame) -> list[dict]:
+    """Convert DataFrame to records replacing all NA/NaN variants with None and arrays with lists for JSON safety."""
+    return [{k: _json_safe(v) for k, v in rec.items()} for rec in df.to_dict(orient="records")]
+
+
+def _as_bucket_list(bucket_num) -> list[int]:
+    """ videos store bucket_num as a list of zero padded strings, products as a single string"""
+    if bucket_num is None:
+        return []
+    if isinstance(bucket_num, (list, tuple, np.ndarray)):
+        return [int(b) for b in bucket_num]
+    return [int(bucket_num)]
+
+
+class _GrowableIntArray:
+    """ Contiguous int64 buffer with amortized O(1) append, view() is the filled part"""
+
+    def __init__(self, capacity: int = 16):
+        self._data = np.empty(max(capacity, 1), dtype=np.int64)
+        self._size = 0
+
+    @classmethod
+    def from_array(cls, values) -> "_GrowableIntArray":
+        values = np.asarray(values, dtype=np.int64)
+        buffer = cls(2 * len(values))
+        buffer._data[: len(values)] = values
+        buffer._size = len(values)
+        return buffer
+
+    def append(self, value: int):
+        if self._size == len(self._data):
+            grown = np.empty(len(self._data) * 2, dtype=np.int64)
+            grown[: self._size] = self._data[: self._size]
+            self._data = grown
+        self._data[self._size] = value
+        self._size += 1
+
+    def view(self) -> np.ndarray:
+        return self._data[: self._size]
+
+    def __len__(self):
+        return self._size
+
+
+class _LazyPermutation:
+    """
+    Fisher-Yates shuffle of range(n) that is only materialized for the positions actually drawn,
+    so drawing k distinct values costs O(k) whatever n is.
+    """
+
+    def __init__(self, n: int):
+        self.remaining = n
+        self._swaps = {}
+
+    def draw(self, rng) -> int:
+        j = int(rng.integers(self.remaining))
+        last = self.remaining - 1
+        value = self._swaps.get(j, j)
+        self._swaps[j] = self._swaps.get(last, last)
+        self.remaining -= 1
+        return value
+
+
+class PositionBitmap:
+    """
+    Compact set of catalog positions, one bit per item (125 KB per million videos).
+    Supports `pos in bitmap` for the samplers and a vectorized contains() for whole position arrays.
+    """
+
+    def __init__(self, n_items: int = 0):
+        self._bits = np.zeros((max(n_items, 1) + 7) // 8, dtype=np.uint8)
+        self._count = 0
+
+    @classmethod
+    def from_positions(cls, positions, n_items: int) -> "PositionBitmap":
+        bitmap = cls(n_items)
+        bitmap.add_many(positions)
+        return bitmap
+
+    def _grow(self, max_pos: int):
+        n_bytes = max_pos // 8 + 1
+        if n_bytes > len(self._bits):
+            self._bits = np.concatenate([self._bits, np.zeros(max(n_bytes, 2 * len(self._bits)) - len(self._bits), dtype=np.uint8)])
+
+    def add(self, pos: int):
+        if pos < 0 or pos in self:
+            return
+        self._grow(pos)
+        self._bits[pos >> 3] |= np.uint8(1 << (pos & 7))
+        self._count += 1
+
+    def add_many(self, positions):
+        positions = np.unique(np.asarray(positions, dtype=np.int64))
+        positions = positions[positions >= 0]
+        if len(positions) == 0:
+            return
+        self._grow(int(positions[-1]))
+        new = positions[~self.contains(positions)]
+        np.bitwise_or.at(self._bits, new >> 3, (1 << (new & 7)).astype(np.uint8))
+        self._count += len(new)
+
+    def contains(self, positions) -> np.ndarray:
+        positions = np.asarray(positions, dtype=np.int64)
+        in_range = (positions >= 0) & (positions < 8 * len(self._bits))
+        clipped = np.where(in_range, positions, 0)
+        return in_range & ((self._bits[clipped >> 3] >> (clipped & 7).astype(np.uint8)) & 1).astype(bool)
+
+    def __contains__(self, pos) -> bool:
+        pos = int(pos)
+        return 0 <= pos < 8 * len(self._bits) and bool((self._bits[pos >> 3] >> (pos & 7)) & 1)
+
+    def __len__(self):
+        return self._count
+
+
+class CatalogIndex:
+    """
+    In memory inverted index over a catalog (videos or products).
+
+    Items get dense positions in upload order. For every bucket id the positions of its items are kept in a
+    contiguous int array, and each item's buckets are kept in CSR layout (bucket_ptr / bucket_ids) for the scoring
+    core. Candidate sampling then draws buckets by weight and items within buckets directly, so it costs
+    O(n_recommended) instead of a pass over the whole catalog.
+    """
+
+    def __init__(self, id_key: str):
+        self.id_key = id_key
+        self.records = []
+        self.position = {}
+        self.version = 0
+        self._bucket_positions = {}
+        self._bucket_ptr = _GrowableIntArray()
+        self._bucket_ptr.append(0)
+        self._bucket_ids = _GrowableIntArray()
+        self._id_index = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_records(cls, records: list[dict], id_key: str) -> "CatalogIndex":
+        """ Bulk build, the per bucket position arrays come from one stable argsort instead of per item appends"""
+        index = cls(id_key)
+        for record in records:
+            if record[id_key] not in index.position:
+                index.position[record[id_key]] = len(index.records)
+                index.records.append(record)
+
+        bucket_lists = [_as_bucket_list(record.get("bucket_num")) for record in index.records]
+        counts = np.fromiter((len(b) for b in bucket_lists), dtype=np.int64, count=len(bucket_lists))
+        bucket_ids = np.fromiter(itertools.chain.from_iterable(bucket_lists), dtype=np.int64, count=int(counts.sum()))
+        item_of_entry = np.repeat(np.arange(len(bucket_lists), dtype=np.int64), counts)
+
+        index._bucket_ptr = _GrowableIntArray.from_array(np.concatenate([[0], np.cumsum(counts)]))
+        index._bucket_ids = _GrowableIntArray.from_array(bucket_ids)
+
+        # stable sort keeps positions ascending inside each bucket, same layout as appending in upload order
+        order = np.argsort(bucket_ids, kind="stable")
+        unique_buckets, starts = np.unique(bucket_ids[order], return_index=True)
+        for bucket, positions in zip(unique_buckets, np.split(item_of_entry[order], starts[1:])):
+            index._bucket_positions[int(bucket)] = _GrowableIntArray.from_array(positions)
+
+        index.version = len(index.records)
+        return index
+
+    def add(self, record: dict) -> int:
+        """ Adds (or ignores a duplicate of) one item, called on upload. Returns the item's position."""
+        with self._lock:
+            item_id = record[self.id_key]
+            if item_id in self.position:
+                return self.position[item_id]
+
+            pos = len(self.records)
+            buckets = _as_bucket_list(record.get("bucket_num"))
+
+            for bucket in buckets:
+                self._bucket_ids.append(bucket)
+                self._bucket_positions.setdefault(bucket, _GrowableIntArray()).append(pos)
+            self._bucket_ptr.append(len(self._bucket_ids))
+
+            self.records.append(record)
+            self.position[item_id] = pos
+            self._id_index = None
+            self.version += 1
+            return pos
+
+    @property
+    def n_items(self) -> int:
+        return len(self.records)
+
+    @property
+    def bucket_ptr(self) -> np.ndarray:
+        return self._bucket_ptr.view()
+
+    @property
+    def bucket_ids(self) -> np.ndarray:
+        return self._bucket_ids.view()
+
+    def id_index(self) -> pd.Index:
+        """ item id -> position lookup for vectorized encoding, rebuilt only after the catalog changed"""
+        id_index = self._id_index
+        if id_index is None:
+            id_index = pd.Index([record[self.id_key] for record in self.records])
+            self._id_index = id_index
+        return id_index
+
+    def bucket_positions(self, bucket: int) -> np.ndarray:
+        positions = self._bucket_positions.get(int(bucket))
+        return positions.view() if positions is not None else np.empty(0, dtype=np.int64)
+
+    def buckets(self) -> np.ndarray:
+        """ bucket ids that have at least one item"""
+        return np.array(sorted(self._bucket_positions), dtype=np.int64)
+
+    def primary_buckets(self, positions) -> np.ndarray:
+        """ first bucket of every item, -1 for items without one"""
+        positions = np.asarray(positions, dtype=np.int64)
+        bucket_ptr, bucket_ids = self.bucket_ptr, self.bucket_ids
+        has_bucket = bucket_ptr[positions + 1] > bucket_ptr[positions]
+        if not has_bucket.any():
+            return np.full(len(positions), -1, dtype=np.int64)
+        return np.where(has_bucket, bucket_ids[np.where(has_bucket, bucket_ptr[positions], 0)], -1)
+
+    def get_records(self, positions) -> list[dict]:
+        return [dict(self.records[int(pos)]) for pos in positions]
+
+    def bucket_sampler(self, bucket_weights):
+        """
+        (bucket ids, per bucket positions, AliasSampler over weight_b * n_items_b) for a preference vector, or None if
+        no weighted bucket has items. Built on every call and not cached: the vectors passed in blend the decaying
+        session profile (and the exploration plan) in, so they are never the same twice, and the table is only
+        O(number of buckets) to build.
+        """
+        bucket_weights = np.asarray(bucket_weights, dtype=np.float64)
+        buckets = [b for b in np.flatnonzero(bucket_weights > 0) if len(self.bucket_positions(b)) > 0]
+        if buckets:
+            positions = [self.bucket_positions(b) for b in buckets]
+            mass = bucket_weights[buckets] * np.array([len(p) for p in positions], dtype=np.float64)
+            return np.array(buckets, dtype=np.int64), positions, AliasSampler(mass)
+        return None
+
+    def sample_weighted(self, bucket_weights, n: int, rng, excluded=()) -> list[int]:
+        """
+        Up to n distinct positions without replacement, each item drawn with probability proportional to the
+        weight of its bucket (same as np.random.choice(p=item_weights, replace=False) over the items of weighted
+        buckets). Stops early when the weighted buckets run out of items.
+
+        Draws bucket by alias table and item uniformly within it, rejecting items already picked or excluded.
+        Conditioning on "not picked yet" keeps every draw proportional to the remaining weights, so this is exact,
+        and it costs O(n) while most of the weighted mass is still available. When rejections pile up (e.g. the
+        user watched most of their preferred buckets) the rest is drawn by the exhaustive walk.
+
+        :param excluded: containers (sets, PositionBitmap) of positions that must not be returned, e.g. already watched
+        """
+        if n <= 0:
+            return []
+        sampler = self.bucket_sampler(bucket_weights)
+        if sampler is None:
+            return []
+        _, positions, alias = sampler
+
+        picked = []
+        picked_set = set()
+        max_attempts = REJECTION_ATTEMPTS_FACTOR * n + 16
+        attempts = 0
+        while len(picked) < n and attempts < max_attempts:
+            batch = min(2 * (n - len(picked)) + 8, max_attempts - attempts)
+            for b, u in zip(alias.draw(rng, batch), rng.random(batch)):
+                attempts += 1
+                bucket_positions = positions[b]
+                pos = int(bucket_positions[int(u * len(bucket_positions))])
+                if pos in picked_set or any(pos in positions_out for positions_out in excluded):
+                    continue
+                picked.append(pos)
+                picked_set.add(pos)
+                if len(picked) == n:
+                    break
+
+        if len(picked) < n:
+            picked += self._sample_weighted_exhaustive(bucket_weights, n - len(picked), rng, (*excluded, picked_set))
+        return picked
+
+    def _sample_weighted_exhaustive(self, bucket_weights, n: int, rng, excluded=()) -> list[int]:
+        """
+        sample_weighted by walking every weighted bucket without replacement (lazy Fisher-Yates per bucket):
+        each draw picks bucket b with probability proportional to weight_b * items left in b. Always terminates,
+        cost grows with the number of excluded items it has to step over.
+        """
+        sampler = self.bucket_sampler(bucket_weights)
+        if n <= 0 or sampler is None:
+            return []
+        buckets, positions, _ = sampler
+
+        weights = np.asarray(bucket_weights, dtype=np.float64)[buckets]
+        permutations = [_LazyPermutation(len(p)) for p in positions]
+        remaining = np.array([len(p) for p in positions], dtype=np.float64)
+
+        picked = []
+        picked_set = set()
+        while len(picked) < n:
+            mass = weights * remaining
+            total = mass.sum()
+            if total <= 0:
+                break
+            b = int(np.searchsorted(np.cumsum(mass), rng.random() * total, side="right"))
+            b = min(b, len(buckets) - 1)
+            pos = int(positions[b][permutations[b].draw(rng)])
+            remaining[b] -= 1
+
+            # items listed in several weighted buckets can be reached more than once
+            if pos in picked_set or any(pos in positions_out for positions_out in excluded):
+                continue
+            picked.append(pos)
+            picked_set.add(pos)
+
+        return picked
+
+    def sample_uniform(self, n: int, rng, excluded=()) -> list[int]:
+        """ Up to n distinct positions uniformly from the whole catalog, skipping positions in any excluded container"""
+        permutation = _LazyPermutation(self.n_items)
+        picked = []
+        while len(picked) < n and permutation.remaining > 0:
+            pos = permutation.draw(rng)
+            if any(pos in positions_out for positions_out in excluded):
+                continue
+            picked.append(pos)
+        return picked
+
+
+_catalog_indexes = {}
+_catalog_indexes_lock = threading.Lock()
+
+
+def get_catalog_index(item_type: str) -> CatalogIndex:
+    """ Catalog index for "video" or "product", built from the parquet tables on first use"""
+    index = _catalog_indexes.get(item_type)
+    if index is not None:
+        return index
+
+    with _catalog_indexes_lock:
+        index = _catalog_indexes.get(item_type)
+        if index is None:
+            if item_type == "video":
+                index = CatalogIndex.from_records(_df_to_records(download_all_videos_metadata()), "video_id")
+            elif item_type == "product":
+                index = CatalogIndex.from_records(_df_to_records(download_all_products_metadata()), "product_id")
+            else:
+                raise ValueError(f"Unknown catalog type {item_type}")
+            _catalog_indexes[item_type] = index
+    return index
+
+
+def add_to_catalog_index(item_type: str, metadata: dict):
+    """
+    Keeps a built catalog index in sync on upload. If it was not built yet there is nothing to do,
+    the first get_catalog_index call reads the item from parquet.
+    """
+    index = _catalog_indexes.get(item_type)
+    if index is not None:
+        index.add(metadata)
@@ -0,0 +1,390 @@
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from backend.src.database.db_utils import download_user_interactions, DEFAULT_USER_ID
+from backend.src.instrumentation import instrumented
+from backend.src.product_recommendation.catalog_index import get_catalog_index
+from backend.src.product_recommendation.scoring import encode_interactions, logged_interactions, timestamp_epoch_s
+from backend.src.product_recommendation.user_state import MAX_CACHED_USERS
+
+logger = logging.getLogger(__name__)
+
+# interactions of one user less than SESSION_GAP_S apart belong to the same session
+SESSION_GAP_S = 30 * 60
+# a positive interaction (watched past 50%, not skipped) is paired with at most the SESSION_WINDOW previous positives of its session
+SESSION_WINDOW = 20
+# neighbours kept per video
+TOP_NEIGHBOURS = 50
+# pair increments buffered in a dict before a background compaction merges them into the CSR arrays
+COMPACT_DELTA_PAIRS = 200_000
+# pairs of a log replay merged into the counts at a time, bounds its memory by the distinct pairs plus one chunk
+REPLAY_CHUNK_PAIRS = 4_000_000
+
+_COMPACTION_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="co-engagement-compaction")
+_BUILD_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="co-engagement-build")
+
+
+def _empty_csr():
+    return np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+
+def _csr_rows(csr) -> np.ndarray:
+    """ Row of every stored entry"""
+    indptr = csr[0]
+    return np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+
+
+def _csr_from_pairs(rows, cols, weights):
+    """ CSR (indptr, indices, data) with columns sorted inside each row, duplicate (row, col) pairs summed"""
+    if len(rows) == 0:
+        return _empty_csr()
+    order = np.lexsort((cols, rows))
+    rows, cols, weights = rows[order], cols[order], weights[order]
+
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    starts = np.flatnonzero(first)
+    data = np.add.reduceat(weights, starts)
+    rows, cols = rows[starts], cols[starts]
+
+    indptr = np.zeros(int(rows[-1]) + 2, dtype=np.int64)
+    np.cumsum(np.bincount(rows), out=indptr[1:])
+    return indptr, cols, data
+
+
+def _merge_pairs(csr, rows, cols, weights):
+    """ csr with the (row, col) increments added"""
+    return _csr_from_pairs(
+        np.concatenate([_csr_rows(csr), rows]),
+        np.concatenate([csr[1], cols]),
+        np.concatenate([csr[2], weights]),
+    )
+
+
+def _top_n(csr, n: int):
+    """ The n largest entries of every row (CSR, strongest first)"""
+    indptr, indices, data = csr
+    rows = _csr_rows(csr)
+    order = np.lexsort((-data, rows))
+    # rows keep their length, so an entry's rank is its offset from the row start
+    keep = order[np.arange(len(order)) - indptr[rows[order]] < n]
+
+    top_indptr = np.zeros(len(indptr), dtype=np.int64)
+    np.cumsum(np.bincount(rows[keep], minlength=len(indptr) - 1), out=top_indptr[1:])
+    return top_indptr, indices[keep], data[keep]
+
+
+def _csr_row(csr, row: int):
+    indptr, indices, data = csr
+    if row >= len(indptr) - 1:
+        return indices[:0], data[:0]
+    return indices[indptr[row]:indptr[row + 1]], data[indptr[row]:indptr[row + 1]]
+
+
+class CoEngagementIndex:
+    """
+    Item-item co-engagement over video catalog positions: how often two videos were both watched past 50% in the same
+    session, at most SESSION_WINDOW positives apart.
+
+    Counts live in a CSR matrix plus a dict of increments since the last compaction. The TOP_NEIGHBOURS strongest
+    neighbours of every video are a second CSR; rows changed since the compaction are kept up to date in an overlay
+    as interactions arrive (counts only grow, so a video enters a row only by beating its weakest neighbour).
+    """
+
+    def __init__(self, n_neighbours: int = TOP_NEIGHBOURS):
+        self.n_neighbours = n_neighbours
+        self._lock = threading.Lock()
+        self._counts = _empty_csr()
+        self._top = _empty_csr()
+        # increments not in _counts yet: _frozen is being merged by a running compaction, _delta collects new ones
+        self._frozen = {}
+        self._delta = {}
+        # row -> {neighbour: count} for rows changed since the last compaction, takes precedence over _top
+        self._top_rows = {}
+        # user -> [epoch seconds of the last interaction, last positives of the current session]
+        self._sessions = OrderedDict()
+        self._compacting = False
+
+    @classmethod
+    def from_log(cls, user_ids, video_idx, epoch_s, positive, n_neighbours: int = TOP_NEIGHBOURS) -> "CoEngagementIndex":
+        """
+        Replays an interaction log in one vectorized pass: same counts and session state as calling record() for
+        every row in time order.
+
+        :param video_idx: catalog position per interaction (-1 = unknown video, ignored)
+        :param epoch_s: interaction time, NaN starts a new session
+        :param positive: watched past 50% and not skipped
+        """
+        index = cls(n_neighbours)
+        if len(video_idx) == 0:
+            return index
+
+        user_codes, user_names = pd.factorize(pd.Series(user_ids, dtype=object))
+        epoch_s = np.asarray(epoch_s, dtype=np.float64)
+        order = np.lexsort((epoch_s, user_codes))
+        user_codes, epoch_s = user_codes[order], epoch_s[order]
+        video_idx = np.asarray(video_idx, dtype=np.int64)[order]
+        positive = np.asarray(positive, dtype=bool)[order]
+
+        new_session = np.ones(len(order), dtype=bool)
+        gaps = epoch_s[1:] - epoch_s[:-1]
+        new_session[1:] = (user_codes[1:] != user_codes[:-1]) | ~(gaps <= SESSION_GAP_S)
+        session = np.cumsum(new_session)
+
+        kept = positive & (video_idx >= 0)
+        items, item_session = video_idx[kept], session[kept]
+
+        # pairs are merged into the counts chunk by chunk, never all 2 * SESSION_WINDOW * len(items) of them at once
+        rows, cols, n_buffered = [], [], 0
+        for lag in range(1, SESSION_WINDOW + 1):
+            paired = (item_session[lag:] == item_session[:-lag]) & (items[lag:] != items[:-lag])
+            later, earlier = items[lag:][paired], items[:-lag][paired]
+            rows += [later, earlier]
+            cols += [earlier, later]
+            n_buffered += 2 * len(later)
+            if n_buffered >= REPLAY_CHUNK_PAIRS or lag == SESSION_WINDOW:
+                rows, cols = np.concatenate(rows), np.concatenate(cols)
+                index._counts = _merge_pairs(index._counts, rows, cols, np.ones(len(rows)))
+                rows, cols, n_buffered = [], [], 0
+        index._top = _top_n(index._counts, n_neighbours)
+
+        # session state of every user's last session, least recently active users first so the LRU keeps the latest
+        last_rows = np.flatnonzero(np.append(user_codes[1:] != user_codes[:-1], True))
+        for last in last_rows[np.argsort(np.nan_to_num(epoch_s[last_rows], nan=-np.inf), kind="stable")]:
+            lo, hi = np.searchsorted(item_session, [session[last], session[last] + 1])
+            index._sessions[user_names[user_codes[last]]] = [epoch_s[last], deque(items[lo:hi][-SESSION_WINDOW:].tolist(), maxlen=SESSION_WINDOW)]
+        while len(index._sessions) > MAX_CACHED_USERS:
+            index._sessions.popitem(last=False)
+        return index
+
+    def _count(self, a: int, b: int) -> float:
+        indices, data = _csr_row(self._counts, a)
+        i = np.searchsorted(indices, b)
+        stored = float(data[i]) if i < len(indices) and indices[i] == b else 0.0
+        return stored + self._frozen.get((a, b), 0.0) + self._delta.get((a, b), 0.0)
+
+    def _bump(self, a: int, b: int, weight: float):
+        """ Adds weight to count(a, b) and keeps a's neighbour row exact, caller holds the lock"""
+        self._delta[(a, b)] = self._delta.get((a, b), 0.0) + weight
+        count = self._count(a, b)
+
+        row = self._top_rows.get(a)
+        if row is None:
+            indices, data = _csr_row(self._top, a)
+            row = dict(zip(indices.tolist(), data.tolist()))
+            self._top_rows[a] = row
+
+        if b in row or len(row) < self.n_neighbours:
+            row[b] = count
+        else:
+            weakest = min(row, key=row.get)
+            if count > row[weakest]:
+                del row[weakest]
+                row[b] = count
+
+    def record(self, user_id: str, pos: int, epoch_s: float, positive: bool):
+        """ One logged interaction: opens a new session after SESSION_GAP_S, a positive one is paired with the session's last positives"""
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is None or not (epoch_s - session[0] <= SESSION_GAP_S):
+                session = [epoch_s, deque(maxlen=SESSION_WINDOW)]
+                self._sessions[user_id] = session
+                while len(self._sessions) > MAX_CACHED_USERS:
+                    self._sessions.popitem(last=False)
+            self._sessions.move_to_end(user_id)
+            session[0] = epoch_s
+
+            if not positive or pos < 0:
+                return
+            for other in session[1]:
+                if other != pos:
+                    self._bump(pos, other, 1.0)
+                    self._bump(other, pos, 1.0)
+            session[1].append(pos)
+
+            compact = len(self._delta) >= COMPACT_DELTA_PAIRS and not self._compacting
+            if compact:
+                self._compacting = True
+        if compact:
+            _COMPACTION_EXECUTOR.submit(self.compact)
+
+    def compact(self):
+        """ Merges the buffered increments into the CSR arrays, lookups and updates keep running meanwhile"""
+        with self._lock:
+            frozen, self._delta = self._delta, {}
+            self._frozen = frozen
+            counts = self._counts
+        try:
+            if frozen:
+                keys = np.array(list(frozen.keys()), dtype=np.int64).reshape(-1, 2)
+                merged = _merge_pairs(
+                    counts, keys[:, 0], keys[:, 1], np.fromiter(frozen.values(), dtype=np.float64, count=len(frozen)),
+                )
+                top = _top_n(merged, self.n_neighbours)
+                with self._lock:
+                    self._counts, self._top, self._frozen = merged, top, {}
+                    # rows changed after the swap stay in the overlay, the others are now exact in _top
+                    changed = {a for a, _ in self._delta}
+                    self._top_rows = {a: row for a, row in self._top_rows.items() if a in changed}
+        except Exception:
+            logger.exception("Error compacting co-engagement counts")
+            with self._lock:
+                # the increments stay buffered for the next compaction
+                for key, weight in frozen.items():
+                    self._delta[key] = self._delta.get(key, 0.0) + weight
+        finally:
+            with self._lock:
+                self._frozen = {}
+                self._compacting = False
+
+    def neighbours(self, pos: int) -> tuple[np.ndarray, np.ndarray]:
+        """ (positions, co-engagement counts) of the strongest neighbours of a video, strongest first"""
+        with self._lock:
+            row = self._top_rows.get(pos)
+            if row is not None:
+                indices = np.fromiter(row.keys(), dtype=np.int64, count=len(row))
+                data = np.fromiter(row.values(), dtype=np.float64, count=len(row))
+            else:
+                indices, data = _csr_row(self._top, pos)
+        order = np.argsort(-data, kind="stable")
+        return indices[order], data[order]
+
+    def expand(self, seeds, k: int, excluded=()) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Up to k videos co-engaged with the seeds. Every seed's neighbour counts are scaled to its strongest neighbour
+        so one very popular seed does not drown the others, then summed per video.
+
+        :param excluded: containers of positions to skip (PositionBitmap, set), like CatalogIndex.sample_weighted
+        :return: (positions, scores), best first
+        """
+        positions, scores = [], []
+        for seed in seeds:
+            neighbour_positions, counts = self.neighbours(int(seed))
+            if len(counts):
+                positions.append(neighbour_positions)
+                scores.append(counts / counts[0])
+        if not positions or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        positions, inverse = np.unique(np.concatenate(positions), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(scores))
+        keep = np.ones(len(positions), dtype=bool)
+        for positions_out in excluded:
+            if hasattr(positions_out, "contains"):
+                keep &= ~positions_out.contains(positions)
+            else:
+                keep &= np.fromiter((p not in positions_out for p in positions.tolist()), dtype=bool, count=len(positions))
+        positions, scores = positions[keep], scores[keep]
+
+        order = np.argsort(-scores, kind="stable")[:k]
+        return positions[order], scores[order]
+
+
+_co_engagement_index = None
+_co_engagement_lock = threading.Lock()
+# interactions recorded while a build replays the log (None when no build runs), applied to the index once it is ready
+_pending_interactions = None
+_pending_lock = threading.Lock()
+_build_scheduled = False
+
+
+def _record_interaction(index: CoEngagementIndex, interaction: dict):
+    index.record(
+        interaction.get("user_id", DEFAULT_USER_ID),
+        get_catalog_index("video").position.get(interaction["video_id"], -1),
+        timestamp_epoch_s(interaction.get("interaction_timestamp")),
+        bool(interaction.get("watched_50_pct")) and not bool(interaction.get("skipped_quickly")),
+    )
+
+
+def _build_co_engagement_index() -> CoEngagementIndex:
+    global _co_engagement_index, _pending_interactions
+    with _co_engagement_lock:
+        if _co_engagement_index is not None:
+            return _co_engagement_index
+        with _pending_lock:
+            _pending_interactions = []
+        try:
+            interactions_df = download_user_interactions()
+            coded = encode_interactions(interactions_df, get_catalog_index("video").id_index())
+            index = CoEngagementIndex.from_log(
+                interactions_df["user_id"].to_numpy(dtype=object) if len(interactions_df) else [],
+                coded["video_idx"],
+                coded["interaction_epoch_s"],
+                coded["watched_50_pct"] & ~coded["skipped_quickly"],
+            )
+            with _pending_lock:
+                # written to the log before the hook ran, so an interaction may already be part of the replay
+                logged = logged_interactions(interactions_df, coded["interaction_epoch_s"], _pending_interactions)
+                for interaction, replayed in zip(_pending_interactions, logged):
+                    if not replayed:
+                        _record_interaction(index, interaction)
+                _co_engagement_index = index
+        finally:
+            with _pending_lock:
+                _pending_interactions = None
+        return index
+
+
+def _build_in_background():
+    global _build_scheduled
+    try:
+        _build_co_engagement_index()
+    except Exception:
+        logger.exception("Error building the co-engagement index")
+    finally:
+        with _pending_lock:
+            _build_scheduled = False
+
+
+def start_co_engagement_build():
+    """ Replays the interaction log into the index in the background, called at startup so no request waits for it"""
+    global _build_scheduled
+    with _pending_lock:
+        if _co_engagement_index is not None or _build_scheduled:
+            return
+        _build_scheduled = True
+    _BUILD_EXECUTOR.submit(_build_in_background)
+
+
+def get_co_engagement_index() -> CoEngagementIndex:
+    """ Co-engagement index of the video catalog, waits for (or runs) the replay of the interaction log if it is not built yet"""
+    index = _co_engagement_index
+    if index is not None:
+        return index
+    return _build_co_engagement_index()
+
+
+def peek_co_engagement_index():
+    """ The index if it is built, otherwise None and a background build is started. Used in requests"""
+    index = _co_engagement_index
+    if index is None:
+        start_co_engagement_build()
+    return index
+
+
+@instrumented("recommendation.record_co_engagement")
+def record_co_engagement(interaction: dict):
+    """
+    Interaction hook, called after the interaction is written to parquet. Before any build there is nothing to do,
+    the build replays the new row from the log; during a build it is kept and applied once the index is ready.
+    """
+    index = _co_engagement_index
+    if index is None:
+        with _pending_lock:
+            index = _co_engagement_index
+            if index is None:
+                if _pending_interactions is not None:
+                    _pending_interactions.append(interaction)
+                return
+    _record_interaction(index, interaction)
+
+
+def reset_co_engagement():
+    """ Forgets the index, e.g. after the interaction log was rewritten outside the service"""
+    global _co_engagement_index
+    with _co_engagement_lock:
+        _co_engagement_index = None
@@ -0,0 +1,123 @@
+from collections import deque
+import numpy as np
+
+# an item is kept apart from the last DIVERSITY_WINDOW items placed before it
+DIVERSITY_WINDOW = 4
+# the next item is picked among the first DIVERSITY_LOOKAHEAD items not placed yet
+DIVERSITY_LOOKAHEAD = 16
+# MMR trade-off between relevance (1.0) and dissimilarity to the recently placed items (0.0)
+MMR_LAMBDA = 0.5
+
+
+def _bucket_match(bucket_ids, candidates, placed) -> np.ndarray:
+    """ (len(candidates), len(placed)) bool, items without a bucket (-1) never match"""
+    candidate_buckets = bucket_ids[candidates][:, None]
+    return (candidate_buckets == bucket_ids[placed][None, :]) & (candidate_buckets >= 0)
+
+
+def _embedding_similarity(embeddings, candidates, placed) -> np.ndarray:
+    if embeddings is None:
+        return np.zeros((len(candidates), len(placed)))
+    return embeddings[candidates] @ embeddings[placed].T
+
+
+def diversify(bucket_ids, embeddings=None, relevance=None, window: int = DIVERSITY_WINDOW,
+              lookahead: int = DIVERSITY_LOOKAHEAD, mmr_lambda: float = MMR_LAMBDA) -> np.ndarray:
+    """
+    Greedy MMR re-ranking with a bounded lookahead: the next item is the one among the first `lookahead` unplaced
+    items maximizing mmr_lambda * relevance - (1 - mmr_lambda) * (highest similarity to the last `window` placed items),
+    ties go to the earlier item. Without embeddings this interleaves buckets.
+
+    Sharing a bucket counts as similarity 1, but only within the spacing the bucket can afford: a bucket holding a third
+    of the remaining items may come back every third item. A fixed window would spend the small buckets first and end
+    the page with a run of the dominant one.
+
+    Similarities to the placed items are kept per lookahead slot, so each step compares the placed item against the
+    lookahead and the item entering the lookahead against the window: O(k * (lookahead + window)) comparisons.
+
+    :param bucket_ids: primary bucket per item, -1 never counts as shared
+    :param embeddings: optional (k, d) L2 normalized rows, zero rows for items without one
+    :param relevance: optional per item scores, by default only the input order breaks ties
+    :return: permutation of range(k)
+    """
+    bucket_ids = np.asarray(bucket_ids, dtype=np.int64)
+    k = len(bucket_ids)
+    if k <= 1 or window <= 0:
+        return np.arange(k)
+    relevance = np.zeros(k) if relevance is None else np.asarray(relevance, dtype=np.float64)
+    if embeddings is not None:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+    lookahead = max(1, min(lookahead, k))
+
+    # items not placed yet per bucket (compact codes, items without a bucket are never limited)
+    _, bucket_codes = np.unique(bucket_ids, return_inverse=True)
+    remaining = np.bincount(bucket_codes).astype(np.float64)
+
+    # lookahead slots hold item indices (-1 empty). For every slot and ring slot (placed item): same bucket and
+    # embedding similarity. ring_step is the step an item was placed at, to tell how far back it is
+    slots = np.arange(lookahead)
+    same_bucket = np.zeros((lookahead, window), dtype=bool)
+    similarity = np.zeros((lookahead, window))
+    ring = np.full(window, -1, dtype=np.int64)
+    ring_step = np.full(window, -k - window, dtype=np.int64)
+    next_item = lookahead
+
+    order = np.empty(k, dtype=np.int64)
+    for step in range(k):
+        active = slots >= 0
+        candidates = np.maximum(slots, 0)
+        # spacing a bucket can afford: (items left) / (items of the bucket left), at most window
+        spacing = np.minimum(window, np.floor((k - step) / np.maximum(remaining[bucket_codes[candidates]], 1)) - 1)
+        conflict = same_bucket & ((step - ring_step)[None, :] <= spacing[:, None])
+        penalty = np.maximum(conflict, similarity).max(axis=1)
+        score = np.where(active, mmr_lambda * relevance[candidates] - (1.0 - mmr_lambda) * penalty, -np.inf)
+        best = np.flatnonzero(score == score.max())
+        slot = best[np.argmin(slots[best])]
+        item = slots[slot]
+        order[step] = item
+        remaining[bucket_codes[item]] -= 1
+
+        # the placed item replaces the oldest one of the window
+        ring_slot = step % window
+        ring[ring_slot], ring_step[ring_slot] = item, step
+        others = np.flatnonzero(active)
+        same_bucket[others, ring_slot] = _bucket_match(bucket_ids, slots[others], [item])[:, 0]
+        similarity[others, ring_slot] = _embedding_similarity(embeddings, slots[others], [item])[:, 0]
+
+        # the freed slot takes the next item in input order
+        same_bucket[slot], similarity[slot] = False, 0.0
+        if next_item < k:
+            slots[slot] = next_item
+            placed = np.flatnonzero(ring >= 0)
+            same_bucket[slot, placed] = _bucket_match(bucket_ids, [next_item], ring[placed])[0]
+            similarity[slot, placed] = _embedding_similarity(embeddings, [next_item], ring[placed])[0]
+            next_item += 1
+        else:
+            slots[slot] = -1
+    return order
+
+
+def page_diversity(bucket_ids, embeddings=None, window: int = DIVERSITY_WINDOW) -> dict:
+    """
+    Diversity of a page in its served order, for comparing re-rankers offline
+
+    :return: share of neighbours in the same bucket, longest same bucket run, and (with embeddings) the mean highest
+             similarity of an item to the `window` items before it
+    """
+    bucket_ids = np.asarray(bucket_ids, dtype=np.int64)
+    same = (bucket_ids[1:] == bucket_ids[:-1]) & (bucket_ids[1:] >= 0)
+    longest, run = (1 if len(bucket_ids) else 0), 1
+    for is_same in same:
+        run = run + 1 if is_same else 1
+        longest = max(longest, run)
+    stats = {"adjacent_same_bucket": float(same.mean()) if len(same) else 0.0, "longest_bucket_run": longest}
+
+    if embeddings is not None and len(bucket_ids) > 1:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        recent, highest = deque(maxlen=window), []
+        for i in range(len(bucket_ids)):
+            if recent:
+                highest.append(float((embeddings[list(recent)] @ embeddings[i]).max()))
+            recent.append(i)
+        stats["window_similarity"] = float(np.mean(highest))
+    return stats
@@ -0,0 +1,473 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from backend.src.database.db_utils import download_embedding_ids, open_embedding_matrix, update_embeddings
+from backend.src.product_recommendation.catalog_index import get_catalog_index
+
+logger = logging.getLogger(__name__)
+
+# sentence embedding model of the text space: mean pooled MiniLM, 384 dims (1M items take 1.5 GB on disk,
+# paged in by the OS as the scan touches them)
+TEXT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# texts per forward pass while backfilling, and the token cap per text (pipeline text is a few sentences)
+MODEL_BATCH_SIZE = 64
+MODEL_MAX_TOKENS = 128
+# without the model weights (offline, nothing cached) texts fall back to feature hashing of word uni/bigrams, a lexical
+# stand-in only. Its rows live in their own files (the width is part of the file name), the two never mix
+HASHING_EMBEDDING_DIM = 128
+# texts encoded per vectorizer call while backfilling with the fallback
+ENCODE_BATCH_SIZE = 10000
+# width of the image vectors (DINOv2 small pooled output) of product photos and sampled video frames
+VISUAL_EMBEDDING_DIM = 384
+
+# rows scored per matmul block during a search, bounds the temporary buffers whatever the catalog size
+SEARCH_BLOCK_ROWS = 65536
+
+# matrices up to EXACT_SEARCH_MAX_BYTES (~68k rows of 384 dims) are scanned in full, bigger ones probe an inverted file:
+# IVF_LISTS spherical k-means lists trained on IVF_TRAIN_ROWS sampled rows, IVF_PROBE_LISTS of them scanned per query
+EXACT_SEARCH_MAX_BYTES = 100 * 1024 * 1024
+IVF_LISTS = 256
+IVF_PROBE_LISTS = 8
+IVF_TRAIN_ROWS = 50_000
+IVF_KMEANS_ITERATIONS = 5
+# rows appended after the build are scanned exactly, the lists are rebuilt once they reach this share of the indexed rows
+IVF_REBUILD_RATIO = 0.1
+
+# (item type, space) of every index the recommendations read, loaded in the background from startup on
+EMBEDDING_SPACES = (("video", "text"), ("product", "text"), ("video", "visual"), ("product", "visual"))
+
+# loads, backfills, catalog syncs and inverted file rebuilds, never run in a request
+_BUILD_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-index-build")
+
+
+class _SentenceEncoder:
+    """ Mean pooled (attention masked) last hidden states of a sentence embedding model, loaded from the HF hub cache"""
+
+    def __init__(self, model_name: str):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self._torch = torch
+        self._tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self._model = AutoModel.from_pretrained(model_name).eval()
+        self.name = model_name.rsplit("/", 1)[-1]
+        self.dim = int(self._model.config.hidden_size)
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        with self._torch.inference_mode():
+            for start in range(0, len(texts), MODEL_BATCH_SIZE):
+                batch = self._tokenizer(
+                    texts[start:start + MODEL_BATCH_SIZE], padding=True, truncation=True, max_length=MODEL_MAX_TOKENS,
+                    return_tensors="pt",
+                )
+                hidden = self._model(**batch).last_hidden_state
+                mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1.0)
+                vectors[start:start + len(pooled)] = pooled.numpy()
+        return vectors
+
+
+class _HashingEncoder:
+    """
+    Fallback: signed feature hashing of word uni/bigrams, a fixed random projection of the bag of words. No fitting,
+    no vocabulary, every process encodes the same text to the same vector
+    """
+
+    name = "hashing"
+    dim = HASHING_EMBEDDING_DIM
+
+    def __init__(self):
+        self._vectorizer = HashingVectorizer(
+            n_features=HASHING_EMBEDDING_DIM, ngram_range=(1, 2), stop_words="english", alternate_sign=True, norm=None
+        )
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), ENCODE_BATCH_SIZE):
+            batch = self._vectorizer.transform(texts[start:start + ENCODE_BATCH_SIZE]).toarray()
+            vectors[start:start + len(batch)] = batch
+        return vectors
+
+
+_text_encoder = None
+_text_encoder_lock = threading.Lock()
+
+
+def load_text_encoder():
+    """
+    Encoder of the text space, loaded once per process (the API loads it at startup): TEXT_EMBEDDING_MODEL, or the
+    hashing fallback when the model cannot be loaded
+    """
+    global _text_encoder
+    if _text_encoder is None:
+        with _text_encoder_lock:
+            if _text_encoder is None:
+                try:
+                    _text_encoder = _SentenceEncoder(TEXT_EMBEDDING_MODEL)
+                except (OSError, ImportError) as e:
+                    logger.warning("Text embedding model %s unavailable, falling back to feature hashing: %s", TEXT_EMBEDDING_MODEL, e)
+                    _text_encoder = _HashingEncoder()
+    return _text_encoder
+
+
+def _as_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return " ".join(str(v) for v in value if v is not None)
+    return "" if value != value else str(value)
+
+
+def item_text(record: dict, item_type: str) -> str:
+    """
+    Text the pipeline already produced for an item: description, BLIP caption, OCR text, YOLO labels and buckets
+    for videos, title, details and category for products
+    """
+    if item_type == "video":
+        fields = ("caption", "vid_caption", "ocr_text", "detected_objects", "bucket_name")
+    else:
+        fields = ("title", "product_details", "bucket_name")
+    return " ".join(_as_text(record.get(field)) for field in fields)
+
+
+def encode_texts(texts: list[str]) -> np.ndarray:
+    """ L2 normalized float32 embeddings (len(texts) x text encoder dim), blank texts give a zero row"""
+    encoder = load_text_encoder()
+    vectors = np.zeros((len(texts), encoder.dim), dtype=np.float32)
+    filled = [i for i, text in enumerate(texts) if text and text.strip()]
+    if filled:
+        encoded = encoder.encode([texts[i] for i in filled])
+        norms = np.linalg.norm(encoded, axis=1, keepdims=True)
+        vectors[filled] = encoded / np.where(norms > 0, norms, 1.0)
+    return vectors
+
+
+def _excluded_mask(positions: np.ndarray, excluded) -> np.ndarray:
+    mask = positions < 0
+    for positions_out in excluded:
+        if hasattr(positions_out, "contains"):
+            mask |= positions_out.contains(positions)
+        elif len(positions_out):
+            mask |= np.isin(positions, np.fromiter(positions_out, dtype=np.int64, count=len(positions_out)))
+    return mask
+
+
+class _InvertedFile:
+    """
+    Approximate search structure over the first n_indexed rows: spherical k-means centroids and, per centroid,
+    the sorted rows assigned to it (CSR: rows of list l are list_rows[list_ptr[l]:list_ptr[l + 1]])
+    """
+
+    def __init__(self, matrix: np.ndarray, rng):
+        n_rows = len(matrix)
+        sample = np.asarray(matrix[np.sort(rng.choice(n_rows, size=min(n_rows, IVF_TRAIN_ROWS), replace=False))])
+        n_lists = min(IVF_LISTS, len(sample))
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+        for _ in range(IVF_KMEANS_ITERATIONS):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # an empty list keeps its old centroid
+            centroids = np.where(norms > 0, sums / np.where(norms > 0, norms, 1.0), centroids)
+
+        assignment = np.concatenate([
+            np.argmax(matrix[start:start + SEARCH_BLOCK_ROWS] @ centroids.T, axis=1)
+            for start in range(0, n_rows, SEARCH_BLOCK_ROWS)
+        ])
+        self.centroids = centroids
+        self.list_rows = np.argsort(assignment, kind="stable")
+        self.list_ptr = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_lists), out=self.list_ptr[1:])
+        self.n_indexed = n_rows
+
+    def candidate_rows(self, queries: np.ndarray, n_rows: int) -> np.ndarray:
+        """ Sorted rows of the IVF_PROBE_LISTS lists closest to any query plus every row appended after the build"""
+        n_probe = min(IVF_PROBE_LISTS, len(self.centroids))
+        probe = np.unique(np.argpartition(-(queries @ self.centroids.T), n_probe - 1, axis=1)[:, :n_probe])
+        rows = np.concatenate(
+            [self.list_rows[self.list_ptr[l]:self.list_ptr[l + 1]] for l in probe] + [np.arange(self.n_indexed, n_rows)]
+        )
+        rows.sort()
+        return rows
+
+
+class EmbeddingIndex:
+    """
+    Item embeddings of one catalog in one space ("text" or "visual") in a memory mapped float32 matrix, rows stored
+    by item id under data/embeddings and mapped onto catalog positions on load.
+
+    Text rows are derived from the metadata: items the file does not cover yet (uploads, older catalogs) are encoded
+    and appended, so every item is encoded once. Visual rows need the image models and are added by the upload
+    services with add(), items without one are simply never returned.
+
+    Up to EXACT_SEARCH_MAX_BYTES of rows a search scans every row, above that it probes an inverted file that is
+    rebuilt once the rows appended since its build reach IVF_REBUILD_RATIO of the indexed ones.
+
+    Loading, syncing and rebuilding are slow with a big catalog: requests go through peek_embedding_index, which
+    leaves them to the background worker.
+    """
+
+    def __init__(self, item_type: str, space: str = "text"):
+        self.item_type = item_type
+        self.space = space
+        if space == "text":
+            encoder = load_text_encoder()
+            self.dim = encoder.dim
+            # hashed rows keep the file names they had before there were other spaces and encoders
+            self.name = item_type if encoder.name == "hashing" else f"{item_type}-{encoder.name}"
+        elif space == "visual":
+            self.dim = VISUAL_EMBEDDING_DIM
+            self.name = f"{item_type}-{space}"
+        else:
+            raise ValueError(f"Unknown embedding space {space}")
+        self._lock = threading.Lock()
+        # one inverted file build at a time, searches keep using the previous one meanwhile
+        self._ivf_lock = threading.Lock()
+        self._rng = np.random.default_rng(0)
+
+        catalog = get_catalog_index(item_type)
+        ids = download_embedding_ids(self.name, self.dim)
+        self._n_rows = len(ids)
+
+        row_position = catalog.id_index().get_indexer(ids).astype(np.int64) if ids else np.empty(0, dtype=np.int64)
+        position_row = np.full(catalog.n_items, -1, dtype=np.int64)
+        known = np.flatnonzero(row_position >= 0)
+        # ids stored twice keep their last row, the other rows never match
+        position_row[row_position[known]] = known
+        row_position[known[position_row[row_position[known]] != known]] = -1
+
+        # replaced as a whole, a search never sees a matrix and mappings of different sizes:
+        # (matrix, catalog position of every row (-1 = unknown / replaced), row of every catalog position (-1 = none),
+        #  inverted file or None for exact search)
+        self._snapshot = (open_embedding_matrix(self.name, self.dim, self._n_rows), row_position, position_row, None)
+        self._sync_rows()
+
+    @property
+    def n_rows(self) -> int:
+        return self._n_rows
+
+    def needs_sync(self) -> bool:
+        """ Whether the catalog grew since the last sync"""
+        return get_catalog_index(self.item_type).n_items != len(self._snapshot[2])
+
+    def sync(self):
+        """ Picks up items uploaded since the last call, a no op unless the catalog grew"""
+        if self.needs_sync():
+            self._sync_rows()
+
+    def _sync_rows(self):
+        """ Maps new catalog positions and, for text, encodes and appends every item without a row, then rebuilds the inverted file if it is due"""
+        catalog = get_catalog_index(self.item_type)
+        with self._lock:
+            matrix, row_position, position_row, ivf = self._snapshot
+            position_row = np.concatenate([position_row, np.full(catalog.n_items - len(position_row), -1, dtype=np.int64)])
+            self._snapshot = (matrix, row_position, position_row, ivf)
+
+            missing = np.flatnonzero(position_row < 0) if self.space == "text" else []
+            if len(missing):
+                records = catalog.get_records(missing)
+                vectors = encode_texts([item_text(record, self.item_type) for record in records])
+                self._append_rows([record[catalog.id_key] for record in records], missing, vectors)
+        self._rebuild_ivf()
+
+    def add(self, item_id, vector: np.ndarray):
+        """ Stores (or replaces) the embedding of one item, normalized. The item should already be in the catalog index"""
+        vector = np.asarray(vector, dtype=np.float32).reshape(1, -1)
+        if vector.shape[1] != self.dim:
+            raise ValueError(f"{self.space} embeddings have {self.dim} dimensions, got {vector.shape[1]}")
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector = vector / norm
+
+        self.sync()
+        with self._lock:
+            pos = get_catalog_index(self.item_type).position.get(item_id, -1)
+            self._append_rows([item_id], np.array([pos], dtype=np.int64), vector)
+        if self._ivf_due():
+            _BUILD_EXECUTOR.submit(self._rebuild_ivf)
+
+    def _append_rows(self, ids: list, positions: np.ndarray, vectors: np.ndarray):
+        """ Persists rows and points their catalog positions at them, caller holds the lock"""
+        matrix, row_position, position_row, ivf = self._snapshot
+        update_embeddings(self.name, ids, vectors, self._n_rows)
+
+        new_rows = np.arange(self._n_rows, self._n_rows + len(ids))
+        row_position = np.concatenate([row_position, positions])
+        position_row = position_row.copy()
+        if len(position_row) < positions.max(initial=-1) + 1:
+            position_row = np.concatenate([position_row, np.full(positions.max() + 1 - len(position_row), -1, dtype=np.int64)])
+        mapped = positions >= 0
+        replaced = position_row[positions[mapped]]
+        row_position[replaced[replaced >= 0]] = -1
+        position_row[positions[mapped]] = new_rows[mapped]
+
+        self._n_rows += len(ids)
+        self._snapshot = (open_embedding_matrix(self.name, self.dim, self._n_rows), row_position, position_row, ivf)
+
+    def _ivf_due(self) -> bool:
+        matrix, _, _, ivf = self._snapshot
+        if len(matrix) * self.dim * 4 <= EXACT_SEARCH_MAX_BYTES:
+            return False
+        return ivf is None or len(matrix) - ivf.n_indexed >= IVF_REBUILD_RATIO * ivf.n_indexed
+
+    def _rebuild_ivf(self):
+        """ Rebuilds the inverted file if it is due, outside the row lock so uploads keep appending meanwhile"""
+        try:
+            with self._ivf_lock:
+                if not self._ivf_due():
+                    return
+                ivf = _InvertedFile(self._snapshot[0], self._rng)
+                with self._lock:
+                    # rows are only ever appended, the lists stay valid for the rows added during the build
+                    matrix, row_position, position_row, _ = self._snapshot
+                    self._snapshot = (matrix, row_position, position_row, ivf)
+        except Exception:
+            logger.exception("Error rebuilding the %s inverted file", self.name)
+
+    def vectors(self, positions) -> np.ndarray:
+        """ Embeddings of catalog positions (zero rows for positions without one)"""
+        matrix, _, position_row, _ = self._snapshot
+        positions = np.asarray(positions, dtype=np.int64)
+        in_range = (positions >= 0) & (positions < len(position_row))
+        rows = np.where(in_range, position_row[np.where(in_range, positions, 0)], -1)
+        vectors = np.zeros((len(positions), self.dim), dtype=np.float32)
+        vectors[rows >= 0] = matrix[rows[rows >= 0]]
+        return vectors
+
+    def has_vectors(self, positions) -> np.ndarray:
+        """ Which catalog positions have an embedding"""
+        position_row = self._snapshot[2]
+        positions = np.asarray(positions, dtype=np.int64)
+        in_range = (positions >= 0) & (positions < len(position_row))
+        return in_range & (position_row[np.where(in_range, positions, 0)] >= 0)
+
+    def search(self, query: np.ndarray, k: int, excluded=(), exact: bool = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Top k by inner product (cosine, rows and query are normalized).
+
+        :param excluded: containers of catalog positions to skip (PositionBitmap, set)
+        :param exact: force (True) or skip (False) the full scan, by default the inverted file is used once built
+        :return: (catalog positions, scores), best first
+        """
+        return self.search_many(np.asarray(query, dtype=np.float32)[None, :], k, excluded, exact)[0]
+
+    def search_many(self, queries: np.ndarray, k: int, excluded=(), exact: bool = None) -> list[tuple[np.ndarray, np.ndarray]]:
+        """ search for several queries in one pass over the rows (blocks of SEARCH_BLOCK_ROWS), one result per query"""
+        matrix, row_position, _, ivf = self._snapshot
+        queries = np.asarray(queries, dtype=np.float32)
+        best = [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in range(len(queries))]
+        if k <= 0 or len(queries) == 0:
+            return best
+
+        candidate_rows = None
+        if ivf is not None and not exact:
+            candidate_rows = ivf.candidate_rows(queries, len(matrix))
+        n_candidates = len(matrix) if candidate_rows is None else len(candidate_rows)
+
+        for start in range(0, n_candidates, SEARCH_BLOCK_ROWS):
+            if candidate_rows is None:
+                block = slice(start, start + SEARCH_BLOCK_ROWS)
+            else:
+                block = candidate_rows[start:start + SEARCH_BLOCK_ROWS]
+            positions = row_position[block]
+            keep = ~_excluded_mask(positions, excluded)
+            positions = positions[keep]
+            block_scores = (matrix[block] @ queries.T)[keep]
+
+            for q, (best_positions, best_scores) in enumerate(best):
+                scores = block_scores[:, q]
+                block_positions = positions
+                if len(scores) > k:
+                    top = np.argpartition(-scores, k - 1)[:k]
+                    scores, block_positions = scores[top], positions[top]
+
+                best_scores = np.concatenate([best_scores, scores])
+                best_positions = np.concatenate([best_positions, block_positions])
+                if len(best_scores) > k:
+                    top = np.argpartition(-best_scores, k - 1)[:k]
+                    best_scores, best_positions = best_scores[top], best_positions[top]
+                best[q] = (best_positions, best_scores)
+
+        results = []
+        for best_positions, best_scores in best:
+            order = np.argsort(-best_scores, kind="stable")
+            results.append((best_positions[order], best_scores[order]))
+        return results
+
+
+_embedding_indexes = {}
+_embedding_indexes_lock = threading.Lock()
+# (item type, space) -> future of a scheduled background load / sync
+_builds = {}
+_builds_lock = threading.Lock()
+
+
+def get_embedding_index(item_type: str, space: str = "text") -> EmbeddingIndex:
+    """
+    Embedding index for "video" or "product" in one space, loaded (and backfilled) on first use and synced with the
+    catalog index. Blocks for as long as that takes, requests use peek_embedding_index.
+    """
+    key = (item_type, space)
+    index = _embedding_indexes.get(key)
+    if index is None:
+        with _embedding_indexes_lock:
+            index = _embedding_indexes.get(key)
+            if index is None:
+                index = EmbeddingIndex(item_type, space)
+                _embedding_indexes[key] = index
+                return index
+    index.sync()
+    return index
+
+
+def _build_in_background(key):
+    try:
+        get_embedding_index(*key)
+    except Exception:
+        logger.exception("Error building the %s %s embedding index", *key)
+
+
+def _schedule_build(key):
+    with _builds_lock:
+        build = _builds.get(key)
+        if build is None or build.done():
+            _builds[key] = _BUILD_EXECUTOR.submit(_build_in_background, key)
+
+
+def start_embedding_builds():
+    """ Loads (and backfills) every index in EMBEDDING_SPACES in the background, called at startup so no request waits for it"""
+    for key in EMBEDDING_SPACES:
+        _schedule_build(key)
+
+
+def peek_embedding_index(item_type: str, space: str = "text"):
+    """
+    The index if it is loaded, otherwise None and a background load is started. Used in requests: items added to the
+    catalog since the last sync are picked up in the background too, until then they have no embedding.
+    """
+    key = (item_type, space)
+    index = _embedding_indexes.get(key)
+    if index is None or index.needs_sync():
+        _schedule_build(key)
+    return index
+
+
+def add_visual_embedding(item_type: str, item_id, vector: np.ndarray):
+    """ Upload hook: stores the image embedding of a product photo or of a video's sampled frames"""
+    get_embedding_index(item_type, "visual").add(item_id, vector)
+
+
+def reset_embedding_indexes():
+    """ Forgets the loaded embedding indexes, the next use reloads them from disk. Waits for running background loads"""
+    with _builds_lock:
+        builds = list(_builds.values())
+        _builds.clear()
+    for build in builds:
+        build.cancel()
+    wait(builds)
+    with _embedding_indexes_lock:
+        _embedding_indexes.clear()
@@ -1,446 +1,407 @@
 from fastapi import HTTPException
 import pandas as pd
-import time
-from backend.src.database.db_utils import download_all_videos_metadata, download_all_products_metadata,  download_user_interactions
+from backend.src.database.db_utils import DEFAULT_USER_ID
+from backend.src.instrumentation import instrumented
+from backend.src.product_recommendation.scoring import other_categories_from, bucket_preference_vector, blend_session_profile
+from backend.src.product_recommendation.catalog_index import get_catalog_index
+from backend.src.product_recommendation.user_state import get_user_state
+from backend.src.product_recommendation.recommendation_cache import TTLLRUCache
+from backend.src.product_recommendation.embedding_index import peek_embedding_index
+from backend.src.product_recommendation.co_engagement import peek_co_engagement_index
+from backend.src.product_recommendation.diversity import diversify
 import numpy as np
-from datetime import datetime
 
-def _df_to_records(df: pd.DataFrame) -> list[dict]:
-    """Convert DataFrame to records replacing all NA/NaN variants with None for JSON safety."""
-    return [
-        {k: (None if pd.isna(v) else v) for k, v in rec.items()}
-        for rec in df.to_dict(orient="records")
-    ]
+# candidate sampling randomness (bucket draws, within bucket draws, exploration and the final shuffle)
+_rng = np.random.default_rng()
+
+
+def seed_recommendation_rng(seed: int):
+    """ Makes candidate sampling reproducible (tests, offline evaluation)"""
+    _rng.bit_generator.state = np.random.default_rng(seed).bit_generator.state
+
 
 # Number of video categories user needs to watch until they get 80% preferred products and 70% preferred videos. (Represents the usual total number of categories the average user is interested in)
 PROFILE_SATURATION_POINT = 4.0
 
-# caching product recommendations
-_products_recommendation_cache = {"data": None, "timestamp": 0, "ttl": 300, "n_recommended": 20}
+# exploration policy: "thompson" lets the user's bucket bandit decide how many slots of a page explore and in which
+# buckets, "fixed" is the previous split (80% preferred products / 70% preferred videos, ramped up over the first
+# PROFILE_SATURATION_POINT categories, the rest drawn uniformly). Switchable for offline replays
+EXPLORATION_POLICY = "thompson"
+EXPLORATION_POLICIES = ("thompson", "fixed")
+
+# share of the preferred slots filled by content similarity to the user's watched videos, the rest by bucket weighting
+EMBEDDING_BLEND_RATIO = 0.5
+# similar items are drawn from the SIMILAR_CANDIDATE_FACTOR * n nearest, weighted by similarity, so pages vary
+SIMILAR_CANDIDATE_FACTOR = 3
+# products: up to this share of the preferred slots (taken from the similarity share) are the products whose photos
+# look most like the frames of the user's RECENT_VIDEOS_FOR_VISUAL most recent, not skipped videos
+VISUAL_MATCH_RATIO = 0.25
+RECENT_VIDEOS_FOR_VISUAL = 5
+# videos: up to this share of the preferred slots (taken from the similarity share) are videos other users engaged
+# with in the same sessions as the user's RECENT_POSITIVES_FOR_CO_ENGAGEMENT latest positive videos
+CO_ENGAGEMENT_RATIO = 0.25
+RECENT_POSITIVES_FOR_CO_ENGAGEMENT = 10
+
+# order of a page: "shuffle" (random order), "interleave" (a bucket does not repeat within the diversity window when
+# the page allows it) or "mmr" (text similar items are kept apart as well). Switchable for offline comparisons
+RERANK_STRATEGY = "mmr"
+RERANK_STRATEGIES = ("shuffle", "interleave", "mmr")
+
+# caching product recommendations, keyed by (user_id, n_recommended, product catalog version), 5 minute TTL
+_products_recommendation_cache = TTLLRUCache(max_entries=4096, ttl_s=300)
+
+
+def invalidate_user_products_cache(user_id: str = DEFAULT_USER_ID):
+    """ Hook for new interactions and the refresh button: the user's next shop request is recomputed"""
+    _products_recommendation_cache.invalidate_user(user_id)
+
+
+def invalidate_products_cache():
+    """ Hook for product uploads: cached pages were sampled from the old catalog"""
+    _products_recommendation_cache.clear()
+
+
+def get_products_cache_stats() -> dict:
+    return _products_recommendation_cache.stats()
+
+
+def _draw_weighted(positions, scores, n: int) -> list[int]:
+    """ Up to n distinct positions drawn with probability proportional to their (positive) scores"""
+    weights = np.maximum(scores, 0.0).astype(np.float64)
+    n = min(n, int(np.count_nonzero(weights)))
+    if n == 0:
+        return []
+    return [int(pos) for pos in _rng.choice(positions, size=n, replace=False, p=weights / weights.sum())]
+
+
+@instrumented("recommendation.sample_similar")
+def _sample_similar(item_type: str, user_vector, n: int, excluded=()) -> list[int]:
+    """
+    Up to n distinct positions of items close to the user's content profile
+
+    :param user_vector: from UserState.content_profile, None gives no items
+    :param excluded: containers of positions to skip, like CatalogIndex.sample_weighted
+    """
+    # while the index is still loading the other candidate sources fill its share
+    index = peek_embedding_index(item_type)
+    if n <= 0 or user_vector is None or index is None:
+        return []
+    positions, scores = index.search(user_vector, SIMILAR_CANDIDATE_FACTOR * n, excluded)
+    return _draw_weighted(positions, scores, n)
+
+
+def _recent_videos(interactions: dict, usable, limit: int) -> list[int]:
+    """
+    Up to limit distinct video positions of the user's most recent usable interactions, newest first
+
+    :param usable: bool mask over the interactions
+    """
+    # newest first, interactions without a timestamp last
+    video_idx = np.asarray(interactions["video_idx"], dtype=np.int64)
+    order = np.argsort(-np.nan_to_num(interactions["interaction_epoch_s"], nan=-np.inf), kind="stable")
+    recent = []
+    for pos in video_idx[order[np.asarray(usable, dtype=bool)[order]]]:
+        if int(pos) not in recent:
+            recent.append(int(pos))
+            if len(recent) == limit:
+                break
+    return recent
+
+
+@instrumented("recommendation.sample_co_engaged")
+def _sample_co_engaged(interactions: dict, n: int, excluded=()) -> list[int]:
+    """
+    Up to n distinct positions of videos co-engaged with the user's latest positive videos (watched past 50%, not skipped)
+
+    :param excluded: containers of positions to skip, like CatalogIndex.sample_weighted
+    """
+    if n <= 0:
+        return []
+    positive = (
+        np.asarray(interactions["watched_50_pct"], dtype=bool)
+        & ~np.asarray(interactions["skipped_quickly"], dtype=bool)
+        & (np.asarray(interactions["video_idx"]) >= 0)
+    )
+    seeds = _recent_videos(interactions, positive, RECENT_POSITIVES_FOR_CO_ENGAGEMENT)
+    # while the index is still being built the other candidate sources fill its share
+    index = peek_co_engagement_index()
+    if not seeds or index is None:
+        return []
+    positions, scores = index.expand(seeds, SIMILAR_CANDIDATE_FACTOR * n, excluded)
+    return _draw_weighted(positions, scores, n)
+
+
+@instrumented("recommendation.exploration_plan")
+def _exploration_plan(user_state, catalog, n_recommended: int, n_unique_prefs: int, target_preferred_ratio: float):
+    """
+    (n_preferred, bucket of every exploration slot) of a page by EXPLORATION_POLICY. The fixed policy returns None
+    buckets, its exploration is uniform over the catalog
 
-def product_recommendation(n_recommended: int = 50) -> pd.DataFrame:
+    :param target_preferred_ratio: preferred share of the fixed policy once the profile is saturated
+    """
+    if EXPLORATION_POLICY == "fixed":
+        warmup_factor = min(1.0, n_unique_prefs / PROFILE_SATURATION_POINT)
+        return int(n_recommended * target_preferred_ratio * warmup_factor), None
+    explore_buckets = user_state.bandit.explore_slots(n_recommended, catalog.buckets(), _rng)
+    return n_recommended - len(explore_buckets), explore_buckets
+
+
+def _sample_explore(catalog, explore_buckets, n: int, excluded=()) -> list[int]:
+    """ n exploration positions, drawn from the planned buckets (as many as slots were planned), topped up uniformly"""
+    sampled = []
+    if explore_buckets is not None and len(explore_buckets):
+        # sample_weighted weighs items, per item weight slots / bucket size keeps the planned share of every bucket
+        slots = np.bincount(explore_buckets).astype(np.float64)
+        sizes = np.array([len(catalog.bucket_positions(b)) for b in range(len(slots))], dtype=np.float64)
+        sampled = catalog.sample_weighted(slots / np.maximum(sizes, 1.0), min(n, len(explore_buckets)), _rng, excluded=excluded)
+    return sampled + catalog.sample_uniform(n - len(sampled), _rng, excluded=(*excluded, set(sampled)))
+
+
+@instrumented("recommendation.page_order")
+def _page_order(item_type: str, catalog, positions) -> np.ndarray:
+    """ Shuffled page positions, re-ranked by RERANK_STRATEGY so neighbouring items differ"""
+    positions = _rng.permutation(np.array(positions, dtype=np.int64))
+    if RERANK_STRATEGY == "shuffle" or len(positions) < 2:
+        return positions
+    index = peek_embedding_index(item_type) if RERANK_STRATEGY == "mmr" else None
+    # without the index (still loading) the page is only interleaved by bucket
+    embeddings = index.vectors(positions) if index is not None else None
+    return positions[diversify(catalog.primary_buckets(positions), embeddings)]
+
+
+@instrumented("recommendation.visual_product_matches")
+def _visual_product_matches(interactions: dict, n: int) -> list[int]:
+    """
+    Up to n distinct positions of products visually closest to the user's most recent videos, taken in turns:
+    best match of the latest video, best match of the one before, ..., then the second best matches and so on
+    """
+    if n <= 0:
+        return []
+    video_visual, product_visual = peek_embedding_index("video", "visual"), peek_embedding_index("product", "visual")
+    if video_visual is None or product_visual is None:
+        return []
+
+    usable = ~np.asarray(interactions["skipped_quickly"], dtype=bool) & video_visual.has_vectors(interactions["video_idx"])
+    recent = _recent_videos(interactions, usable, RECENT_VIDEOS_FOR_VISUAL)
+    if not recent:
+        return []
+
+    matches = product_visual.search_many(video_visual.vectors(recent), n)
+    picked = []
+    for rank in range(n):
+        for positions, _ in matches:
+            if rank < len(positions) and int(positions[rank]) not in picked:
+                picked.append(int(positions[rank]))
+                if len(picked) == n:
+                    return picked
+    return picked
+
+
+@instrumented("recommendation.product")
+def product_recommendation(n_recommended: int = 50, user_id: str = DEFAULT_USER_ID) -> list[dict]:
     """
     Recommendation service that returns products in preferred categories with added randomness
 
     making it as efficient as possible using 
     1) caching
     2) vectorization
-    3) early filtering
+    3) catalog index (candidates are drawn per bucket, never by scanning the product catalog)
     4) numpy operations
+    5) embedding indexes (visually and textually similar products from blocked scans over memory mapped matrices)
 
-    Note: if you want to override caching either request a different number of products next time or refresh the shop
+    Note: if you want to override caching refresh the shop, watch a video or wait for the TTL
+
+    :param user_id: whose interactions and cached shop page are used
     """
     try:
 
         # NOTE: here "bucket" means category / genre
-        current_time = time.time()
-
-        # step 0 if n_recommended products requested is different from last time or the refresh button is clicked then clear the cache.
-        # TODO: add refresh logic
-        if n_recommended != _products_recommendation_cache["n_recommended"]:
-            _products_recommendation_cache["data"] = None
-
-        # Step 1 check cache (5 minute TTL)
-
-        if _products_recommendation_cache["data"] is not None:
-            if current_time - _products_recommendation_cache["timestamp"] < _products_recommendation_cache["ttl"]:
-                return _products_recommendation_cache["data"]
+        products = get_catalog_index("product")
+
+        # Step 1 check cache (5 minute TTL). Every page size of every user has its own entry, and a product upload
+        # bumps the catalog version so pages sampled from the old catalog are never served
+        cache_key = (user_id, n_recommended, products.version)
+        cached = _products_recommendation_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
-        # Step 2 get the parquet files and make dataframes out of:
-        # 1) user_interactions
-        # 2) video metadata
-        # 3) products metadata
+        # Step 2 get the user's state and the in memory catalog indexes (built from parquet once, kept in sync on upload):
+        # 1) user's integer coded interactions (interactions on unknown videos have video_idx -1 and are ignored)
+        # 2) video catalog index
+        # 3) product catalog index
 
-        user_interactions_df = download_user_interactions()
-        videos_df = download_all_videos_metadata()
-        products_df = download_all_products_metadata()
+        user_state = get_user_state(user_id)
+        interactions = user_state.interactions
+        videos = get_catalog_index("video")
 
-        if user_interactions_df.empty or products_df.empty or videos_df.empty:
+        if user_state.n_interactions == 0 or products.n_items == 0 or videos.n_items == 0:
             empty_result = []
-            _products_recommendation_cache["data"] = empty_result
-            _products_recommendation_cache["timestamp"] = current_time
+            _products_recommendation_cache.put(cache_key, empty_result)
             return empty_result
 
-        # Step 3 join user_interactions + video metadata on video_id column and keep only the rows for vids user watched
-
-        # Set indices on the dataframes for faster accessing modifying dataframe itself.
-        user_interactions_df = user_interactions_df.set_index("video_id")
-        videos_df = videos_df.set_index("video_id")
-
-        # left join dataframes keeping video info for the ones the user watched
-        interactions_with_buckets = user_interactions_df.join(videos_df)
-        
-        interactions_with_buckets = interactions_with_buckets.dropna(subset = ["bucket_num"])
-        # REFACTORED: Explode bucket_num so each bucket in the list gets its own row with the same watch_time
-        # This handles videos with multiple assigned categories (e.g., video has bucket_num=[1,2,3])
-        # After explode: each video-bucket pair gets attributed the full watch_time
-        interactions_with_buckets = interactions_with_buckets.reset_index().explode("bucket_num").set_index("video_id")
-        interactions_with_buckets["bucket_num"] = interactions_with_buckets["bucket_num"].astype(np.int32)
-        
-        # FEATURE: Distribute "other" category (bucket_num=13) watch time across all other categories
-        # while retaining a small portion for the "other" category itself.
-        other_bucket_id = 13
-        other_mask = interactions_with_buckets["bucket_num"] == other_bucket_id
-        other_interactions = interactions_with_buckets[other_mask].copy()
-        
-        if not other_interactions.empty:
-            # Dynamically fetch all unique categories from products
-            unique_categories = products_df["bucket_num"].dropna().astype(np.int32).unique()
-            other_categories = [cat for cat in unique_categories if cat != other_bucket_id]
-            
-            if not other_categories:
-                other_categories = [1]
-                
-            # Define how much weight stays with 'other' (e.g., 20%)
-            retention_ratio = 0.10
-            distribution_ratio = 1.0 - retention_ratio
-                
-            expanded_rows_list = []
-            for cat_id in other_categories:
-                expanded = other_interactions.copy()
-                expanded["bucket_num"] = cat_id
-                # Distribute the remaining watch_time equally across other categories
-                expanded["watch_time_ms"] = expanded["watch_time_ms"] * (distribution_ratio / len(other_categories))
-                expanded_rows_list.append(expanded)
-            
-            # Keep the original 'other' interactions but reduce their weight
-            reduced_other = other_interactions.copy()
-            reduced_other["watch_time_ms"] = reduced_other["watch_time_ms"] * retention_ratio
-            
-            # Combine expanded rows, reduced 'other' rows, and remove original full-weight "other" interactions
-            expanded_df = pd.concat(expanded_rows_list + [reduced_other], ignore_index=False)
-            interactions_with_buckets = interactions_with_buckets[~other_mask]
-            interactions_with_buckets = pd.concat([interactions_with_buckets, expanded_df], ignore_index=False)
-            
-        if interactions_with_buckets.empty:
-            # just recommend random products since no proper interaction data
-            result = _df_to_records(products_df.sample(min(n_recommended, len(products_df))))
-
-            _products_recommendation_cache["data"] = result
-            _products_recommendation_cache["timestamp"] = current_time
+        # step 3 per bucket engagement (explode, "other" distribution, engagement, recency, bincount) in the shared scoring core
+        # "other" watch time is distributed over all categories available in products
+        product_buckets = products.buckets()
+        max_bucket_id = int(max(videos.bucket_ids.max(initial=0), product_buckets.max(initial=0))) + 1
+        other_categories = other_categories_from(product_buckets)
+
+        bucket_watch_frequency_array = bucket_preference_vector(
+            **interactions,
+            bucket_ptr=videos.bucket_ptr,
+            bucket_ids=videos.bucket_ids,
+            other_categories=other_categories,
+            n_buckets=max_bucket_id,
+        )
+        # the last minutes of the session (kept in memory, updated on every interaction) shift the long-term shares
+        bucket_watch_frequency_array = blend_session_profile(
+            bucket_watch_frequency_array, user_state.session_profile(), other_categories
+        )
 
-            return result
-    
-        # step 4 build engagement scores per interaction
-        buckets_watched = interactions_with_buckets["bucket_num"].values.astype(np.int32)
-        watch_times = interactions_with_buckets["watch_time_ms"].values.astype(np.float32)
-
-        skipped = interactions_with_buckets["skipped_quickly"].fillna(False).astype(bool).values
-        watched_half = interactions_with_buckets["watched_50_pct"].fillna(False).astype(bool).values
-
-        # Penalise quick skips (0.1×), reward videos watched past halfway (1.5×)
-        engagement_scores = watch_times.copy()
-        engagement_scores[skipped] *= 0.1
-        engagement_scores[watched_half] *= 1.5
-        
-        # Recency weighting: exponential decay with 7-day half-life
-        now = datetime.now()
-        if 'interaction_timestamp' in interactions_with_buckets.columns:
-            try:
-                timestamps = interactions_with_buckets['interaction_timestamp']
-                days_ago = np.array([(now - pd.to_datetime(ts)).days for ts in timestamps])
-                recency_decay = np.exp(-days_ago / 7)
-                engagement_scores *= recency_decay
-            except Exception as e:
-                # If timestamp parsing fails, use all interactions with equal weight
-                print(f"Warning: Could not apply recency weighting: {e}")
-        else:
-            # Backward compatibility: interactions without timestamp column
-            # Treat old interactions as if they're 30 days old (low weight)
-            print("Warning: 'interaction_timestamp' column not found. Using uniform weights.")
-
-        products_bucket_num_max = products_df["bucket_num"].astype(np.int32).max()
-        max_bucket_id= int(max(buckets_watched.max(), products_bucket_num_max)) + 1
-
-        bucket_watch_frequency_array = np.bincount(buckets_watched, weights=engagement_scores, minlength=max_bucket_id)
-
-        # step 5 based on frequency of interaction weigh the preferred video buckets up that are available in products dataframe and normalize
+        # step 4 based on frequency of interaction weigh the preferred video buckets up that are available in products
         total_watch_time = np.sum(bucket_watch_frequency_array)
 
         if total_watch_time == 0:
             # user hasnt watched any videos so recommend random products
-            result = _df_to_records(products_df.sample(min(n_recommended, len(products_df))))
-            _products_recommendation_cache["data"] = result
-            _products_recommendation_cache["timestamp"] = current_time
+            result = products.get_records(products.sample_uniform(n_recommended, _rng))
+            _products_recommendation_cache.put(cache_key, result)
             return result
         
-        # step 6 sample from available products dataframe randomly picking rows with higher likelihood of choosing rows in higher weight buckets.
+        # step 5 sample products bucket by bucket, picking products in higher weight buckets with higher likelihood.
         preferred_buckets = np.where(bucket_watch_frequency_array > 0)[0]
 
-        product_buckets = products_df["bucket_num"].values.astype(np.int32)
-        preferred_product_buckets = np.isin(product_buckets, preferred_buckets)
-
-        # only recommending relevant products in subset of dataframe that are in buckets user interacted 
-        preferred_products_df = products_df[preferred_product_buckets].reset_index(drop = True)
-
-        if len(preferred_products_df) == 0:
+        if not any(len(products.bucket_positions(b)) for b in preferred_buckets):
             # edge case where no products in preferred categories
-            result = _df_to_records(products_df.sample(min(n_recommended, len(products_df))))
-            _products_recommendation_cache["data"] = result
-            _products_recommendation_cache["timestamp"] = current_time
+            result = products.get_records(products.sample_uniform(n_recommended, _rng))
+            _products_recommendation_cache.put(cache_key, result)
             return result
-        
-        # weighing and ranking the relevant buckets available in products dataframe based on interaction frequency
-        bucket_weights = bucket_watch_frequency_array[preferred_products_df["bucket_num"].values.astype(np.int32)]
-
-        # normalizing because need a normalized value between 0 and 1 for np random choice sampling
-        bucket_weights = bucket_weights.astype(np.float32)
-        bucket_weights = bucket_weights / np.sum(bucket_weights)
-        # --- Dynamic Exploration Warm-up ---
-        # Calculate how many unique categories the user actually prefers
-        n_unique_prefs = len(preferred_buckets)
-        
-        # Base split is 80-20, but scales down if they've seen very few categories
-        # e.g., 1 category = 20% preferred, 2 = 40%, 3 = 60%, 4+ = 80%
-        target_preferred_ratio = 0.80
-        warmup_factor = min(1.0, n_unique_prefs / PROFILE_SATURATION_POINT) 
-        dynamic_ratio = target_preferred_ratio * warmup_factor
-        
-        n_preferred = int(n_recommended * dynamic_ratio)
+
+        # --- Exploration budget ---
+        # Thompson sampling over the user's bucket arms decides how many products explore and in which buckets:
+        # few or mixed outcomes explore more, consistent ones in the known buckets less.
+        # (fixed policy: 80-20 scaled down while the user has seen few categories, 1 category = 20% preferred ... 4+ = 80%)
+        n_preferred, explore_buckets = _exploration_plan(user_state, products, n_recommended, len(preferred_buckets), 0.80)
         # ----------------------------------------
 
-        n_preferred_capped = min(n_preferred, len(preferred_products_df))
-        preferred_indices = np.random.choice(
-            len(preferred_products_df),
-            size = n_preferred_capped,
-            p = bucket_weights,
-            replace = False
+        # part of the preferred products look like the user's latest videos (product photo vs sampled frames),
+        # the rest of the similarity share are the products nearest to the text of everything the user watched
+        n_similar = int(n_preferred * EMBEDDING_BLEND_RATIO)
+        visual_matched = _visual_product_matches(interactions, min(n_similar, int(n_preferred * VISUAL_MATCH_RATIO)))
+        similar_sampled = visual_matched + _sample_similar(
+            "product", user_state.content_profile(), n_similar - len(visual_matched), excluded=(set(visual_matched),)
         )
 
-        # dataframe of recommended products based on user video preferences 
-        preferred_sampled = preferred_products_df.iloc[preferred_indices]
-
-        picked_ids = preferred_sampled["product_id"].values
-
-        # EXCLUSION MASK - get product ids series in preferred_products dataframe that have not been picked
-        remaining_products = ~products_df["product_id"].isin(picked_ids)
-        # reset index not required since we will just use pandas sample later (no fancy indexing operations)
-        exploratory_products_df = products_df[remaining_products].reset_index(drop = True)
-
-        # step 7 randomly sample from all products and mix in some randomness as well (EXPLORATION)
-        n_explore = n_recommended - n_preferred_capped
-
-        n_explore_capped = min(n_explore, len(exploratory_products_df))
-
-        if n_explore_capped > 0:
-            explore_sampled = exploratory_products_df.sample(
-                n = n_explore_capped,
-                replace = False
-            )
-        else:
-            # empty dataframe if no more unique products available in dataframe to explore
-            explore_sampled = pd.DataFrame()
+        # positions of recommended products based on user video preferences, capped by what the preferred buckets hold
+        preferred_sampled = similar_sampled + products.sample_weighted(
+            bucket_watch_frequency_array, n_preferred - len(similar_sampled), _rng, excluded=(set(similar_sampled),)
+        )
 
-        result_df = pd.concat([preferred_sampled, explore_sampled], ignore_index = True)
+        # step 6 exploration: products of the buckets the bandit picked, any product for slots left over (EXPLORATION)
+        # EXCLUSION - products already picked are skipped
+        n_explore = n_recommended - len(preferred_sampled)
+        explore_sampled = _sample_explore(products, explore_buckets, n_explore, excluded=(set(preferred_sampled),))
 
-        # shuffling result
-        result_df = result_df.sample(frac = 1).reset_index(drop= True)
+        # shuffling result, then spreading out same category / similar products
+        result_positions = _page_order("product", products, preferred_sampled + explore_sampled)
 
         # cache result and return 
-        _products_recommendation_cache["data"] = _df_to_records(result_df)
-        _products_recommendation_cache["timestamp"] = current_time
-        _products_recommendation_cache["n_recommended"] = n_recommended
-
-        result = _products_recommendation_cache["data"]
+        result = products.get_records(result_positions)
+        _products_recommendation_cache.put(cache_key, result)
         return result
     except Exception as e:
         raise HTTPException(status_code = 500, detail = f"product recommendation failed: {str(e)}")
 
-def video_recommendation(n_recommended: int = 10) -> list[dict]:
+@instrumented("recommendation.video")
+def video_recommendation(n_recommended: int = 10, user_id: str = DEFAULT_USER_ID) -> list[dict]:
     """
-    70/30 mix of weighted preferred videos and random exploration.
+    Mix of preferred videos (half co-engaged or content similar, half bucket weighted) and exploration, split per page
+    by EXPLORATION_POLICY.
     Keeps track of videos already recommended (assumes all were watched or user doesnt want to watch'em and recommends new ones)
     If no unwatched videos period or even in user preferred categories then videos are randomly selected 
-    """
-    videos_df = download_all_videos_metadata()
 
-    if videos_df.empty:
-        raise HTTPException("No video metadata available in database")
-    
-    if len(videos_df) <= n_recommended:
-        return _df_to_records(videos_df)
+    :param user_id: whose interactions and watched videos are used
+    """
+    videos = get_catalog_index("video")
 
-    # If fewer than n videos exist in the database , return all
-    if len(videos_df) <= n_recommended:
-        return _df_to_records(videos_df)
+    if videos.n_items == 0:
+        raise HTTPException(status_code = 404, detail = "No video metadata available in database")
 
-    user_interactions_df = download_user_interactions()
+    # If fewer than n videos exist in the database, return all the user has not watched yet (all once everything
+    # was watched), shuffled and re-ranked like any page
+    if videos.n_items <= n_recommended:
+        positions = np.arange(videos.n_items)
+        unwatched = positions[~get_user_state(user_id).watched.contains(positions)]
+        return videos.get_records(_page_order("video", videos, unwatched if len(unwatched) else positions))
 
     try:
         # Step 1: Fallback if user has no interactions yet
-        if user_interactions_df.empty:
-            return _df_to_records(videos_df.sample(min(n_recommended, len(videos_df))))
-            
-        # step 2: Join interactions with video metadata to get bucket_num (category of videos interacted with)
-        ui_df = user_interactions_df.set_index("video_id")
-        v_df = videos_df.set_index("video_id")
-
-        interactions_with_buckets = ui_df.join(v_df).dropna(subset=["bucket_num"])
-        # Explode bucket_num so each bucket gets its own row with the same watch_time
-        interactions_with_buckets = interactions_with_buckets.reset_index().explode("bucket_num").set_index("video_id")
-        
-        # FIX: Cast to int32 before creating the mask so `== 13` works correctly
-        interactions_with_buckets["bucket_num"] = interactions_with_buckets["bucket_num"].astype(np.int32)
-        
-        # FEATURE: Distribute "other" category (bucket_num=13) watch time across all other categories
-        # while retaining a small portion for the "other" category itself.
-        other_bucket_id = 13
-        other_mask = interactions_with_buckets["bucket_num"] == other_bucket_id
-        other_interactions = interactions_with_buckets[other_mask].copy()
-        
-        if not other_interactions.empty:
-            # Dynamically fetch all unique categories from the video catalog
-            unique_categories = videos_df["bucket_num"].explode().dropna().astype(np.int32).unique()
-            
-            # Distribute evenly across all available categories EXCEPT 'other' (13)
-            other_categories = [cat for cat in unique_categories if cat != other_bucket_id]
-            
-            # Fallback in case no other categories exist
-            if not other_categories:
-                other_categories = [1]
-                
-            # Define how much weight stays with 'other' (e.g., 10%)
-            retention_ratio = 0.10
-            distribution_ratio = 1.0 - retention_ratio
-                
-            expanded_rows_list = []
-            for cat_id in other_categories:
-                expanded = other_interactions.copy()
-                expanded["bucket_num"] = cat_id
-                # Distribute the remaining watch_time equally across other categories
-                expanded["watch_time_ms"] = expanded["watch_time_ms"] * (distribution_ratio / len(other_categories))
-                expanded_rows_list.append(expanded)
+        user_state = get_user_state(user_id)
+        if user_state.n_interactions == 0:
+            return videos.get_records(videos.sample_uniform(n_recommended, _rng))
             
-            # Keep the original 'other' interactions but reduce their weight
-            reduced_other = other_interactions.copy()
-            reduced_other["watch_time_ms"] = reduced_other["watch_time_ms"] * retention_ratio
-            
-            # Combine expanded rows, reduced 'other' rows, and remove original full-weight "other" interactions
-            expanded_df = pd.concat(expanded_rows_list + [reduced_other], ignore_index=False)
-            interactions_with_buckets = interactions_with_buckets[~other_mask]
-            interactions_with_buckets = pd.concat([interactions_with_buckets, expanded_df], ignore_index=False)
-
-        if interactions_with_buckets.empty:
-            return _df_to_records(videos_df.sample(min(n_recommended, len(videos_df))))
+        # step 2: the user's interactions, integer coded against the catalog index (unknown videos have video_idx -1)
+        interactions = user_state.interactions
+
+        # Step 3: per bucket engagement (explode, "other" distribution, engagement, recency, bincount) in the shared scoring core
+        # "other" watch time is distributed over all categories available in the video catalog
+        other_categories = other_categories_from(videos.buckets())
+        bucket_watch_frequency_array = bucket_preference_vector(
+            **interactions,
+            bucket_ptr=videos.bucket_ptr,
+            bucket_ids=videos.bucket_ids,
+            other_categories=other_categories,
+            n_buckets=int(videos.bucket_ids.max(initial=0)) + 1,
+        )
+        # the last minutes of the session (kept in memory, updated on every interaction) shift the long-term shares
+        bucket_watch_frequency_array = blend_session_profile(
+            bucket_watch_frequency_array, user_state.session_profile(), other_categories
+        )
 
-        # Step 3: Calculate engagement scores per interaction
-        buckets_watched = interactions_with_buckets["bucket_num"].values.astype(np.int32)
-        watch_times = interactions_with_buckets["watch_time_ms"].values.astype(np.float32)
+        if bucket_watch_frequency_array.sum() == 0:
+            return videos.get_records(videos.sample_uniform(n_recommended, _rng))
 
-        skipped = interactions_with_buckets["skipped_quickly"].fillna(False).astype(bool).values
-        watched_half = interactions_with_buckets["watched_50_pct"].fillna(False).astype(bool).values
+        # step 4: videos the user has already watched are rejected by a bitmap test while sampling
+        watched = user_state.watched
 
-        # Penalise quick skips (0.1×), reward videos watched past halfway (1.5×)
-        engagement_scores = watch_times.copy()
-        engagement_scores[skipped] *= 0.1
-        engagement_scores[watched_half] *= 1.5
-        
-        # Recency weighting: exponential decay with 7-day half-life
-        now = datetime.now()
-        if 'interaction_timestamp' in interactions_with_buckets.columns:
-            try:
-                timestamps = interactions_with_buckets['interaction_timestamp']
-                days_ago = np.array([(now - pd.to_datetime(ts)).days for ts in timestamps])
-                recency_decay = np.exp(-days_ago / 7)
-                engagement_scores *= recency_decay
-            except Exception as e:
-                # If timestamp parsing fails, use all interactions with equal weight
-                print(f"Warning: Could not apply recency weighting: {e}")
-        else:
-            # Backward compatibility: interactions without timestamp column
-            # Treat old interactions as if they're 30 days old (low weight)
-            print("Warning: 'interaction_timestamp' column not found. Using uniform weights.")
-
-        # determining max bucket id across all exploded video buckets for the category watch frequency array
-        vid_bucket_num_max = videos_df["bucket_num"].explode().astype(np.int32).max()
-        max_bucket_id = int(max(buckets_watched.max(), vid_bucket_num_max)) + 1
-
-        bucket_watch_frequency_array = np.bincount(buckets_watched, weights=engagement_scores, minlength=max_bucket_id)
-
-        # step 4: remove videos the user has already watched
-        watched_video_ids = user_interactions_df["video_id"].unique()
-        unwatched_videos_df = videos_df[~videos_df["video_id"].isin(watched_video_ids)].copy()
-
-        if unwatched_videos_df.empty:
+        if len(watched) >= videos.n_items:
             # edge case: user literally watched every video in the database. So just give them random watched videos
-            return _df_to_records(videos_df.sample(min(n_recommended, len(videos_df))))
-        
-        # Explode unwatched_videos_df so each bucket gets its own row
-        # This allows proper filtering since unwatched_videos_df has bucket_num as lists (not single values)
-        # After explode: can safely convert bucket_num to int32 and index into bucket_watch_frequency_array
-        unwatched_videos_df = unwatched_videos_df.reset_index().explode("bucket_num").set_index("video_id")
-        unwatched_videos_df["bucket_num"] = unwatched_videos_df["bucket_num"].astype(np.int32)
-        
-        # step 5: filtering unwatched videos into preferred categories
-        unwatched_buckets = unwatched_videos_df["bucket_num"].values.astype(np.int32)
-        preferred_mask = bucket_watch_frequency_array[unwatched_buckets] > 0
-
-        # Reset index to make video_id a column before filtering
-        # This preserves video_id as a column for later operations
-        unwatched_videos_df = unwatched_videos_df.reset_index(drop=False)
-        # NEW: Count unique preferred categories for dynamic scaling of relevant vs random video recommendation
+            return videos.get_records(videos.sample_uniform(n_recommended, _rng))
+
+        # Step 5: how many videos explore and in which buckets, by the exploration policy.
+        # Thompson sampling over the user's bucket arms: the exploration arm (outcomes of videos in categories the user
+        # had never seen) competes per slot with the best known category, so a fresh user with one category explores
+        # a lot and the share shrinks as the known categories collect consistent outcomes.
+        # (fixed policy: 70-30, ramped up over the first PROFILE_SATURATION_POINT categories so the first watched
+        # video does not turn the whole feed into its category)
         n_unique_prefs = np.count_nonzero(bucket_watch_frequency_array > 0)
+        n_preferred, explore_buckets = _exploration_plan(user_state, videos, n_recommended, n_unique_prefs, 0.7)
+
+        # part of the preferred videos are unwatched ones other users engaged with in the same sessions as the user's
+        # latest positive videos, the rest of the similarity share are the ones closest in content to what the user watched
+        n_similar = int(n_preferred * EMBEDDING_BLEND_RATIO)
+        co_engaged = _sample_co_engaged(interactions, min(n_similar, int(n_preferred * CO_ENGAGEMENT_RATIO)), excluded=(watched,))
+        similar_sampled = co_engaged + _sample_similar(
+            "video", user_state.content_profile(), n_similar - len(co_engaged), excluded=(watched, set(co_engaged))
+        )
 
-        
-        # only keeping unwatched videos whose category has been watched by the user before
-        preferred_vids_df = unwatched_videos_df[preferred_mask]
-
-        if preferred_vids_df.empty:
-            # if no videos are preferred... maybe because all videos in categories user prefers are watched, recommend random videos watched or unwatched 
-            return _df_to_records(videos_df.sample(min(n_recommended, len(videos_df))))
-        
-        # Drop duplicates to get unique videos (since explode created multiple rows per video with different buckets)
-        preferred_vids_df = preferred_vids_df.drop_duplicates(subset=["video_id"])
-        
-        # Step 6: Preferred videos sampled weighted using bucket interaction frequency.
-        # slowly increase the ratio of preferred videos recommended as we watch more categories
-        # fixing issue where when app is started fresh with no interactions, the moment a user sees their first video, All subsequent product recommendations are 80% from that category and all subsequent video recommendations are 70% from that one category, since that is the only preferred category.
-
-        # To fix this we slowly ramp up the percentage of preferred content recommended as a function of number of unique categories the user watched.
-
-        # If the user watched videos from over 3 unique categories recommendation split is back to normal (70% for videos, 30% for products)
-        target_preferred_ratio = 0.7
-        warmup_factor = min(1.0, n_unique_prefs / PROFILE_SATURATION_POINT)
-        dynamic_ratio = target_preferred_ratio * warmup_factor
-        n_preferred = int(n_recommended * dynamic_ratio)
-        # making sure the number of preferred videos we recommend does not exceed the number of those preferred videos available
-        n_preferred_capped = min(n_preferred, len(preferred_vids_df))
-
-        # Map the bucket weights to specififc rows in our preferred dataframe
-        pref_vids_buckets = preferred_vids_df["bucket_num"].values.astype(np.int32)
-        vid_weights = bucket_watch_frequency_array[pref_vids_buckets].astype(np.float32)
-        vid_weights /= np.sum(vid_weights) #normalize to bring weights between 0 and 1 so that np random choice can do its thing
-
-        preferred_indices = np.random.choice(
-            len(preferred_vids_df),
-            size = n_preferred_capped,
-            p = vid_weights,
-            replace = False # no duplicates
+        # the rest: buckets are drawn by weight and videos uniformly inside a bucket, watched videos are skipped
+        # the number of preferred videos is capped by the unwatched videos the preferred buckets hold
+        preferred_sampled = similar_sampled + videos.sample_weighted(
+            bucket_watch_frequency_array, n_preferred - len(similar_sampled), _rng,
+            excluded=(watched, set(similar_sampled)),
         )
 
-        preferred_sampled = preferred_vids_df.iloc[preferred_indices]
+        if n_preferred > 0 and not preferred_sampled:
+            # if no videos are preferred... maybe because all videos in categories user prefers are watched, recommend random videos watched or unwatched 
+            return videos.get_records(videos.sample_uniform(n_recommended, _rng))
 
-        # step 7: 30% exploratory sampling (randomly choose from remaining set of unwatched videos)
-        picked_ids = preferred_sampled["video_id"].values
-        exploratory_vids_df = unwatched_videos_df[~unwatched_videos_df["video_id"].isin(picked_ids)]
-        
-        # Drop duplicates to get unique videos for exploration set
-        exploratory_vids_df = exploratory_vids_df.drop_duplicates(subset=["video_id"])
-
-        n_explore = n_recommended - n_preferred_capped
-        # making sure that the number of exploratory videos recommended doesnt exceed the number of those videos available.
-        n_explore_capped = min(n_explore, len(exploratory_vids_df))
-        explore_sampled = pd.DataFrame()
-        if n_explore_capped > 0:
-            explore_sampled = exploratory_vids_df.sample(n = n_explore_capped, replace = False)
-        
-        # Step 8 combine and shuffle and return 
+        # step 6: exploratory sampling (unwatched videos of the buckets the bandit picked, any unwatched video for the rest)
+        n_explore = n_recommended - len(preferred_sampled)
+        explore_sampled = _sample_explore(videos, explore_buckets, n_explore, excluded=(watched, set(preferred_sampled)))
 
-        result_df = pd.concat([preferred_sampled, explore_sampled], ignore_index = True)
+        # Step 7 combine, shuffle, spread out same category / similar videos and return
+        result_positions = _page_order("video", videos, preferred_sampled + explore_sampled)
 
-        result_df = result_df.sample(frac = 1).reset_index(drop = True)
-        
-        return _df_to_records(result_df)
+        return videos.get_records(result_positions)
 
     except Exception as e:
         raise HTTPException(status_code = 500, detail = f"video recommendation failed: {str(e)}")
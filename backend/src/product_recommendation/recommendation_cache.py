@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLLRUCache:
+    """
+    Thread safe cache with a time to live per entry and least recently used eviction once max_entries is reached.
+    Keys are tuples whose first element is the user id, so one user's entries can be invalidated together.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl_s: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0, "invalidated": 0}
+
+    def get(self, key, now: float = None):
+        """ Cached value or None on a miss (absent or older than ttl_s)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            stored_at, value = entry
+            if now - stored_at >= self.ttl_s:
+                del self._entries[key]
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def put(self, key, value, now: float = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evicted"] += 1
+
+    def invalidate_user(self, user_id: str):
+        """ Drops every entry of user_id"""
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == user_id]
+            for key in keys:
+                del self._entries[key]
+            self._stats["invalidated"] += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._stats["invalidated"] += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,249 @@
+import logging
+import threading
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from backend.src.database.db_utils import DEFAULT_USER_ID
+from backend.src.instrumentation import instrumented
+from backend.src.product_recommendation.personalized_recommendation import video_recommendation, product_recommendation
+from backend.src.product_recommendation.user_state import MAX_CACHED_USERS, get_user_state
+from backend.src.product_recommendation.catalog_index import get_catalog_index
+
+logger = logging.getLogger(__name__)
+
+# feed pool per user: refilled up to VIDEO_POOL_SIZE in the background once fewer than VIDEO_POOL_LOW_WATERMARK are left.
+# the watermark stays above FEED_SESSION_SIZE so a new feed session is normally served from the pool
+VIDEO_POOL_SIZE = 150
+VIDEO_POOL_LOW_WATERMARK = 60
+
+# cursor feed: a session takes FEED_SESSION_SIZE candidates from the pool once, its pages are slices of that list
+FEED_SESSION_SIZE = 50
+MAX_FEED_SESSIONS = 4096
+
+_POOL_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="recommendation-pool")
+
+
+class _VideoPool:
+    """
+    Ready to serve feed videos of one user. generation is bumped by every interaction, a refill that started
+    before the bump samples again so the pool always reflects the latest profile.
+    """
+
+    def __init__(self):
+        self.records = deque()
+        self.generation = 0
+        self.stale = False
+        self.refilling = False
+        self.lock = threading.Lock()
+
+
+_video_pools = OrderedDict()
+# page sizes each user requested from the shop, their pages are recomputed in the background after invalidation
+_shop_page_sizes = OrderedDict()
+# session id -> {"user_id", "records"}
+_feed_sessions = OrderedDict()
+_pools_lock = threading.Lock()
+
+
+def _get_video_pool(user_id: str) -> _VideoPool:
+    with _pools_lock:
+        pool = _video_pools.get(user_id)
+        if pool is None:
+            pool = _VideoPool()
+            _video_pools[user_id] = pool
+            while len(_video_pools) > MAX_CACHED_USERS:
+                _video_pools.popitem(last=False)
+        _video_pools.move_to_end(user_id)
+        return pool
+
+
+def _refill_video_pool(user_id: str, pool: _VideoPool):
+    try:
+        while True:
+            with pool.lock:
+                generation = pool.generation
+            # no more than the unwatched videos (and fewer than the whole catalog) so small catalogs are sampled and
+            # scored like big ones instead of taking video_recommendation's whole catalog path
+            videos = get_catalog_index("video")
+            n_unwatched = videos.n_items - len(get_user_state(user_id).watched)
+            fresh = video_recommendation(max(min(VIDEO_POOL_SIZE, n_unwatched, videos.n_items - 1), 1), user_id)
+
+            with pool.lock:
+                if generation != pool.generation:
+                    # an interaction arrived while sampling, sample again with it
+                    continue
+                if pool.stale:
+                    pool.records.clear()
+                    pool.stale = False
+
+                pooled_ids = {record["video_id"] for record in pool.records}
+                added = 0
+                for record in fresh:
+                    if len(pool.records) >= VIDEO_POOL_SIZE:
+                        break
+                    if record["video_id"] not in pooled_ids:
+                        pool.records.append(record)
+                        pooled_ids.add(record["video_id"])
+                        added += 1
+
+                # a small catalog may not have VIDEO_POOL_LOW_WATERMARK distinct videos to offer
+                if len(pool.records) >= VIDEO_POOL_LOW_WATERMARK or added == 0:
+                    pool.refilling = False
+                    return
+    except Exception:
+        logger.exception("Error refilling video pool of %s", user_id)
+        with pool.lock:
+            pool.refilling = False
+
+
+def _schedule_video_refill(user_id: str, pool: _VideoPool):
+    with pool.lock:
+        if pool.refilling:
+            return
+        pool.refilling = True
+    _POOL_EXECUTOR.submit(_refill_video_pool, user_id, pool)
+
+
+def pop_videos(n_recommended: int = 10, user_id: str = DEFAULT_USER_ID) -> list[dict]:
+    """
+    Next n_recommended feed videos from the user's pool. Only a cold or drained pool computes in the request,
+    either way a background refill is scheduled once the pool is below the low watermark.
+    """
+    pool = _get_video_pool(user_id)
+    with pool.lock:
+        if len(pool.records) >= n_recommended:
+            recommended = [pool.records.popleft() for _ in range(n_recommended)]
+        else:
+            recommended = None
+        below_watermark = len(pool.records) < VIDEO_POOL_LOW_WATERMARK
+
+    if recommended is None:
+        recommended = video_recommendation(n_recommended, user_id)
+    if below_watermark:
+        _schedule_video_refill(user_id, pool)
+    return recommended
+
+
+def _new_feed_session(user_id: str):
+    session_id = uuid.uuid4().hex
+    pool = _get_video_pool(user_id)
+    with pool.lock:
+        generation = pool.generation
+    session = {"user_id": user_id, "records": pop_videos(FEED_SESSION_SIZE, user_id), "generation": generation}
+    with _pools_lock:
+        _feed_sessions[session_id] = session
+        while len(_feed_sessions) > MAX_FEED_SESSIONS:
+            _feed_sessions.popitem(last=False)
+    return session_id, session
+
+
+def _resume_feed_session(cursor: str, user_id: str):
+    """ (session_id, session, offset) for a cursor of user_id, None if it is malformed, expired or someone else's"""
+    session_id, _, offset = cursor.partition(".")
+    with _pools_lock:
+        session = _feed_sessions.get(session_id)
+        if session is not None:
+            _feed_sessions.move_to_end(session_id)
+    if session is None or session["user_id"] != user_id or not offset.isdigit():
+        return None
+    return session_id, session, int(offset)
+
+
+def _refresh_feed_session(session: dict, offset: int):
+    """
+    Once the pool was rebuilt after the user's latest interactions, the candidates the session has not served yet
+    are swapped for fresh ones from the pool, so the next page follows the last swipes. Served ones keep their offsets.
+    """
+    pool = _get_video_pool(session["user_id"])
+    with pool.lock:
+        generation = pool.generation
+        if generation == session["generation"] or pool.stale:
+            return
+    served = session["records"][:offset]
+    served_ids = {record["video_id"] for record in served}
+    fresh = [record for record in pop_videos(FEED_SESSION_SIZE, session["user_id"]) if record["video_id"] not in served_ids]
+    session["records"], session["generation"] = served + fresh, generation
+
+
+@instrumented("recommendation.feed_page")
+def get_feed_page(n_recommended: int = 10, user_id: str = DEFAULT_USER_ID, cursor: str = None, _continued: bool = False) -> dict:
+    """
+    One page of the cursor feed. Without a (valid) cursor a new session is started, otherwise the page continues
+    the session's candidate list where the cursor points. Videos watched since the session started are skipped
+    on the way, so a page costs O(page) whatever the catalog or history size.
+
+    :return: {"videos": page, "next_cursor": cursor of the following page}
+    """
+    resumed = _resume_feed_session(cursor, user_id) if cursor else None
+    if resumed is None:
+        session_id, session = _new_feed_session(user_id)
+        offset = 0
+    else:
+        session_id, session, offset = resumed
+        _refresh_feed_session(session, offset)
+
+    watched = get_user_state(user_id).watched
+    videos = get_catalog_index("video")
+    # a user who watched everything gets rewatches, same as video_recommendation
+    skip_watched = len(watched) < videos.n_items
+    records = session["records"]
+
+    page = []
+    while len(page) < n_recommended and offset < len(records):
+        record = records[offset]
+        offset += 1
+        pos = videos.position.get(record["video_id"])
+        if not skip_watched or pos is None or pos not in watched:
+            page.append(record)
+
+    if len(page) < n_recommended and not _continued:
+        # session used up: the rest of the page and the cursor come from a fresh session
+        rest = get_feed_page(n_recommended - len(page), user_id, None, _continued=True)
+        page_ids = {record["video_id"] for record in page}
+        page += [record for record in rest["videos"] if record["video_id"] not in page_ids]
+        return {"videos": page, "next_cursor": rest["next_cursor"]}
+
+    return {"videos": page, "next_cursor": f"{session_id}.{offset}"}
+
+
+@instrumented("recommendation.shop_page")
+def get_shop_page(n_recommended: int = 20, user_id: str = DEFAULT_USER_ID) -> list[dict]:
+    """ Shop page from the product cache, the page size is remembered so refresh_shop_pages can precompute it"""
+    with _pools_lock:
+        _shop_page_sizes.setdefault(user_id, set()).add(n_recommended)
+        _shop_page_sizes.move_to_end(user_id)
+        while len(_shop_page_sizes) > MAX_CACHED_USERS:
+            _shop_page_sizes.popitem(last=False)
+    return product_recommendation(n_recommended, user_id)
+
+
+def refresh_shop_pages(user_id: str = DEFAULT_USER_ID):
+    """ Recomputes the user's invalidated shop pages in the background so the next shop request is a cache hit"""
+    with _pools_lock:
+        page_sizes = list(_shop_page_sizes.get(user_id, ()))
+    for n_recommended in page_sizes:
+        _POOL_EXECUTOR.submit(product_recommendation, n_recommended, user_id)
+
+
+def on_interaction(user_id: str, video_id: str):
+    """
+    Interaction hook: drops the watched video from the user's feed pool, marks the pool for a rebuild with the
+    new profile (served as is until the rebuild lands) and precomputes the user's shop pages.
+    """
+    with _pools_lock:
+        pool = _video_pools.get(user_id)
+    if pool is not None:
+        with pool.lock:
+            pool.records = deque(record for record in pool.records if record["video_id"] != video_id)
+            pool.generation += 1
+            pool.stale = True
+        _schedule_video_refill(user_id, pool)
+    refresh_shop_pages(user_id)
+
+
+def reset_pools():
+    """ Forgets every pooled feed, feed session and shop page size, e.g. after the interaction log was rewritten outside the service"""
+    with _pools_lock:
+        _video_pools.clear()
+        _feed_sessions.clear()
+        _shop_page_sizes.clear()
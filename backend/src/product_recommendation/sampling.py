@@ -0,0 +1,34 @@
+import numpy as np
+
+
+class AliasSampler:
+    """
+    Vose alias table over non negative float64 weights: O(n) to build, O(1) per draw (with replacement).
+    Weights are never normalized to float32, only their float64 ratios to the mean matter.
+    """
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        n = len(weights)
+        total = weights.sum()
+        if n == 0 or not total > 0:
+            raise ValueError("AliasSampler needs at least one positive weight")
+
+        self.n = n
+        self.prob = weights * (n / total)
+        self.alias = np.arange(n, dtype=np.int64)
+
+        small = [i for i in range(n) if self.prob[i] < 1.0]
+        large = [i for i in range(n) if self.prob[i] >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.alias[s] = l
+            self.prob[l] -= 1.0 - self.prob[s]
+            (small if self.prob[l] < 1.0 else large).append(l)
+        # whatever is left is 1 up to rounding
+        self.prob[small + large] = 1.0
+
+    def draw(self, rng, size: int) -> np.ndarray:
+        """ size indices drawn with replacement, P(i) = weights[i] / sum(weights)"""
+        idx = rng.integers(self.n, size=size)
+        return np.where(rng.random(size) < self.prob[idx], idx, self.alias[idx])
@@ -0,0 +1,302 @@
+import itertools
+import numpy as np
+import pandas as pd
+from backend.src.database.db_utils import DEFAULT_USER_ID
+from backend.src.instrumentation import instrumented
+
+# "other" category (bucket_num=13) watch time is spread over every other category, this share stays with "other"
+OTHER_BUCKET_ID = 13
+OTHER_RETENTION_RATIO = 0.10
+
+# Penalise quick skips (0.1×), reward videos watched past halfway (1.5×)
+SKIP_PENALTY = 0.1
+HALF_WATCH_BOOST = 1.5
+
+# Recency weighting: exp(-days_ago / 7)
+RECENCY_DECAY_DAYS = 7.0
+SECONDS_PER_DAY = 86400.0
+
+# short-term session profile: the same engagement weights, halved every SESSION_HALF_LIFE_S seconds
+SESSION_HALF_LIFE_S = 120.0
+# the session profile takes up to SESSION_PROFILE_WEIGHT of the blended preference, the full share once it holds
+# SESSION_FULL_WEIGHT_MS of (decayed) engagement, so it fades out with the session
+SESSION_PROFILE_WEIGHT = 0.5
+SESSION_FULL_WEIGHT_MS = 60_000.0
+
+# reference time of the recency decay and the session profile, None = the wall clock. Offline replays pin it to the
+# time of the replayed interaction so a months old log decays like it did when it was recorded
+_clock_epoch_s = None
+
+
+def set_clock(epoch_s: float = None):
+    """ Pins now_epoch_s() to epoch_s (naive local time like the stored timestamps), None goes back to the wall clock"""
+    global _clock_epoch_s
+    _clock_epoch_s = None if epoch_s is None else float(epoch_s)
+
+
+def now_epoch_s() -> float:
+    """ Epoch seconds of local now, or of the pinned replay time"""
+    clock_epoch_s = _clock_epoch_s
+    if clock_epoch_s is not None:
+        return clock_epoch_s
+    return pd.Timestamp.now().value / 1e9
+
+
+def encode_video_buckets(videos_df: pd.DataFrame):
+    """
+    Integer codes for the video catalog.
+
+    :return: (video_index, bucket_ptr, bucket_ids) where video_index maps video_id -> dense video position and
+             the buckets of video i are bucket_ids[bucket_ptr[i]:bucket_ptr[i + 1]] (CSR layout of the bucket_num lists)
+    """
+    videos_df = videos_df.drop_duplicates(subset=["video_id"])
+    bucket_lists = videos_df["bucket_num"].tolist()
+
+    counts = np.fromiter((len(b) for b in bucket_lists), dtype=np.int64, count=len(bucket_lists))
+    bucket_ptr = np.zeros(len(bucket_lists) + 1, dtype=np.int64)
+    np.cumsum(counts, out=bucket_ptr[1:])
+
+    # bucket_num values are zero padded strings like "04", astype parses them
+    bucket_ids = np.array(list(itertools.chain.from_iterable(bucket_lists))).astype(np.int64)
+
+    return pd.Index(videos_df["video_id"].to_numpy()), bucket_ptr, bucket_ids
+
+
+def encode_interactions(user_interactions_df: pd.DataFrame, video_index: pd.Index) -> dict:
+    """
+    Integer / float codes for the interaction log. Interactions on videos missing from video_index get video_idx -1,
+    timestamps that cannot be parsed get NaN epoch seconds (no recency decay).
+    """
+    n = len(user_interactions_df)
+
+    if "interaction_timestamp" in user_interactions_df.columns:
+        timestamps = pd.to_datetime(user_interactions_df["interaction_timestamp"], errors="coerce", format="ISO8601")
+        if timestamps.dt.tz is not None:
+            timestamps = timestamps.dt.tz_convert(None)
+        epoch_s = timestamps.to_numpy(dtype="datetime64[ns]").astype(np.int64) / 1e9
+        epoch_s[timestamps.isna().to_numpy()] = np.nan
+    else:
+        # Backward compatibility: interactions without timestamp column get uniform weights
+        epoch_s = np.full(n, np.nan)
+
+    return {
+        "video_idx": video_index.get_indexer(user_interactions_df["video_id"]),
+        "watch_time_ms": user_interactions_df["watch_time_ms"].to_numpy(dtype=np.float64),
+        "skipped_quickly": user_interactions_df["skipped_quickly"].fillna(False).astype(bool).to_numpy(),
+        "watched_50_pct": user_interactions_df["watched_50_pct"].fillna(False).astype(bool).to_numpy(),
+        "interaction_epoch_s": epoch_s,
+    }
+
+
+def _interaction_key(user_id, video_id, epoch_s, watch_time_ms) -> tuple:
+    return (
+        str(user_id), str(video_id), None if np.isnan(epoch_s) else round(epoch_s * 1e3),
+        None if pd.isna(watch_time_ms) else float(watch_time_ms),
+    )
+
+
+def logged_interactions(user_interactions_df: pd.DataFrame, epoch_s, interactions: list) -> np.ndarray:
+    """
+    Which interactions (interaction hook payloads) are rows of the log, matched on user, video, timestamp and watch time.
+    A hook runs after its row is written, so a load of the log that overlaps the hook may or may not have read the row.
+
+    :param epoch_s: interaction_epoch_s of encode_interactions(user_interactions_df)
+    """
+    if not interactions or len(user_interactions_df) == 0:
+        return np.zeros(len(interactions), dtype=bool)
+    user_ids = [interaction.get("user_id", DEFAULT_USER_ID) for interaction in interactions]
+    # only the rows of these users are keyed, the log may hold every user
+    rows = user_interactions_df["user_id"].isin(set(user_ids)).to_numpy()
+    logged = set(map(
+        _interaction_key,
+        user_interactions_df["user_id"].to_numpy()[rows], user_interactions_df["video_id"].to_numpy()[rows],
+        np.asarray(epoch_s, dtype=np.float64)[rows], user_interactions_df["watch_time_ms"].to_numpy()[rows],
+    ))
+    return np.array([
+        _interaction_key(user_id, interaction["video_id"], timestamp_epoch_s(interaction.get("interaction_timestamp")),
+                         interaction.get("watch_time_ms")) in logged
+        for user_id, interaction in zip(user_ids, interactions)
+    ], dtype=bool)
+
+
+def timestamp_epoch_s(value) -> float:
+    """ Epoch seconds of one interaction_timestamp like encode_interactions: aware times in UTC, NaN if unparseable"""
+    try:
+        timestamp = pd.Timestamp(value)
+    except (TypeError, ValueError):
+        return np.nan
+    if pd.isna(timestamp):
+        return np.nan
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert(None)
+    return timestamp.value / 1e9
+
+
+def encode_interaction(interaction: dict, video_position: dict) -> dict:
+    """
+    encode_interactions of a single logged interaction, without building a DataFrame (per interaction hooks)
+
+    :param video_position: video_id -> dense video position (CatalogIndex.position)
+    """
+    return {
+        "video_idx": np.array([video_position.get(interaction["video_id"], -1)], dtype=np.int64),
+        "watch_time_ms": np.array([interaction["watch_time_ms"]], dtype=np.float64),
+        "skipped_quickly": np.array([bool(interaction.get("skipped_quickly"))]),
+        "watched_50_pct": np.array([bool(interaction.get("watched_50_pct"))]),
+        "interaction_epoch_s": np.array([timestamp_epoch_s(interaction.get("interaction_timestamp"))]),
+    }
+
+
+def other_categories_from(bucket_ids) -> np.ndarray:
+    """ Categories "other" watch time is distributed over: every catalog category except "other" itself"""
+    other_categories = np.unique(np.asarray(bucket_ids, dtype=np.int64))
+    other_categories = other_categories[other_categories != OTHER_BUCKET_ID]
+    if len(other_categories) == 0:
+        # Fallback in case no other categories exist
+        other_categories = np.array([1], dtype=np.int64)
+    return other_categories
+
+
+def engagement_weights(watch_time_ms, skipped_quickly, watched_50_pct) -> np.ndarray:
+    """ Engagement weighted watch time of every interaction (skip penalty, half watch boost), no recency decay"""
+    engagement = np.asarray(watch_time_ms, dtype=np.float64).copy()
+    engagement[np.asarray(skipped_quickly, dtype=bool)] *= SKIP_PENALTY
+    engagement[np.asarray(watched_50_pct, dtype=bool)] *= HALF_WATCH_BOOST
+    return engagement
+
+
+def interaction_weights(watch_time_ms, skipped_quickly, watched_50_pct, interaction_epoch_s, now_s: float = None) -> np.ndarray:
+    """
+    Engagement weighted, recency decayed watch time of every interaction (skip penalty, half watch boost, exp decay)
+
+    :param now_s: reference epoch seconds for recency, defaults to local now (timestamps are naive local time)
+    """
+    engagement = engagement_weights(watch_time_ms, skipped_quickly, watched_50_pct)
+
+    if now_s is None:
+        now_s = now_epoch_s()
+    epoch_s = np.asarray(interaction_epoch_s, dtype=np.float64)
+    # whole days like timedelta.days, interactions without a timestamp are not decayed
+    days_ago = np.floor((now_s - epoch_s) / SECONDS_PER_DAY)
+    recency_decay = np.where(np.isnan(days_ago), 1.0, np.exp(-np.nan_to_num(days_ago) / RECENCY_DECAY_DAYS))
+    return engagement * recency_decay
+
+
+@instrumented("recommendation.bucket_preferences")
+def bucket_preference_vector(
+    video_idx,
+    watch_time_ms,
+    skipped_quickly,
+    watched_50_pct,
+    interaction_epoch_s,
+    bucket_ptr,
+    bucket_ids,
+    other_categories,
+    n_buckets: int = 0,
+    now_s: float = None,
+) -> np.ndarray:
+    """
+    Per-bucket preference (engagement weighted watch time) from integer coded interactions.
+
+    Same result as the pipeline both recommenders used to run in pandas:
+    explode multi bucket videos -> engagement -> recency -> bincount -> "other" redistribution
+
+    :param video_idx: dense video position per interaction (-1 = not in catalog, ignored)
+    :param bucket_ptr, bucket_ids: CSR bucket lists per video from encode_video_buckets
+    :param other_categories: unique categories "other" watch time is spread over (other_categories_from)
+    :param n_buckets: minimum length of the returned vector
+    :param now_s: reference epoch seconds for recency, defaults to local now (timestamps are naive local time)
+    """
+    video_idx = np.asarray(video_idx, dtype=np.int64)
+    valid = video_idx >= 0
+    video_idx = video_idx[valid]
+
+    engagement = interaction_weights(watch_time_ms, skipped_quickly, watched_50_pct, interaction_epoch_s, now_s)[valid]
+
+    return redistribute_other(_bucket_bincount(video_idx, engagement, bucket_ptr, bucket_ids, n_buckets), other_categories)
+
+
+def explode_buckets(video_idx, bucket_ptr, bucket_ids):
+    """ (interaction row, bucket) of every bucket of every interaction's video, video_idx must all be valid"""
+    starts = bucket_ptr[video_idx]
+    counts = bucket_ptr[video_idx + 1] - starts
+    entry_row = np.repeat(np.arange(len(video_idx)), counts)
+    entry_offset = np.arange(len(entry_row)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return entry_row, bucket_ids[starts[entry_row] + entry_offset]
+
+
+def _bucket_bincount(video_idx, engagement, bucket_ptr, bucket_ids, n_buckets: int) -> np.ndarray:
+    """ explode: every bucket of a video gets the interaction's full engagement, summed per bucket"""
+    entry_row, entry_bucket = explode_buckets(video_idx, bucket_ptr, bucket_ids)
+    return np.bincount(entry_bucket, weights=engagement[entry_row], minlength=n_buckets)
+
+
+def redistribute_other(bucket_weights, other_categories) -> np.ndarray:
+    """
+    "other" redistribution is linear in the weights, so instead of replicating every "other" row once per
+    category it is applied once to the aggregated vector: OTHER_RETENTION_RATIO of the "other" mass stays,
+    the rest is split equally over other_categories
+    """
+    bucket_weights = np.asarray(bucket_weights, dtype=np.float64)
+    if len(bucket_weights) <= OTHER_BUCKET_ID or bucket_weights[OTHER_BUCKET_ID] <= 0:
+        return bucket_weights
+
+    bucket_weights = bucket_weights.copy()
+    other_categories = np.asarray(other_categories, dtype=np.int64)
+    other_weight = bucket_weights[OTHER_BUCKET_ID]
+
+    needed_len = int(other_categories.max()) + 1
+    if needed_len > len(bucket_weights):
+        bucket_weights = np.pad(bucket_weights, (0, needed_len - len(bucket_weights)))
+
+    bucket_weights[other_categories] += other_weight * (1.0 - OTHER_RETENTION_RATIO) / len(other_categories)
+    bucket_weights[OTHER_BUCKET_ID] = other_weight * OTHER_RETENTION_RATIO
+    return bucket_weights
+
+
+def session_bucket_weights(
+    video_idx,
+    watch_time_ms,
+    skipped_quickly,
+    watched_50_pct,
+    interaction_epoch_s,
+    bucket_ptr,
+    bucket_ids,
+    now_s: float,
+    n_buckets: int = 0,
+) -> np.ndarray:
+    """
+    Per-bucket engagement halved every SESSION_HALF_LIFE_S before now_s, "other" is not redistributed yet
+    (blend_session_profile does it). Interactions without a timestamp are not part of any session.
+    """
+    video_idx = np.asarray(video_idx, dtype=np.int64)
+    epoch_s = np.asarray(interaction_epoch_s, dtype=np.float64)
+    valid = (video_idx >= 0) & ~np.isnan(epoch_s)
+
+    # engagement only, the day scale recency decay is replaced by the half-life
+    engagement = interaction_weights(watch_time_ms, skipped_quickly, watched_50_pct, np.full(len(video_idx), np.nan))
+    age_s = np.maximum(now_s - epoch_s[valid], 0.0)
+    engagement = engagement[valid] * np.exp2(-age_s / SESSION_HALF_LIFE_S)
+    return _bucket_bincount(video_idx[valid], engagement, bucket_ptr, bucket_ids, n_buckets)
+
+
+def blend_session_profile(bucket_weights, session_weights, other_categories) -> np.ndarray:
+    """
+    Long-term preference with the short-term session profile mixed in. Both are turned into shares first, the
+    session gets SESSION_PROFILE_WEIGHT scaled by how much (decayed) engagement it holds. The result sums to 1.
+
+    :param bucket_weights: from bucket_preference_vector
+    :param session_weights: from session_bucket_weights / UserState.session_profile
+    """
+    long_mass = float(np.sum(bucket_weights))
+    session_mass = float(np.sum(session_weights))
+    if long_mass <= 0 or session_mass <= 0:
+        return bucket_weights
+
+    session_weights = redistribute_other(session_weights, other_categories)
+    n_buckets = max(len(bucket_weights), len(session_weights))
+    bucket_weights = np.pad(bucket_weights, (0, n_buckets - len(bucket_weights)))
+    session_weights = np.pad(session_weights, (0, n_buckets - len(session_weights)))
+
+    share = SESSION_PROFILE_WEIGHT * min(1.0, session_mass / SESSION_FULL_WEIGHT_MS)
+    return (1.0 - share) * bucket_weights / long_mass + share * session_weights / session_mass
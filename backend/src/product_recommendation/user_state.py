@@ -0,0 +1,227 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from backend.src.database.db_utils import download_user_interactions, DEFAULT_USER_ID
+from backend.src.instrumentation import instrumented
+from backend.src.product_recommendation.scoring import encode_interactions, encode_interaction, session_bucket_weights, now_epoch_s, \
+    engagement_weights, logged_interactions, SESSION_HALF_LIFE_S, RECENCY_DECAY_DAYS, SECONDS_PER_DAY
+from backend.src.product_recommendation.catalog_index import get_catalog_index, PositionBitmap
+from backend.src.product_recommendation.bandit import BucketBandit, interaction_outcomes
+from backend.src.product_recommendation.embedding_index import peek_embedding_index
+
+# e-folding time of the content profile's recency decay, the bucket preferences' exp(-days_ago / 7) without whole days
+RECENCY_DECAY_S = RECENCY_DECAY_DAYS * SECONDS_PER_DAY
+
+# most users kept in memory, the least recently used state is dropped and reloaded from parquet when that user returns
+MAX_CACHED_USERS = 1024
+
+
+class UserState:
+    """
+    Recommendation state of one user: the interaction log integer coded for the scoring core, the watched bitmap,
+    the short-term session profile, the content profile and the exploration bandit. lock only guards appending,
+    different users never wait on each other.
+    """
+
+    def __init__(self, user_id: str, interactions: dict, n_videos: int):
+        self.user_id = user_id
+        self.interactions = interactions
+        self.watched = PositionBitmap.from_positions(interactions["video_idx"], n_videos)
+        self.lock = threading.Lock()
+
+        # (per bucket session weights, epoch seconds they are decayed to), replaced as a whole like interactions
+        epoch_s = interactions["interaction_epoch_s"]
+        session_epoch_s = float(np.nanmax(epoch_s)) if np.any(~np.isnan(epoch_s)) else np.nan
+        self._session = (self._session_weights(interactions, session_epoch_s), session_epoch_s)
+
+        videos = get_catalog_index("video")
+        self.bandit = BucketBandit.from_interactions(**interactions, bucket_ptr=videos.bucket_ptr, bucket_ids=videos.bucket_ids)
+
+        # (summed text embeddings of timestamped rows decayed to epoch s, of rows without a timestamp, epoch s),
+        # built on the first content_profile() call and kept up to date by append()
+        self._content = None
+
+    @property
+    def n_interactions(self) -> int:
+        return len(self.interactions["video_idx"])
+
+    @staticmethod
+    def _session_weights(interactions: dict, now_s: float) -> np.ndarray:
+        if np.isnan(now_s):
+            return np.zeros(0)
+        videos = get_catalog_index("video")
+        return session_bucket_weights(**interactions, bucket_ptr=videos.bucket_ptr, bucket_ids=videos.bucket_ids, now_s=now_s)
+
+    def session_profile(self, now_s: float = None) -> np.ndarray:
+        """ Per bucket engagement of the current session, halved every SESSION_HALF_LIFE_S (no storage reads)"""
+        weights, epoch_s = self._session
+        if np.isnan(epoch_s) or len(weights) == 0:
+            return np.zeros(0)
+        if now_s is None:
+            now_s = now_epoch_s()
+        return weights * np.exp2(-max(now_s - epoch_s, 0.0) / SESSION_HALF_LIFE_S)
+
+    @staticmethod
+    def _content_sums(interactions: dict, epoch_s: float, index):
+        """ Watched videos' text embeddings weighted by engagement, recency decayed to epoch_s (rows without a timestamp apart)"""
+        video_idx = np.asarray(interactions["video_idx"], dtype=np.int64)
+        vectors = index.vectors(video_idx)
+        weights = engagement_weights(interactions["watch_time_ms"], interactions["skipped_quickly"], interactions["watched_50_pct"])
+        weights[video_idx < 0] = 0.0
+
+        row_epoch_s = np.asarray(interactions["interaction_epoch_s"], dtype=np.float64)
+        dated = ~np.isnan(row_epoch_s)
+        decay = np.exp(-(epoch_s - row_epoch_s[dated]) / RECENCY_DECAY_S) if dated.any() else []
+        return (
+            (weights[dated] * decay).astype(np.float32) @ vectors[dated],
+            weights[~dated].astype(np.float32) @ vectors[~dated],
+        )
+
+    def content_profile(self, now_s: float = None):
+        """
+        Content profile: the text embeddings of the watched videos summed with the engagement weights and the recency
+        decay of the bucket preferences, normalized. None if no watched video has an embedding, or while the video
+        embedding index is still loading.
+        Only the first call reads the whole log, after that it is kept as running sums (no per request history scan).
+        """
+        if self._content is None:
+            index = peek_embedding_index("video")
+            if index is None:
+                return None
+            with self.lock:
+                if self._content is None:
+                    epoch_s = self._session[1]
+                    sums = self._content_sums(self.interactions, 0.0 if np.isnan(epoch_s) else epoch_s, index)
+                    self._content = (*sums, epoch_s)
+
+        dated, undated, epoch_s = self._content
+        profile = undated
+        if not np.isnan(epoch_s):
+            if now_s is None:
+                now_s = now_epoch_s()
+            profile = undated + dated * np.float32(np.exp(-max(now_s - epoch_s, 0.0) / RECENCY_DECAY_S))
+
+        norm = np.linalg.norm(profile)
+        if not norm > 0:
+            return None
+        return profile / norm
+
+    def append(self, interaction: dict):
+        """ Adds one logged interaction to the coded log, the watched bitmap, the session profile, the content profile and the bandit"""
+        row = encode_interaction(interaction, get_catalog_index("video").position)
+        with self.lock:
+            # replaced as a whole so a request reading self.interactions never sees arrays of different lengths
+            self.interactions = {k: np.concatenate([v, row[k]]) for k, v in self.interactions.items()}
+            pos = int(row["video_idx"][0])
+            self.watched.add(pos)
+
+            if pos >= 0:
+                videos = get_catalog_index("video")
+                self.bandit.update(
+                    videos.bucket_ids[videos.bucket_ptr[pos]:videos.bucket_ptr[pos + 1]],
+                    bool(interaction_outcomes(row["skipped_quickly"], row["watched_50_pct"])[0]),
+                )
+
+            # decay the profile to the newer of the two times, then add the row decayed to the same time
+            row_epoch_s = float(row["interaction_epoch_s"][0])
+            if not np.isnan(row_epoch_s):
+                weights, epoch_s = self._session
+                now_s = row_epoch_s if np.isnan(epoch_s) else max(epoch_s, row_epoch_s)
+                weights = self.session_profile(now_s)
+                added = self._session_weights(row, now_s)
+                if len(added) > len(weights):
+                    weights = np.pad(weights, (0, len(added) - len(weights)))
+                # session_profile returned a new array, adding in place does not touch self._session
+                weights[:len(added)] += added
+                self._session = (weights, now_s)
+
+            # the profile is only built once the index is loaded, a video uploaded since its last sync adds nothing
+            index = peek_embedding_index("video") if self._content is not None and pos >= 0 else None
+            if index is not None:
+                dated, undated, epoch_s = self._content
+                if np.isnan(row_epoch_s):
+                    undated = undated + self._content_sums(row, 0.0, index)[1]
+                else:
+                    # decay the sums to the newer of the two times, then add the row decayed to the same time
+                    now_s = row_epoch_s if np.isnan(epoch_s) else max(epoch_s, row_epoch_s)
+                    if not np.isnan(epoch_s):
+                        dated = dated * np.float32(np.exp(-(now_s - epoch_s) / RECENCY_DECAY_S))
+                    dated = dated + self._content_sums(row, now_s, index)[0]
+                    epoch_s = now_s
+                self._content = (dated, undated, epoch_s)
+
+
+_user_states = OrderedDict()
+# user -> [loads running, interactions recorded meanwhile], the interactions the loads did not read are applied on insert
+_loading_users = {}
+_user_states_lock = threading.Lock()
+
+
+@instrumented("recommendation.user_state")
+def get_user_state(user_id: str = DEFAULT_USER_ID) -> UserState:
+    """ user_id's state from the LRU, loaded from the interaction parquet table on a miss"""
+    with _user_states_lock:
+        state = _user_states.get(user_id)
+        if state is not None:
+            _user_states.move_to_end(user_id)
+            return state
+        loading = _loading_users.setdefault(user_id, [0, []])
+        loading[0] += 1
+
+    # loaded outside the LRU lock so a slow load does not hold up other users
+    try:
+        videos = get_catalog_index("video")
+        interactions_df = download_user_interactions(user_id)
+        interactions = encode_interactions(interactions_df, videos.id_index())
+        state = UserState(user_id, interactions, videos.n_items)
+    except Exception:
+        with _user_states_lock:
+            _done_loading(user_id, loading)
+        raise
+
+    with _user_states_lock:
+        _done_loading(user_id, loading)
+        # another request of the same user may have loaded it meanwhile
+        existing = _user_states.get(user_id)
+        if existing is not None:
+            _user_states.move_to_end(user_id)
+            return existing
+        # interactions recorded during the load, the ones written after the parquet read are not in the state yet
+        recorded = loading[1]
+        for interaction, logged in zip(recorded, logged_interactions(interactions_df, interactions["interaction_epoch_s"], recorded)):
+            if not logged:
+                state.append(interaction)
+        _user_states[user_id] = state
+        while len(_user_states) > MAX_CACHED_USERS:
+            _user_states.popitem(last=False)
+    return state
+
+
+def _done_loading(user_id: str, loading: list):
+    """ caller holds _user_states_lock"""
+    loading[0] -= 1
+    if loading[0] == 0:
+        del _loading_users[user_id]
+
+
+@instrumented("recommendation.record_interaction")
+def record_interaction(interaction: dict):
+    """
+    Interaction hook, called after the interaction is written to parquet. Users not in memory need nothing,
+    their next load reads the new row; while a load runs the interaction is kept for it.
+    """
+    user_id = interaction.get("user_id", DEFAULT_USER_ID)
+    with _user_states_lock:
+        state = _user_states.get(user_id)
+        if state is None:
+            loading = _loading_users.get(user_id)
+            if loading is not None:
+                loading[1].append(interaction)
+            return
+    state.append(interaction)
+
+
+def reset_user_states():
+    """ Forgets every user's state, e.g. after the interaction log was rewritten outside the service"""
+    with _user_states_lock:
+        _user_states.clear()
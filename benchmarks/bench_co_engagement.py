@@ -0,0 +1,91 @@
+"""
+Item-item co-engagement index: cost of keeping it current and of the feed's candidate lookups.
+
+Builds the index from a synthetic interaction log (interleaved user sessions over a video catalog with Zipf popularity), then
+streams more interactions through record() and times every call, the neighbour lookup of a video, the feed's expansion
+from 10 recent positives and a compaction of the buffered increments into the CSR arrays.
+
+to run: python benchmarks/bench_co_engagement.py --videos 100000 --users 2000 --log 2000000 --stream 200000
+"""
+import argparse
+import time
+
+import numpy as np
+
+try:
+    from backend.src.product_recommendation.co_engagement import CoEngagementIndex, _COMPACTION_EXECUTOR
+except ModuleNotFoundError:
+    import sys
+    from pathlib import Path
+
+    repo_root = Path(__file__).resolve().parents[1]
+    if str(repo_root) not in sys.path:
+        sys.path.insert(0, str(repo_root))
+    from backend.src.product_recommendation.co_engagement import CoEngagementIndex, _COMPACTION_EXECUTOR
+
+
+def make_log(n_rows, n_videos, n_users, rng, start_s=1.7e9):
+    """ Interactions in time order, users picking Zipf popular videos"""
+    user_ids = np.array([f"user-{u}" for u in range(n_users)], dtype=object)[rng.integers(0, n_users, size=n_rows)]
+    video_idx = (rng.zipf(1.3, size=n_rows) - 1) % n_videos
+    # 20 interactions per second overall: a user's next interaction is ~n_users / 20 seconds later on average,
+    # with 2k users a session runs ~20 interactions before the SESSION_GAP_S break
+    epoch_s = start_s + np.cumsum(rng.exponential(0.05, size=n_rows))
+    positive = rng.random(n_rows) < 0.4
+    return user_ids, video_idx, epoch_s, positive
+
+
+def percentiles_us(samples_s):
+    samples_us = np.asarray(samples_s) * 1e6
+    return {f"p{q}": float(np.percentile(samples_us, q)) for q in (50, 99)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark co-engagement updates per interaction and neighbour lookups.")
+    parser.add_argument("--videos", type=int, default=100_000, help="Video catalog size")
+    parser.add_argument("--users", type=int, default=2_000)
+    parser.add_argument("--log", type=int, default=2_000_000, help="Interactions replayed to build the index")
+    parser.add_argument("--stream", type=int, default=200_000, help="Interactions recorded one by one afterwards")
+    parser.add_argument("--lookups", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    user_ids, video_idx, epoch_s, positive = make_log(args.log + args.stream, args.videos, args.users, rng)
+
+    start = time.perf_counter()
+    index = CoEngagementIndex.from_log(user_ids[:args.log], video_idx[:args.log], epoch_s[:args.log], positive[:args.log])
+    build_s = time.perf_counter() - start
+    print(f"build from {args.log} logged interactions: {build_s:.2f}s, {len(index._counts[1])} video pairs")
+
+    # compactions triggered meanwhile run in the background, their lock hand-offs are part of the numbers
+    record_s = []
+    for args_row in zip(user_ids[args.log:], video_idx[args.log:], epoch_s[args.log:], positive[args.log:]):
+        start = time.perf_counter()
+        index.record(*args_row)
+        record_s.append(time.perf_counter() - start)
+    p = percentiles_us(record_s)
+    print(f"record: p50 {p['p50']:.1f}us | p99 {p['p99']:.1f}us | mean {np.mean(record_s) * 1e6:.1f}us "
+          f"({len(index._delta)} buffered pairs)")
+
+    popular = (rng.zipf(1.3, size=args.lookups) - 1) % args.videos
+    for name, lookup in (
+        ("neighbours", lambda i: index.neighbours(int(popular[i]))),
+        ("expand(10 seeds, k=30)", lambda i: index.expand(popular[i:i + 10], 30, excluded=(set(popular[i:i + 10].tolist()),))),
+    ):
+        lookup_s = []
+        for i in range(args.lookups - 10):
+            start = time.perf_counter()
+            lookup(i)
+            lookup_s.append(time.perf_counter() - start)
+        p = percentiles_us(lookup_s)
+        print(f"{name}: p50 {p['p50']:.1f}us | p99 {p['p99']:.1f}us")
+
+    _COMPACTION_EXECUTOR.submit(lambda: None).result()
+    start = time.perf_counter()
+    index.compact()
+    print(f"compaction of the streamed increments: {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Feed / shop request latency: recommending synchronously in the request vs serving from the background refilled pools.
+
+Writes a synthetic catalog and interaction history to a temporary data directory, then replays the same session in
+both modes: request a feed page, log an interaction for every video on it, pause, open the shop every few pages. Each mode
+uses its own user so their histories do not mix. Reports p50 / p95 / p99 per endpoint.
+
+to run: python benchmarks/bench_feed_latency.py --videos 20000 --products 5000 --pages 300
+"""
+import argparse
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+try:
+    from backend.src.database import db_utils
+except ModuleNotFoundError:
+    import sys
+    from pathlib import Path
+
+    repo_root = Path(__file__).resolve().parents[1]
+    if str(repo_root) not in sys.path:
+        sys.path.insert(0, str(repo_root))
+    from backend.src.database import db_utils
+
+from backend.src.backend_base_services import update_user_interaction_service
+from backend.src.product_recommendation.personalized_recommendation import video_recommendation, product_recommendation
+from backend.src.product_recommendation.recommendation_pool import pop_videos, get_shop_page
+from benchmarks.bench_scoring import make_catalog
+from benchmarks.synthetic_data import use_data_dir
+
+MODES = {
+    "sync": {"feed": video_recommendation, "shop": product_recommendation},
+    "pool": {"feed": pop_videos, "shop": get_shop_page},
+}
+
+
+def write_synthetic_data(data_dir, n_videos, n_products, n_history, users, rng):
+    """ Catalog + per user history in the db_utils on disk layout, db_utils is pointed at data_dir"""
+    use_data_dir(data_dir)
+
+    videos_df = make_catalog(n_videos, rng)
+    db_utils.update_parquet_table_batch(videos_df.to_dict(orient="records"), "video")
+
+    db_utils.update_parquet_table_batch([
+        {"product_id": f"prod-{i}", "title": f"product {i}", "bucket_num": f"{b:02d}", "price": 10.0}
+        for i, b in enumerate(rng.integers(1, 14, size=n_products))
+    ], "product")
+
+    now = datetime.now()
+    db_utils.update_parquet_table_batch([
+        {
+            "user_id": user_id,
+            "video_id": videos_df["video_id"].iat[int(v)],
+            "watch_time_ms": int(rng.integers(500, 90000)),
+            "skipped_quickly": bool(rng.random() < 0.2),
+            "watched_50_pct": bool(rng.random() < 0.4),
+            "interaction_timestamp": (now - timedelta(seconds=int(rng.integers(0, 30 * 86400)))).isoformat(),
+        }
+        for user_id in users for v in rng.integers(0, n_videos, size=n_history)
+    ], "user")
+
+
+def percentiles(samples_s):
+    samples_ms = np.asarray(samples_s) * 1e3
+    return {f"p{q}": float(np.percentile(samples_ms, q)) for q in (50, 95, 99)}
+
+
+def run_session(mode, user_id, pages, page_size, shop_every, shop_size, think_s, rng):
+    feed, shop = MODES[mode]["feed"], MODES[mode]["shop"]
+    timings = {"feed": [], "shop": []}
+
+    for page in range(pages):
+        start = time.perf_counter()
+        videos = feed(page_size, user_id)
+        timings["feed"].append(time.perf_counter() - start)
+
+        for video in videos:
+            update_user_interaction_service(
+                video["video_id"], int(rng.integers(500, 90000)), bool(rng.random() < 0.2), bool(rng.random() < 0.4), user_id
+            )
+
+        # the user watching the page, background refills run meanwhile
+        time.sleep(think_s)
+
+        if page % shop_every == 0:
+            start = time.perf_counter()
+            shop(shop_size, user_id)
+            timings["shop"].append(time.perf_counter() - start)
+
+    return {endpoint: percentiles(samples) for endpoint, samples in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark feed / shop latency with and without background pools.")
+    parser.add_argument("--videos", type=int, default=20_000, help="Video catalog size")
+    parser.add_argument("--products", type=int, default=5_000, help="Product catalog size")
+    parser.add_argument("--history", type=int, default=2_000, help="Interactions per user before the session")
+    parser.add_argument("--pages", type=int, default=300, help="Feed pages per session")
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--shop-every", type=int, default=5, help="Open the shop every N feed pages")
+    parser.add_argument("--shop-size", type=int, default=50)
+    parser.add_argument("--think-ms", type=float, default=50.0, help="Pause between pages")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_synthetic_data(data_dir, args.videos, args.products, args.history, [f"bench-{m}" for m in MODES], rng)
+
+        print(f"{'mode':>6} | {'endpoint':>8} | {'p50':>9} | {'p95':>9} | {'p99':>9}")
+        for mode in MODES:
+            results = run_session(
+                mode, f"bench-{mode}", args.pages, args.page_size, args.shop_every, args.shop_size,
+                args.think_ms / 1e3, rng,
+            )
+            for endpoint, p in results.items():
+                print(f"{mode:>6} | {endpoint:>8} | {p['p50']:>7.2f}ms | {p['p95']:>7.2f}ms | {p['p99']:>7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
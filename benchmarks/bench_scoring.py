@@ -0,0 +1,175 @@
+"""
+Microbenchmark: shared NumPy scoring core vs the pandas pipeline the recommenders used to run.
+
+Both paths compute the per bucket preference vector for the same synthetic catalog / interaction log,
+the results are checked to match before timings are reported. The pandas path is only run in full up to
+--pandas-limit interactions, larger sizes report a linear estimate (marked ~).
+
+to run: python benchmarks/bench_scoring.py --sizes 10000 100000 1000000
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+try:
+    from backend.src.product_recommendation.scoring import encode_video_buckets, encode_interactions, \
+        other_categories_from, bucket_preference_vector
+except ModuleNotFoundError:
+    import sys
+    from pathlib import Path
+
+    repo_root = Path(__file__).resolve().parents[1]
+    if str(repo_root) not in sys.path:
+        sys.path.insert(0, str(repo_root))
+    from backend.src.product_recommendation.scoring import encode_video_buckets, encode_interactions, \
+        other_categories_from, bucket_preference_vector
+
+
+def pandas_bucket_preference_vector(user_interactions_df, videos_df, other_categories, now):
+    """
+    The join -> explode -> "other" replication -> engagement -> recency -> bincount pipeline
+    video_recommendation / product_recommendation ran before the scoring core, kept as the reference.
+    """
+    ui_df = user_interactions_df.set_index("video_id")
+    v_df = videos_df.set_index("video_id")
+
+    interactions_with_buckets = ui_df.join(v_df).dropna(subset=["bucket_num"])
+    interactions_with_buckets = interactions_with_buckets.reset_index().explode("bucket_num").set_index("video_id")
+    interactions_with_buckets["bucket_num"] = interactions_with_buckets["bucket_num"].astype(np.int32)
+
+    other_bucket_id = 13
+    other_mask = interactions_with_buckets["bucket_num"] == other_bucket_id
+    other_interactions = interactions_with_buckets[other_mask].copy()
+
+    if not other_interactions.empty:
+        retention_ratio = 0.10
+        distribution_ratio = 1.0 - retention_ratio
+
+        expanded_rows_list = []
+        for cat_id in other_categories:
+            expanded = other_interactions.copy()
+            expanded["bucket_num"] = cat_id
+            expanded["watch_time_ms"] = expanded["watch_time_ms"] * (distribution_ratio / len(other_categories))
+            expanded_rows_list.append(expanded)
+
+        reduced_other = other_interactions.copy()
+        reduced_other["watch_time_ms"] = reduced_other["watch_time_ms"] * retention_ratio
+
+        expanded_df = pd.concat(expanded_rows_list + [reduced_other], ignore_index=False)
+        interactions_with_buckets = interactions_with_buckets[~other_mask]
+        interactions_with_buckets = pd.concat([interactions_with_buckets, expanded_df], ignore_index=False)
+
+    buckets_watched = interactions_with_buckets["bucket_num"].values.astype(np.int32)
+    watch_times = interactions_with_buckets["watch_time_ms"].values.astype(np.float64)
+
+    skipped = interactions_with_buckets["skipped_quickly"].fillna(False).astype(bool).values
+    watched_half = interactions_with_buckets["watched_50_pct"].fillna(False).astype(bool).values
+
+    engagement_scores = watch_times.copy()
+    engagement_scores[skipped] *= 0.1
+    engagement_scores[watched_half] *= 1.5
+
+    timestamps = interactions_with_buckets["interaction_timestamp"]
+    days_ago = np.array([(now - pd.to_datetime(ts)).days for ts in timestamps])
+    engagement_scores *= np.exp(-days_ago / 7)
+
+    vid_bucket_num_max = videos_df["bucket_num"].explode().astype(np.int32).max()
+    max_bucket_id = int(max(buckets_watched.max(), vid_bucket_num_max)) + 1
+
+    return np.bincount(buckets_watched, weights=engagement_scores, minlength=max_bucket_id)
+
+
+def make_catalog(n_videos, rng):
+    """ Videos with 1-3 zero padded bucket strings, like upload_video_service writes them"""
+    n_buckets_per_video = rng.integers(1, 4, size=n_videos)
+    bucket_num = [
+        [f"{b:02d}" for b in rng.choice(np.arange(1, 14), size=k, replace=False)] for k in n_buckets_per_video
+    ]
+    return pd.DataFrame({"video_id": [f"vid-{i}" for i in range(n_videos)], "bucket_num": bucket_num})
+
+
+def make_interactions(n_interactions, videos_df, rng, now):
+    seconds_ago = rng.integers(0, 60 * 86400, size=n_interactions)
+    return pd.DataFrame({
+        "video_id": videos_df["video_id"].to_numpy()[rng.integers(0, len(videos_df), size=n_interactions)],
+        "watch_time_ms": rng.integers(500, 90000, size=n_interactions),
+        "skipped_quickly": rng.random(n_interactions) < 0.2,
+        "watched_50_pct": rng.random(n_interactions) < 0.4,
+        "interaction_timestamp": [(now - timedelta(seconds=int(s))).isoformat() for s in seconds_ago],
+    })
+
+
+def best_of(fn, repeats):
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run(sizes, n_videos, repeats, seed, pandas_limit):
+    rng = np.random.default_rng(seed)
+    now = datetime.now()
+    now_s = pd.Timestamp(now).value / 1e9
+    videos_df = make_catalog(n_videos, rng)
+
+    video_index, bucket_ptr, bucket_ids = encode_video_buckets(videos_df)
+    other_categories = other_categories_from(bucket_ids)
+
+    def core(interactions, n_buckets):
+        return bucket_preference_vector(
+            **interactions, bucket_ptr=bucket_ptr, bucket_ids=bucket_ids,
+            other_categories=other_categories, n_buckets=n_buckets, now_s=now_s,
+        )
+
+    print(f"{'interactions':>12} | {'pandas':>12} | {'encode':>10} | {'core':>10} | {'speedup (core)':>14} | {'speedup (encode+core)':>21}")
+    rows = []
+    for n in sizes:
+        interactions_df = make_interactions(n, videos_df, rng, now)
+
+        # the pandas path parses timestamps row by row (~1ms each on pandas 3), above pandas_limit it is timed on
+        # the first pandas_limit rows and scaled linearly
+        pandas_n = min(n, pandas_limit)
+        pandas_df = interactions_df.iloc[:pandas_n]
+        pandas_s, expected = best_of(
+            lambda: pandas_bucket_preference_vector(pandas_df, videos_df, other_categories, now), 1
+        )
+        if not np.allclose(core(encode_interactions(pandas_df, video_index), len(expected))[: len(expected)], expected, rtol=1e-9):
+            raise AssertionError(f"scoring core diverged from pandas reference at {pandas_n} interactions")
+        pandas_estimated = pandas_n < n
+        pandas_s *= n / pandas_n
+
+        encode_s, interactions = best_of(lambda: encode_interactions(interactions_df, video_index), repeats)
+        core_s, _ = best_of(lambda: core(interactions, len(expected)), repeats)
+
+        pandas_label = f"{'~' if pandas_estimated else ''}{pandas_s * 1e3:.1f}ms"
+        print(
+            f"{n:>12} | {pandas_label:>12} | {encode_s * 1e3:>8.1f}ms | {core_s * 1e3:>8.1f}ms | "
+            f"{pandas_s / core_s:>13.1f}x | {pandas_s / (encode_s + core_s):>20.1f}x"
+        )
+        rows.append({
+            "interactions": n, "pandas_s": pandas_s, "pandas_estimated": pandas_estimated,
+            "encode_s": encode_s, "core_s": core_s,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the NumPy scoring core against the legacy pandas pipeline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="Interaction log sizes")
+    parser.add_argument("--videos", type=int, default=1000, help="Catalog size")
+    parser.add_argument("--repeats", type=int, default=3, help="Best of N timings")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pandas-limit", type=int, default=10_000, help="Largest log the pandas path runs on in full")
+    args = parser.parse_args()
+
+    run(args.sizes, args.videos, args.repeats, args.seed, args.pandas_limit)
+
+
+if __name__ == "__main__":
+    main()
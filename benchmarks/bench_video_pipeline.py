@@ -0,0 +1,343 @@
+"""
+Benchmark of the video analysis pipeline, stage by stage and end to end, over a fixed clip set.
+
+Stages (each in its own process, so it only loads its own model and its peak RSS is its own):
+- decode: get_base_frames (10 frames, --sampling uniform / scene)
+- classification: classify_video_genre with VideoMAE (decodes the clip itself)
+- ocr: ocr_read_frames with EasyOCR over the decoded frames
+- zero_shot: zero_shot_classification with BART MNLI over the clip description
+- caption: capping_video with BLIP over the decoded frames
+- objects: detect_objects_from_frames with YOLO11n over the decoded frames
+- end_to_end: categorize_video_service with all five models, cascade off (every stage runs, multi-label output)
+  and on (early exit, single-label output), writing into a temporary data directory
+
+The frames of the frame based stages are decoded once before timing, so only the stage itself is timed.
+Each stage gets a warm-up call on the first clip, then every clip is timed --repeats times.
+Reported per stage: p50 / p95 / p99 / mean latency, frames/second (frames the stage consumed / time), clips/second,
+model load time and peak RSS (the whole worker process, model included, and the growth while the stage ran).
+
+The clip set is a folder of videos (e.g. data/videos with the 20 sample tiktoks) or, with --synthetic-clips,
+deterministic generated clips (moving shapes, scene cuts and on-screen text) written to --clips.
+
+to run: python benchmarks/bench_video_pipeline.py --clips data/videos --repeats 3 --json video_pipeline.json
+        python benchmarks/bench_video_pipeline.py --clips /tmp/bench_clips --synthetic-clips 8 --stages decode ocr objects
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+try:
+    from backend.src.detection.detect_utils import get_base_frames, load_json
+except ModuleNotFoundError:
+    repo_root = Path(__file__).resolve().parents[1]
+    if str(repo_root) not in sys.path:
+        sys.path.insert(0, str(repo_root))
+    from backend.src.detection.detect_utils import get_base_frames, load_json
+
+from backend.src.detection.detect_modules import classify_video_genre, ocr_read_frames, zero_shot_classification, \
+    capping_video, detect_objects_from_frames
+
+repo_root = Path(__file__).resolve().parents[1]
+BUCKET_KEYS = list(load_json(str(repo_root / "backend" / "configs" / "buckets.json"))["buckets"].keys())
+
+STAGES = ["decode", "classification", "ocr", "zero_shot", "caption", "objects", "end_to_end"]
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".mkv", ".webm", ".avi")
+NUM_FRAMES = 10
+# used for clips without a description, long enough that BART does real work
+DEFAULT_DESCRIPTION = "unboxing my new wireless headphones and testing the noise cancelling on the train"
+
+SYNTHETIC_TEXTS = ["SALE 50% OFF", "NEW LIPSTICK", "GAMING SETUP", "HOME DECOR", "LEG DAY", "PUPPY FOOD"]
+
+
+########################################## Clip set ##########################################
+def make_synthetic_clips(out_dir, n_clips, seconds=6.0, fps=30, size=(360, 640), seed=0):
+    """
+    Writes n_clips deterministic portrait clips: a few scenes per clip (new background colour and caption text)
+    with shapes moving across them, so scene sampling, OCR and the detectors all get something to work on.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    width, height = size
+    n_frames = int(seconds * fps)
+    descriptions = {}
+
+    for clip in range(n_clips):
+        path = out_dir / f"synthetic_{clip:03d}.mp4"
+        n_scenes = int(rng.integers(2, 5))
+        scene_len = n_frames // n_scenes
+        backgrounds = rng.integers(0, 256, size=(n_scenes, 3))
+        texts = rng.choice(SYNTHETIC_TEXTS, size=n_scenes)
+        shapes = rng.uniform(0, 1, size=(4, 4))  # x, y, dx, dy per shape
+
+        writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+        for i in range(n_frames):
+            scene = min(i // scene_len, n_scenes - 1)
+            frame = np.empty((height, width, 3), dtype=np.uint8)
+            frame[:] = backgrounds[scene]
+            t = i / n_frames
+            for x, y, dx, dy in shapes:
+                cx = int(((x + dx * t) % 1.0) * width)
+                cy = int(((y + dy * t) % 1.0) * height)
+                cv2.rectangle(frame, (cx - 30, cy - 30), (cx + 30, cy + 30), (255 - backgrounds[scene]).tolist(), -1)
+            cv2.putText(frame, str(texts[scene]), (20, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255, 255, 255), 3)
+            writer.write(frame)
+        writer.release()
+        descriptions[path.stem] = f"{' '.join(texts).lower()} haul and review"
+
+    with open(out_dir / "descriptions.json", "w") as f:
+        json.dump(descriptions, f, indent=2)
+    return descriptions
+
+
+def list_clips(clips_dir, max_clips=None):
+    clips = sorted(str(p) for p in Path(clips_dir).iterdir() if p.suffix.lower() in VIDEO_EXTENSIONS)
+    return clips[:max_clips] if max_clips else clips
+
+
+def load_clip_descriptions(clips_dir):
+    """ Optional descriptions.json ({clip stem: description}) next to the clips"""
+    path = Path(clips_dir) / "descriptions.json"
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+########################################## Measurement ##########################################
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(samples_s, frames: int) -> dict:
+    samples_ms = np.asarray(samples_s, dtype=np.float64) * 1e3
+    total_s = samples_ms.sum() / 1e3
+    return {
+        "calls": len(samples_ms),
+        "p50_ms": float(np.percentile(samples_ms, 50)),
+        "p95_ms": float(np.percentile(samples_ms, 95)),
+        "p99_ms": float(np.percentile(samples_ms, 99)),
+        "mean_ms": float(samples_ms.mean()),
+        "frames_per_s": frames / total_s if frames and total_s > 0 else None,
+        "clips_per_s": len(samples_ms) / total_s if total_s > 0 else None,
+    }
+
+
+########################################## Stages (worker process) ##########################################
+def load_stage(stage, device, sampling):
+    """
+    Loads only the model the stage needs (same checkpoints as the API) and returns
+    run(clip_path, frames, description) -> number of frames the call consumed
+    """
+    if stage == "decode":
+        return lambda path, frames, description: len(get_base_frames(path, NUM_FRAMES, sampling))
+
+    if stage == "classification":
+        from transformers import pipeline
+
+        genre_clf = pipeline(task="video-classification", model="MCG-NJU/videomae-small-finetuned-kinetics", device=device)
+        clip_frames = genre_clf.model.config.num_frames
+
+        def run(path, frames, description):
+            classify_video_genre(genre_clf, path, 3)
+            return clip_frames
+        return run
+
+    if stage == "ocr":
+        import easyocr
+
+        reader = easyocr.Reader(["en"], gpu=device >= 0)
+
+        def run(path, frames, description):
+            ocr_read_frames(frames, reader)
+            return len(frames)
+        return run
+
+    if stage == "zero_shot":
+        from transformers import pipeline
+
+        bart_mnli = pipeline(task="zero-shot-classification", model="facebook/bart-large-mnli", device=device)
+
+        def run(path, frames, description):
+            zero_shot_classification(bart_mnli, BUCKET_KEYS, description)
+            return 0
+        return run
+
+    if stage == "caption":
+        from transformers import pipeline
+
+        caption_model = pipeline(task="image-text-to-text", model="Salesforce/blip-image-captioning-base", device=device)
+
+        def run(path, frames, description):
+            capping_video(frames, caption_model)
+            return len(frames)
+        return run
+
+    if stage == "objects":
+        from ultralytics import YOLO
+
+        object_detector = YOLO("yolo11n.pt")
+
+        def run(path, frames, description):
+            detect_objects_from_frames(frames, object_detector)
+            return len(frames)
+        return run
+
+    if stage.startswith("end_to_end"):
+        # the service reads its configs relative to the repo root and writes into db_utils' directories
+        os.chdir(repo_root)
+        from backend.src import backend_base_services
+        from backend.src.detection.detect_utils import get_video_duration_ms_from_path
+        from benchmarks.synthetic_data import use_data_dir
+        from scripts.batch_categorization import build_models
+
+        backend_base_services.FRAME_SAMPLING_MODE = sampling
+        models = build_models(device)
+        use_data_dir(tempfile.mkdtemp(prefix="bench_video_pipeline_"))
+        cascade = stage == "end_to_end_cascade"
+
+        def run(path, frames, description):
+            result = backend_base_services.categorize_video_service(
+                *models, Path(path).stem, path, get_video_duration_ms_from_path(path), description, cascade=cascade,
+            )
+            if result["status"] != "completed":
+                raise RuntimeError(f"categorization failed for {path}")
+            return NUM_FRAMES
+        return run
+
+    raise ValueError(f"unknown stage {stage}")
+
+
+def run_worker(stage, clips, descriptions, repeats, device, sampling) -> dict:
+    """ Times one stage over the clip set; the stages' own prints are discarded"""
+    inputs = [
+        (path, get_base_frames(path, NUM_FRAMES, sampling), descriptions.get(Path(path).stem) or DEFAULT_DESCRIPTION)
+        for path in clips
+    ]
+    rss_inputs_mb = peak_rss_mb()
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        run = load_stage(stage, device, sampling)
+        load_s = time.perf_counter() - start
+        rss_loaded_mb = peak_rss_mb()
+
+        run(*inputs[0])
+        samples, frames = [], 0
+        for _ in range(repeats):
+            for clip_input in inputs:
+                start = time.perf_counter()
+                frames += run(*clip_input)
+                samples.append(time.perf_counter() - start)
+
+    rss_peak_mb = peak_rss_mb()
+    return {
+        **summarize(samples, frames),
+        "model_load_s": load_s,
+        "peak_rss_mb": rss_peak_mb,
+        "model_rss_mb": rss_loaded_mb - rss_inputs_mb,
+        "stage_rss_mb": rss_peak_mb - rss_loaded_mb,
+    }
+
+
+########################################## Driver ##########################################
+def run_stage(stage, args) -> dict:
+    """ Runs one stage in a fresh interpreter and reads its JSON result from the last line of stdout"""
+    cmd = [
+        sys.executable, str(Path(__file__).resolve()), "--worker", stage, "--clips", args.clips,
+        "--repeats", str(args.repeats), "--device", str(args.device), "--sampling", args.sampling,
+    ]
+    if args.max_clips:
+        cmd += ["--max-clips", str(args.max_clips)]
+    proc = subprocess.run(cmd, capture_output=True, text=True, cwd=repo_root)
+    if proc.returncode != 0:
+        return {"error": (proc.stderr.strip().splitlines() or [f"exit code {proc.returncode}"])[-1]}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def print_report(results):
+    print(
+        f"{'stage':>18} | {'calls':>5} | {'p50':>10} | {'p95':>10} | {'p99':>10} | {'mean':>10} | "
+        f"{'frames/s':>8} | {'clips/s':>7} | {'load':>6} | {'peak RSS':>9} | {'stage RSS':>9}"
+    )
+    for stage, stats in results.items():
+        if "error" in stats:
+            print(f"{stage:>18} | failed: {stats['error']}")
+            continue
+        fps = f"{stats['frames_per_s']:8.1f}" if stats["frames_per_s"] else f"{'-':>8}"
+        print(
+            f"{stage:>18} | {stats['calls']:>5} | {stats['p50_ms']:>8.1f}ms | {stats['p95_ms']:>8.1f}ms | "
+            f"{stats['p99_ms']:>8.1f}ms | {stats['mean_ms']:>8.1f}ms | {fps} | {stats['clips_per_s']:>7.2f} | "
+            f"{stats['model_load_s']:>5.1f}s | {stats['peak_rss_mb']:>7.0f}MB | {stats['stage_rss_mb']:>7.0f}MB"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the video analysis pipeline per stage and end to end.")
+    parser.add_argument("--clips", required=True, help="Folder with the clip set (written first with --synthetic-clips)")
+    parser.add_argument("--synthetic-clips", type=int, default=0, help="Generate this many deterministic clips into --clips")
+    parser.add_argument("--max-clips", type=int, default=0, help="Only use the first N clips (sorted by name)")
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("--repeats", type=int, default=3, help="Timed passes over the clip set per stage")
+    parser.add_argument("--sampling", default="uniform", choices=["uniform", "scene"], help="Frame sampling of get_base_frames")
+    parser.add_argument("--device", type=int, default=-1, help="-1 = CPU, otherwise CUDA device index")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        clips = list_clips(args.clips, args.max_clips)
+        result = run_worker(args.worker, clips, load_clip_descriptions(args.clips), args.repeats, args.device, args.sampling)
+        print(json.dumps(result))
+        return
+
+    if args.synthetic_clips:
+        make_synthetic_clips(args.clips, args.synthetic_clips, seed=args.seed)
+    args.clips = str(Path(args.clips).resolve())
+    clips = list_clips(args.clips, args.max_clips)
+    if not clips:
+        parser.error(f"no videos in {args.clips}")
+    print(f"{len(clips)} clips from {args.clips}, {args.repeats} repeats, {args.sampling} sampling, device {args.device}")
+
+    stages = [s for s in args.stages if s != "end_to_end"]
+    if "end_to_end" in args.stages:
+        stages += ["end_to_end", "end_to_end_cascade"]
+
+    results = {}
+    for stage in stages:
+        start = time.perf_counter()
+        results[stage] = run_stage(stage, args)
+        print(f"{stage} done ({time.perf_counter() - start:.1f}s)")
+    print()
+    print_report(results)
+
+    if args.json:
+        from benchmarks.run_suite import environment
+
+        report = {
+            "environment": environment(),
+            "config": {
+                "clips": clips, "repeats": args.repeats, "sampling": args.sampling, "device": args.device,
+                "num_frames": NUM_FRAMES,
+            },
+            "results": results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
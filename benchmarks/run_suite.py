@@ -0,0 +1,247 @@
+"""
+Benchmark suite of the storage and recommendation hot paths, with a stored baseline to catch regressions.
+
+For every size a synthetic data directory is written with benchmarks/synthetic_data.py, db_utils is pointed at it and
+every case is timed (warm-up call first, except the cold ones):
+- download_all_videos_metadata, download_user_interactions (whole log / one user)
+- video_recommendation, product_recommendation: cold = first call of a user (state loaded from parquet),
+  warm = later calls; the shop cache is cleared before every product call so the recommender itself is timed
+- recommender_setup: the builds the app runs in the background from startup (embedding and co-engagement indexes)
+  plus the first recommendation (catalog index built)
+- download_video_metadata, download_product_metadata (metadata by id)
+- update_parquet_table: one interaction row, run last since every call adds a parquet part
+
+The JSON report holds p50 / p95 / mean per size and case. With --baseline the p50s are compared with a stored report,
+cases slower by more than --tolerance (and by more than --min-delta-ms) are flagged and the exit code is 1.
+
+to run: python benchmarks/run_suite.py --sizes small medium --json report.json --baseline benchmarks/baseline.json
+        python benchmarks/run_suite.py --sizes small medium --save-baseline benchmarks/baseline.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+try:
+    from backend.src.database import db_utils
+except ModuleNotFoundError:
+    repo_root = Path(__file__).resolve().parents[1]
+    if str(repo_root) not in sys.path:
+        sys.path.insert(0, str(repo_root))
+    from backend.src.database import db_utils
+
+from backend.src.product_recommendation import catalog_index
+from backend.src.product_recommendation.co_engagement import get_co_engagement_index, reset_co_engagement
+from backend.src.product_recommendation.embedding_index import EMBEDDING_SPACES, get_embedding_index, reset_embedding_indexes
+from backend.src.product_recommendation.personalized_recommendation import (
+    video_recommendation,
+    product_recommendation,
+    invalidate_products_cache,
+    invalidate_user_products_cache,
+    seed_recommendation_rng,
+)
+from backend.src.product_recommendation.user_state import reset_user_states
+from benchmarks.synthetic_data import generate
+
+# catalog / history sizes: (videos, products, users, interactions)
+SIZES = {
+    "small": (1_000, 200, 100, 10_000),
+    "medium": (20_000, 5_000, 2_000, 200_000),
+    "large": (100_000, 20_000, 20_000, 2_000_000),
+}
+
+
+def summarize(samples_s) -> dict:
+    samples_ms = np.asarray(samples_s, dtype=np.float64) * 1e3
+    return {
+        "calls": len(samples_ms),
+        "p50_ms": float(np.percentile(samples_ms, 50)),
+        "p95_ms": float(np.percentile(samples_ms, 95)),
+        "mean_ms": float(samples_ms.mean()),
+    }
+
+
+def timed(fn, calls: int, warmup: int = 1) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def _time_call(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def reset_recommendation_state():
+    catalog_index._catalog_indexes.clear()
+    reset_embedding_indexes()
+    reset_user_states()
+    reset_co_engagement()
+    invalidate_products_cache()
+
+
+def run_size(name: str, calls: int, users_per_case: int, seed: int) -> dict:
+    n_videos, n_products, n_users, n_interactions = SIZES[name]
+    results = {}
+    data_dirs = {attr: getattr(db_utils, attr) for attr in (
+        "VIDEO_DIR", "PRODUCT_DIR", "VIDEO_PARQUET_DIR", "PRODUCT_PARQUET_DIR", "USER_INTERACTION_PARQUET_DIR", "EMBEDDING_DIR",
+    )}
+    with tempfile.TemporaryDirectory() as data_dir:
+        generate(data_dir, n_videos, n_products, n_users, n_interactions, seed=seed, verbose=False)
+        reset_recommendation_state()
+        seed_recommendation_rng(seed)
+
+        interactions_df = db_utils.download_user_interactions()
+        # the most active users, like the ones who hit the feed most
+        users = interactions_df["user_id"].value_counts().index[:users_per_case].tolist()
+        rng = np.random.default_rng(seed)
+        video_ids = rng.choice(interactions_df["video_id"].unique(), size=calls)
+        product_ids = [f"synthetic-product-{i}" for i in rng.integers(0, n_products, size=calls)]
+        del interactions_df
+
+        results["download_all_videos_metadata"] = timed(db_utils.download_all_videos_metadata, calls)
+        results["download_user_interactions_all"] = timed(db_utils.download_user_interactions, calls)
+        results["download_user_interactions_user"] = timed(lambda: db_utils.download_user_interactions(users[0]), calls)
+
+        start = time.perf_counter()
+        for item_type, space in EMBEDDING_SPACES:
+            get_embedding_index(item_type, space)
+        get_co_engagement_index()
+        video_recommendation(10, users[0])
+        results["recommender_setup"] = summarize([time.perf_counter() - start])
+        reset_user_states()
+
+        results["video_recommendation_cold"] = summarize([_time_call(video_recommendation, 10, user) for user in users])
+        results["video_recommendation_warm"] = summarize(
+            [_time_call(video_recommendation, 10, users[i % len(users)]) for i in range(calls)]
+        )
+        reset_user_states()
+
+        def product_call(user):
+            invalidate_user_products_cache(user)
+            return _time_call(product_recommendation, 50, user)
+
+        results["product_recommendation_cold"] = summarize([product_call(user) for user in users])
+        results["product_recommendation_warm"] = summarize([product_call(users[i % len(users)]) for i in range(calls)])
+
+        video_iter, product_iter = iter(video_ids.tolist() * 2), iter(product_ids * 2)
+        results["download_video_metadata"] = timed(lambda: db_utils.download_video_metadata(next(video_iter)), calls)
+        # download_product_metadata prints the row it found
+        with contextlib.redirect_stdout(io.StringIO()):
+            results["download_product_metadata"] = timed(lambda: db_utils.download_product_metadata(next(product_iter)), calls)
+
+        def write_interaction():
+            db_utils.update_parquet_table({
+                "user_id": users[0],
+                "video_id": video_ids[0],
+                "watch_time_ms": 12000,
+                "skipped_quickly": False,
+                "watched_50_pct": True,
+                "interaction_timestamp": "2026-01-01T12:00:00",
+            }, "user")
+
+        results["update_parquet_table"] = timed(write_interaction, calls)
+        reset_recommendation_state()
+    for attr, path in data_dirs.items():
+        setattr(db_utils, attr, path)
+    return results
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=Path(__file__).parent, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "commit": commit,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list[dict]:
+    """ Cases whose p50 is more than tolerance (relative) and min_delta_ms (absolute) above the baseline's"""
+    rows = []
+    for size, cases in report["results"].items():
+        for case, stats in cases.items():
+            reference = baseline.get("results", {}).get(size, {}).get(case)
+            if reference is None:
+                continue
+            ratio = stats["p50_ms"] / max(reference["p50_ms"], 1e-9)
+            rows.append({
+                "size": size,
+                "case": case,
+                "p50_ms": stats["p50_ms"],
+                "baseline_p50_ms": reference["p50_ms"],
+                "ratio": ratio,
+                "regression": ratio > 1.0 + tolerance and stats["p50_ms"] - reference["p50_ms"] > min_delta_ms,
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the storage and recommendation hot paths.")
+    parser.add_argument("--sizes", nargs="+", default=["small", "medium"], choices=list(SIZES))
+    parser.add_argument("--calls", type=int, default=20, help="Timed calls per case")
+    parser.add_argument("--users", type=int, default=10, help="Users the recommendation cases cycle through")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--baseline", help="Compare with this stored report")
+    parser.add_argument("--save-baseline", help="Store the report as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Flag p50s this much above the baseline (0.3 = +30%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Ignore differences below this (timer noise)")
+    args = parser.parse_args()
+
+    report = {
+        "environment": environment(),
+        "config": {"calls": args.calls, "users": args.users, "seed": args.seed, "sizes": {s: SIZES[s] for s in args.sizes}},
+        "results": {},
+    }
+    for size in args.sizes:
+        start = time.perf_counter()
+        report["results"][size] = run_size(size, args.calls, args.users, args.seed)
+        print(f"\n{size} {SIZES[size]} ({time.perf_counter() - start:.1f}s)")
+        print(f"{'case':>34} | {'p50':>10} | {'p95':>10} | {'mean':>10}")
+        for case, stats in report["results"][size].items():
+            print(f"{case:>34} | {stats['p50_ms']:>8.2f}ms | {stats['p95_ms']:>8.2f}ms | {stats['mean_ms']:>8.2f}ms")
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(report, baseline, args.tolerance, args.min_delta_ms)
+        print(f"\nvs baseline {args.baseline} (commit {baseline.get('environment', {}).get('commit')})")
+        print(f"{'size':>6} | {'case':>34} | {'p50':>10} | {'baseline':>10} | {'ratio':>6}")
+        for row in rows:
+            flag = "  REGRESSION" if row["regression"] else ""
+            print(
+                f"{row['size']:>6} | {row['case']:>34} | {row['p50_ms']:>8.2f}ms | {row['baseline_p50_ms']:>8.2f}ms | "
+                f"{row['ratio']:>5.2f}x{flag}"
+            )
+        if any(row["regression"] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Synthetic catalog and interaction log at production scale, written in the on-disk layout db_utils reads.
+
+- videos: categories follow backend/configs/mapped_labels_buckets.json, i.e. the share of the video classifier's labels
+  that map to every bucket of buckets.json (a third of the videos get a second bucket, like multi signal fusion).
+  Captions are built from the labels so the text embeddings have something to separate.
+- products: one category each from buckets.json (no "other"), same shares as the videos
+- interactions: users with Zipf skewed activity watch in sessions (swipes a few seconds apart, sessions days apart),
+  mostly in the 2-4 categories they like, videos inside a category drawn with Zipf popularity. Watch time relative
+  to the video duration sets skipped_quickly (< 3s, like the frontend) and watched_50_pct.
+
+Interactions are generated and written in chunks, so 10M rows never sit in memory as python objects.
+
+to run: python benchmarks/synthetic_data.py --out data_synth --videos 100000 --products 20000 --users 50000 --interactions 10000000
+        then point db_utils at it with use_data_dir("data_synth") (or run the service with that data directory)
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    from backend.src.database import db_utils
+except ModuleNotFoundError:
+    import sys
+
+    repo_root = Path(__file__).resolve().parents[1]
+    if str(repo_root) not in sys.path:
+        sys.path.insert(0, str(repo_root))
+    from backend.src.database import db_utils
+
+CONFIG_DIR = Path(__file__).resolve().parents[1] / "backend" / "configs"
+# matches SKIP_THRESHOLD_MS of the frontend interaction tracker
+SKIP_THRESHOLD_MS = 3000
+# share of videos whose fusion picked a second bucket
+SECOND_BUCKET_RATIO = 0.3
+MEAN_SESSION_LENGTH = 15
+INTERACTION_CHUNK_ROWS = 1_000_000
+
+
+def use_data_dir(data_dir: str):
+    """ Points db_utils at the tables under data_dir (same sub directories as the default data/ layout)"""
+    db_utils.VIDEO_DIR = f"{data_dir}/videos"
+    db_utils.PRODUCT_DIR = f"{data_dir}/products"
+    db_utils.VIDEO_PARQUET_DIR = f"{data_dir}/video_parquet"
+    db_utils.PRODUCT_PARQUET_DIR = f"{data_dir}/product_parquet"
+    db_utils.USER_INTERACTION_PARQUET_DIR = f"{data_dir}/user_interaction_parquet"
+    db_utils.EMBEDDING_DIR = f"{data_dir}/embeddings"
+
+
+def load_categories():
+    """
+    :return: (bucket_num per bucket name, labels per bucket_num, share of every bucket_num among the labels)
+    """
+    with open(CONFIG_DIR / "buckets.json", encoding="utf-8") as f:
+        buckets = json.load(f)["buckets"]
+    with open(CONFIG_DIR / "mapped_labels_buckets.json", encoding="utf-8") as f:
+        mapped_labels = json.load(f)
+
+    labels = {bucket_num: [] for bucket_num in buckets.values()}
+    for label, (bucket_num, _) in mapped_labels.items():
+        labels[bucket_num].append(label)
+    counts = np.array([len(labels[bucket_num]) for bucket_num in buckets.values()], dtype=np.float64)
+    # buckets no label maps to still show up now and then
+    shares = np.maximum(counts, 0.5) / np.maximum(counts, 0.5).sum()
+    return buckets, labels, dict(zip(buckets.values(), shares))
+
+
+def make_videos(n_videos: int, rng) -> pd.DataFrame:
+    """ Video metadata with the columns upload_video_service writes"""
+    buckets, labels, shares = load_categories()
+    bucket_names = {bucket_num: name for name, bucket_num in buckets.items()}
+    bucket_nums = np.array(list(shares))
+    p = np.array(list(shares.values()))
+
+    primary = rng.choice(bucket_nums, size=n_videos, p=p)
+    second = rng.choice(bucket_nums, size=n_videos, p=p)
+    has_second = (rng.random(n_videos) < SECOND_BUCKET_RATIO) & (second != primary)
+    bucket_num = [[a, b] if two else [a] for a, b, two in zip(primary.tolist(), second.tolist(), has_second.tolist())]
+
+    label_picks = rng.random(n_videos)
+    captions = []
+    for i, bucket in enumerate(primary.tolist()):
+        bucket_labels = labels[bucket] or [bucket_names[bucket]]
+        captions.append(f"{bucket_labels[int(label_picks[i] * len(bucket_labels))]} {bucket_names[bucket]} clip {i}")
+
+    video_ids = [f"synthetic-video-{i}" for i in range(n_videos)]
+    return pd.DataFrame({
+        "video_id": video_ids,
+        "video_path": [f"{db_utils.VIDEO_DIR}/{video_id}.mp4" for video_id in video_ids],
+        # short form clips, median ~25s
+        "duration_ms": np.clip(rng.lognormal(np.log(25_000), 0.6, size=n_videos), 3_000, 180_000).astype(np.int64),
+        "caption": captions,
+        "bucket_num": bucket_num,
+        "bucket_name": [[bucket_names[b] for b in buckets_of_video] for buckets_of_video in bucket_num],
+        "ocr_text": None,
+        "vid_caption": None,
+        "detected_objects": None,
+    })
+
+
+def make_products(n_products: int, rng) -> pd.DataFrame:
+    """ Product metadata with the columns upload_product_service writes"""
+    buckets, _, shares = load_categories()
+    names = [name for name in buckets if name != "other"]
+    p = np.array([shares[buckets[name]] for name in names])
+    category = rng.choice(names, size=n_products, p=p / p.sum())
+    product_ids = [f"synthetic-product-{i}" for i in range(n_products)]
+    return pd.DataFrame({
+        "product_id": product_ids,
+        "product_path": [f"{db_utils.PRODUCT_DIR}/{product_id}.jpg" for product_id in product_ids],
+        "title": [f"{name} product {i}" for i, name in enumerate(category)],
+        "product_details": [f"synthetic {name} product" for name in category],
+        "bucket_num": [buckets[name] for name in category],
+        "bucket_name": category,
+        "price": np.round(rng.lognormal(np.log(25.0), 0.8, size=n_products), 2),
+    })
+
+
+class InteractionModel:
+    """ Users (activity, liked categories) and per category video popularity order, shared by every chunk"""
+
+    def __init__(self, videos_df: pd.DataFrame, n_users: int, rng, activity_skew: float = 0.8, popularity_skew: float = 1.1):
+        self.video_ids = videos_df["video_id"].to_numpy()
+        self.duration_ms = videos_df["duration_ms"].to_numpy(dtype=np.float64)
+        primary = np.array([int(b[0]) for b in videos_df["bucket_num"]], dtype=np.int64)
+        self.n_categories = int(primary.max()) + 1
+        self.popularity_skew = popularity_skew
+
+        # videos grouped by primary category, every group in a random popularity order
+        by_category = rng.permutation(len(primary))
+        self.by_category = by_category[np.argsort(primary[by_category], kind="stable")]
+        self.category_ptr = np.searchsorted(primary[self.by_category], np.arange(self.n_categories + 1))
+        category_size = np.diff(self.category_ptr)
+
+        self.user_ids = np.array([f"synthetic-user-{u}" for u in range(n_users)], dtype=object)
+        activity = 1.0 / np.arange(1, n_users + 1) ** activity_skew
+        self.activity = rng.permutation(activity / activity.sum())
+
+        # 2-4 liked categories per user take 85% of their swipes, the rest follows the catalog
+        catalog_share = category_size / category_size.sum()
+        preference = np.tile(0.15 * catalog_share, (n_users, 1))
+        n_nonempty = int(np.count_nonzero(category_size))
+        for user, n_liked in enumerate(rng.integers(2, 5, size=n_users)):
+            n_liked = min(n_liked, n_nonempty)
+            liked = rng.choice(self.n_categories, size=n_liked, replace=False, p=catalog_share)
+            preference[user, liked] += 0.85 * rng.dirichlet(np.ones(n_liked))
+        self.preference_cdf = np.cumsum(preference / preference.sum(axis=1, keepdims=True), axis=1)
+        self.affinity = preference / catalog_share.clip(min=1e-9)
+
+    def sessions(self, n_rows: int, start_s: float, end_s: float, rng) -> pd.DataFrame:
+        """ About n_rows interactions in whole sessions between start_s and end_s, in the db_utils column layout"""
+        # a few more sessions than needed on average, the last one is cut at n_rows
+        n_sessions = int(n_rows / MEAN_SESSION_LENGTH * 1.1) + 1
+        session_user = rng.choice(len(self.user_ids), size=n_sessions, p=self.activity)
+        session_length = rng.geometric(1.0 / MEAN_SESSION_LENGTH, size=n_sessions)
+        # sessions start at least an hour before end_s so none runs into the future
+        session_start = rng.uniform(start_s, end_s - 3600, size=n_sessions)
+
+        user = np.repeat(session_user, session_length)[:n_rows]
+        n = len(user)
+        category = (rng.random((n, 1)) > self.preference_cdf[user]).sum(axis=1)
+        category = np.minimum(category, self.n_categories - 1)
+        category_size = self.category_ptr[category + 1] - self.category_ptr[category]
+        # categories without videos fall back to the largest one
+        largest = int(np.argmax(np.diff(self.category_ptr)))
+        category = np.where(category_size > 0, category, largest)
+        category_size = self.category_ptr[category + 1] - self.category_ptr[category]
+        rank = (rng.zipf(self.popularity_skew, size=n) - 1) % category_size
+        video = self.by_category[self.category_ptr[category] + rank]
+
+        # liked categories are watched further: about half the swipes outside them are quick skips, few inside
+        affinity = self.affinity[user, category]
+        watch_fraction = rng.beta(0.3 + 0.5 * affinity.clip(max=4.0), 1.5, size=n) * 1.5
+        watch_time_ms = np.maximum(watch_fraction * self.duration_ms[video], 500.0).astype(np.int64)
+
+        # swipes follow each other after the watch time plus a second, the session offsets restart per session
+        step_s = watch_time_ms / 1000.0 + 1.0
+        offset_s = np.cumsum(step_s) - step_s
+        session_first = np.repeat(np.cumsum(session_length) - session_length, session_length)[:n_rows]
+        epoch_s = np.repeat(session_start, session_length)[:n_rows] + offset_s - offset_s[session_first]
+
+        return pd.DataFrame({
+            "user_id": self.user_ids[user],
+            "video_id": self.video_ids[video],
+            "watch_time_ms": watch_time_ms,
+            "skipped_quickly": watch_time_ms < SKIP_THRESHOLD_MS,
+            "watched_50_pct": watch_time_ms >= self.duration_ms[video] / 2,
+            # naive local time with microseconds, like datetime.now().isoformat()
+            "interaction_timestamp": np.datetime_as_string((epoch_s * 1e6).astype("datetime64[us]"), unit="us"),
+        })
+
+
+def generate(data_dir: str, n_videos: int, n_products: int, n_users: int, n_interactions: int, days: float = 30.0,
+             seed: int = 0, popularity_skew: float = 1.1, verbose: bool = True) -> dict:
+    """
+    Writes the three tables under data_dir and points db_utils at them
+
+    :param popularity_skew: Zipf exponent of the video popularity inside a category (> 1, larger = more skewed)
+    :return: row counts per table
+    """
+    rng = np.random.default_rng(seed)
+    use_data_dir(data_dir)
+    start = time.perf_counter()
+
+    videos_df = make_videos(n_videos, rng)
+    db_utils.update_parquet_table_batch(videos_df, "video")
+    db_utils.update_parquet_table_batch(make_products(n_products, rng), "product")
+    if verbose:
+        print(f"catalog: {n_videos} videos, {n_products} products ({time.perf_counter() - start:.1f}s)")
+
+    model = InteractionModel(videos_df, n_users, rng, popularity_skew=popularity_skew)
+    end_s = pd.Timestamp.now().floor("s").value / 1e9
+    start_s = end_s - days * 86400
+    written = 0
+    while written < n_interactions:
+        chunk = model.sessions(min(INTERACTION_CHUNK_ROWS, n_interactions - written), start_s, end_s, rng)
+        db_utils.update_parquet_table_batch(chunk, "user")
+        written += len(chunk)
+        if verbose:
+            print(f"interactions: {written} / {n_interactions} ({time.perf_counter() - start:.1f}s)")
+
+    return {"videos": n_videos, "products": n_products, "users": n_users, "interactions": written}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic catalog and interaction log in the db_utils layout.")
+    parser.add_argument("--out", required=True, help="Data directory, gets video_parquet/ product_parquet/ user_interaction_parquet/")
+    parser.add_argument("--videos", type=int, default=100_000)
+    parser.add_argument("--products", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--interactions", type=int, default=1_000_000, help="Up to 10M")
+    parser.add_argument("--days", type=float, default=30.0, help="Interactions span the last N days")
+    parser.add_argument("--popularity-skew", type=float, default=1.1, help="Zipf exponent of video popularity (> 1)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if os.path.exists(args.out) and os.listdir(args.out):
+        parser.error(f"{args.out} is not empty, parquet parts would be appended to existing tables")
+    generate(args.out, args.videos, args.products, args.users, args.interactions, args.days, args.seed, args.popularity_skew)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ import { CategoryFilter } from "@/components/shop/CategoryFilter";
 import { ProductGrid } from "@/components/shop/ProductGrid";
 import { useProducts } from "@/hooks/use-products";
 import { useRecommendationTracker } from "@/hooks/use-recommendation-tracker";
+import { getUserId } from "@/lib/api-client";
 import { SurveyModal } from "@/components/ui/survey-modal";
 import { useAppStore } from "@/store/app-store";
 import { PageTransition } from "@/components/layout/PageTransition";
@@ -26,14 +27,7 @@ function ShopContent() {
   const hasRecommendations = Object.keys(watchedBuckets).length > 0;
 
   const [showSurvey, setShowSurvey] = useState(false);
-  const [userId] = useState(() => {
-    if (typeof window === "undefined") return "unknown";
-    const stored = localStorage.getItem("user_id");
-    if (stored) return stored;
-    const newId = `user_${Date.now()}`;
-    localStorage.setItem("user_id", newId);
-    return newId;
-  });
+  const [userId] = useState(getUserId);
 
   const currentRecommendationId = useMemo(() => {
     return `prod_rec_${loadCount}_${Date.now()}`;
@@ -3,6 +3,7 @@
 import { useCallback, useRef, useEffect, useState, useMemo } from "react";
 import { useVideoFeed } from "@/hooks/use-video-feed";
 import { useRecommendationTracker } from "@/hooks/use-recommendation-tracker";
+import { getUserId } from "@/lib/api-client";
 import { SurveyModal } from "@/components/ui/survey-modal";
 import { VideoCard } from "./VideoCard";
 import { Loader2, VideoOff } from "lucide-react";
@@ -16,15 +17,7 @@ export function VideoFeed() {
     useVideoFeed();
   const sentinelRef = useRef<HTMLDivElement>(null);
   const [showSurvey, setShowSurvey] = useState(false);
-  const [userId] = useState(() => {
-    // Generate or retrieve user ID (stored in localStorage)
-    if (typeof window === "undefined") return "unknown";
-    const stored = localStorage.getItem("user_id");
-    if (stored) return stored;
-    const newId = `user_${Date.now()}`;
-    localStorage.setItem("user_id", newId);
-    return newId;
-  });
+  const [userId] = useState(getUserId);
 
   const tracker = useRecommendationTracker(SURVEY_THRESHOLD);
 
@@ -11,23 +11,25 @@ export function useVideoFeed() {
 
   const query = useInfiniteQuery({
     queryKey: ["video-feed"],
-    queryFn: async () => {
-      const videos = await fetchFeed(FEED_PAGE_SIZE);
-      return videos.filter((v) => {
+    queryFn: async ({ pageParam }) => {
+      // pages after the first continue the server side feed session through its cursor
+      const page = await fetchFeed(FEED_PAGE_SIZE, pageParam);
+      const videos = page.videos.filter((v) => {
         if (seenIds.current.has(v.video_id)) return false;
         if (v.video_path.toLowerCase().endsWith(".avi")) return false;
         seenIds.current.add(v.video_id);
         return true;
       });
+      return { videos, nextCursor: page.nextCursor };
     },
-    initialPageParam: 0,
-    getNextPageParam: (_lastPage, allPages) => allPages.length,
+    initialPageParam: null as string | null,
+    getNextPageParam: (lastPage) => lastPage.nextCursor,
     staleTime: 30_000,
     retry: 2,
   });
 
   const allVideos: VideoMetadata[] =
-    query.data?.pages.flat() ?? [];
+    query.data?.pages.flatMap((page) => page.videos) ?? [];
 
   const loadMore = useCallback(() => {
     if (!query.isFetchingNextPage && query.hasNextPage !== false) {
@@ -1,5 +1,6 @@
 import { API_BASE, DIRECT_API_BASE } from "./constants";
 import type {
+  FeedPage,
   VideoMetadata,
   ProductMetadata,
   InteractionResponse,
@@ -7,13 +8,26 @@ import type {
   ProductUploadResponse,
 } from "./types";
 
-function normalizeFeedResponse(data: unknown): VideoMetadata[] {
-  if (Array.isArray(data)) return data;
+// Per browser user id kept in localStorage: sent with feed / shop requests and attached to the surveys
+export function getUserId(): string {
+  if (typeof window === "undefined") return "default";
+  const stored = localStorage.getItem("user_id");
+  if (stored) return stored;
+  const newId = `user_${Date.now()}`;
+  localStorage.setItem("user_id", newId);
+  return newId;
+}
+
+function normalizeFeedResponse(data: unknown): FeedPage {
+  if (Array.isArray(data)) return { videos: data, nextCursor: null };
   if (data && typeof data === "object" && "videos" in data) {
-    const obj = data as { videos: VideoMetadata[] };
-    return Array.isArray(obj.videos) ? obj.videos : [];
+    const obj = data as { videos: VideoMetadata[]; next_cursor?: string };
+    return {
+      videos: Array.isArray(obj.videos) ? obj.videos : [],
+      nextCursor: obj.next_cursor ?? null,
+    };
   }
-  return [];
+  return { videos: [], nextCursor: null };
 }
 
 function normalizeShopProductsResponse(data: unknown): ProductMetadata[] {
@@ -25,8 +39,14 @@ function normalizeShopProductsResponse(data: unknown): ProductMetadata[] {
   return [];
 }
 
-export async function fetchFeed(vidsNum = 10): Promise<VideoMetadata[]> {
-  const res = await fetch(`${API_BASE}/feed/videos?vids_num=${vidsNum}`);
+export async function fetchFeed(
+  vidsNum = 10,
+  cursor: string | null = null,
+): Promise<FeedPage> {
+  const cursorParam = cursor ? `&cursor=${encodeURIComponent(cursor)}` : "";
+  const res = await fetch(
+    `${API_BASE}/feed/videos?vids_num=${vidsNum}&user_id=${encodeURIComponent(getUserId())}${cursorParam}`,
+  );
   if (!res.ok) throw new Error(`Feed fetch failed: ${res.status}`);
   const data = await res.json();
   return normalizeFeedResponse(data);
@@ -126,6 +146,7 @@ export async function logInteraction(
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify({
       video_id: videoId,
+      user_id: getUserId(),
       watch_time_ms: watchTimeMs,
       skipped_quickly: extras?.skipped_quickly ?? false,
       watched_50_pct: extras?.watched_50_pct ?? false,
@@ -140,7 +161,7 @@ export async function fetchShopProducts(
 ): Promise<ProductMetadata[]> {
   try {
     const res = await fetch(
-      `${API_BASE}/shop/products?num_products=${numProducts}`,
+      `${API_BASE}/shop/products?num_products=${numProducts}&user_id=${encodeURIComponent(getUserId())}`,
     );
     if (!res.ok) return [];
     const data = await res.json();
@@ -151,7 +172,10 @@ export async function fetchShopProducts(
 }
 
 export async function refreshShop(): Promise<void> {
-  await fetch(`${API_BASE}/shop/refresh`, { method: "POST" });
+  await fetch(
+    `${API_BASE}/shop/refresh?user_id=${encodeURIComponent(getUserId())}`,
+    { method: "POST" },
+  );
 }
 
 export function getVideoUrl(videoId: string): string {
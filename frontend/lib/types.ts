@@ -22,7 +22,13 @@ export interface CartItem {
   quantity: number;
 }
 
+export interface FeedPage {
+  videos: VideoMetadata[];
+  nextCursor: string | null;
+}
+
 export interface InteractionResponse {
+  user_id: string;
   video_id: string;
   watch_time_ms: number;
   skipped_quickly: boolean;
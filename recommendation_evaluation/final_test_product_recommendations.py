@@ -54,6 +54,7 @@ from backend.src.product_recommendation.personalized_recommendation import (
     product_recommendation,
     _products_recommendation_cache  # Import cache to clear it between tests
 )
+from backend.src.product_recommendation.user_state import reset_user_states  # clears cached interactions between tests
 
 # Configuration (relative to project root)
 TEST_DIR = project_root / "data" / "test_interactions"
@@ -90,15 +91,15 @@ def test_actual_user_history_products(original_download_func):
     print("Scenario: Generating recommendations using your REAL app usage data. (User interaction parquet) \n")
     
     from backend.src.database import db_utils
-    import backend.src.product_recommendation.personalized_recommendation as rec_module
+    import backend.src.product_recommendation.user_state as user_state_module
     
     # 1. Restore the original download function to hit the real data
     db_utils.download_user_interactions = original_download_func
-    rec_module.download_user_interactions = original_download_func
+    user_state_module.download_user_interactions = original_download_func
     
     # 2. Force clear the cache so we don't just get Test 5's data
-    _products_recommendation_cache["data"] = None
-    _products_recommendation_cache["timestamp"] = 0
+    reset_user_states()
+    _products_recommendation_cache.clear()
     
     try:
         # 3. Get recommendations
@@ -194,8 +195,8 @@ def setup_test_environment():
     if os.path.exists(TEST_DIR):
         shutil.rmtree(TEST_DIR)
     os.makedirs(TEST_DIR, exist_ok=True)
-    _products_recommendation_cache["data"] = None
-    _products_recommendation_cache["timestamp"] = 0
+    reset_user_states()
+    _products_recommendation_cache.clear()
     print(f"✅ Created fresh test directory and cleared product cache.\n")
 
 def create_mock_interaction(
@@ -220,23 +221,27 @@ def save_mock_interaction(interaction: dict):
     file_key = f"{interaction['video_id']}-{int(datetime.now().timestamp() * 1000000)}"
     out_path = os.path.join(TEST_DIR, f"part-{file_key}.parquet")
     df.to_parquet(out_path, engine="pyarrow", index=False)
+    # per-user state caches the interaction log, drop it so the next recommendation reads the new row
+    reset_user_states()
+    _products_recommendation_cache.clear()
 
 def monkey_patch_download_interactions():
     from backend.src.database import db_utils
-    import backend.src.product_recommendation.personalized_recommendation as rec_module
+    import backend.src.product_recommendation.user_state as user_state_module
     
     original_download = db_utils.download_user_interactions
-    def test_download():
+    def test_download(user_id=None):
         if not os.path.exists(TEST_DIR):
-            return pd.DataFrame()
+            return pd.DataFrame(columns=list(create_mock_interaction("").keys()))
         parquet_files = list(Path(TEST_DIR).glob("*.parquet"))
         if not parquet_files:
-            return pd.DataFrame()
+            return pd.DataFrame(columns=list(create_mock_interaction("").keys()))
         dfs = [pd.read_parquet(f) for f in parquet_files]
         return pd.concat(dfs, ignore_index=True)
     
     db_utils.download_user_interactions = test_download
-    rec_module.download_user_interactions = test_download
+    user_state_module.download_user_interactions = test_download
+    reset_user_states()
     return original_download
 
 def plot_histogram(categories, title, total_categories=13):
@@ -0,0 +1,358 @@
+"""
+Offline replay harness: streams an interaction log in time order through the recommenders.
+
+The storage reads of the recommendation modules are pointed at an in-memory stand-in that only shows the
+interactions replayed so far, and the scoring clock is pinned to the replayed interaction's time, so every page is
+recommended exactly as the service would have at that moment. Before every --eval-every'th interaction the
+interacting user gets a feed page, then the interaction is applied through the same hooks the interaction service
+calls (user state, co-engagement index, shop cache).
+
+Metrics
+- hit rate: the video the user interacted with next was on the page; category hit rate: its category was
+- coverage: share of the catalog / of the catalog categories recommended at least once, categories per page
+- novelty: mean -log2 popularity of the recommended items, popularity = interactions replayed so far (add-one smoothed)
+- latency: p50 / p95 / p99 per recommender call
+
+to run: python recommendation_evaluation/replay_harness.py --events 1000000          (synthetic log)
+        python recommendation_evaluation/replay_harness.py --data-dir data --json replay.json   (recorded log)
+        python recommendation_evaluation/replay_harness.py --data-dir data_synth   (benchmarks/synthetic_data.py output)
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Add parent directory to path so we can import backend module
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.src.database import db_utils
+from backend.src.product_recommendation import catalog_index, co_engagement, user_state
+from backend.src.product_recommendation.catalog_index import get_catalog_index
+from backend.src.product_recommendation.co_engagement import get_co_engagement_index, record_co_engagement, reset_co_engagement
+from backend.src.product_recommendation.embedding_index import EMBEDDING_SPACES, get_embedding_index, reset_embedding_indexes
+from backend.src.product_recommendation.personalized_recommendation import (
+    video_recommendation,
+    product_recommendation,
+    invalidate_products_cache,
+    invalidate_user_products_cache,
+    seed_recommendation_rng,
+)
+from backend.src.product_recommendation.scoring import set_clock
+from backend.src.product_recommendation.user_state import record_interaction, reset_user_states
+from benchmarks.bench_scoring import make_catalog
+from benchmarks.synthetic_data import use_data_dir
+
+N_BUCKETS = 14
+
+
+class InMemoryStorage:
+    """
+    Stand-in for the parquet tables: catalogs plus an interaction log sorted by time, of which only the first
+    n_applied rows are visible to the download functions.
+
+    :param max_events: keep only the first max_events interactions in time order, later ones are never replayed
+    """
+
+    def __init__(self, videos_df: pd.DataFrame, products_df: pd.DataFrame, interactions_df: pd.DataFrame,
+                 max_events: int = None):
+        self.videos_df = videos_df
+        self.products_df = products_df
+
+        timestamps = pd.to_datetime(interactions_df["interaction_timestamp"], errors="coerce", format="ISO8601")
+        if timestamps.dt.tz is not None:
+            timestamps = timestamps.dt.tz_convert(None)
+        epoch_s = timestamps.to_numpy(dtype="datetime64[ns]").astype(np.int64) / 1e9
+        epoch_s[timestamps.isna().to_numpy()] = np.nan
+
+        # rows without a timestamp first, like the bandit and co-engagement replays
+        order = np.argsort(np.nan_to_num(epoch_s, nan=-np.inf), kind="stable")[:max_events]
+        self.interactions_df = interactions_df.iloc[order].reset_index(drop=True)
+        self.epoch_s = epoch_s[order]
+        self.n_applied = 0
+
+        user_codes, self.user_ids = pd.factorize(self.interactions_df["user_id"])
+        user_order = np.argsort(user_codes, kind="stable")
+        user_ptr = np.searchsorted(user_codes[user_order], np.arange(len(self.user_ids) + 1))
+        self._user_rows = {
+            user_id: user_order[user_ptr[i]:user_ptr[i + 1]] for i, user_id in enumerate(self.user_ids)
+        }
+        # plain arrays, one event dict per replayed row without going through pandas
+        self._columns = {col: self.interactions_df[col].to_numpy() for col in self.interactions_df.columns}
+
+    @property
+    def n_events(self) -> int:
+        return len(self.interactions_df)
+
+    def event(self, row: int) -> dict:
+        return {col: values[row] for col, values in self._columns.items()}
+
+    def download_all_videos_metadata(self) -> pd.DataFrame:
+        return self.videos_df.copy()
+
+    def download_all_products_metadata(self) -> pd.DataFrame:
+        return self.products_df.copy()
+
+    def download_user_interactions(self, user_id: str = None) -> pd.DataFrame:
+        if user_id is None:
+            return self.interactions_df.iloc[:self.n_applied].reset_index(drop=True)
+        rows = self._user_rows.get(user_id, np.empty(0, dtype=np.int64))
+        return self.interactions_df.iloc[rows[rows < self.n_applied]].reset_index(drop=True)
+
+
+# (module, attribute) pairs the recommendation modules read storage through
+_PATCHED = [
+    (db_utils, "download_user_interactions"),
+    (db_utils, "download_all_videos_metadata"),
+    (db_utils, "download_all_products_metadata"),
+    (catalog_index, "download_all_videos_metadata"),
+    (catalog_index, "download_all_products_metadata"),
+    (user_state, "download_user_interactions"),
+    (co_engagement, "download_user_interactions"),
+]
+
+
+def _reset_recommendation_state():
+    catalog_index._catalog_indexes.clear()
+    reset_embedding_indexes()
+    reset_user_states()
+    reset_co_engagement()
+    invalidate_products_cache()
+
+
+@contextmanager
+def installed(storage: InMemoryStorage):
+    """ Points the recommendation modules at storage (embeddings in a temporary dir), everything is restored on exit"""
+    originals = [(module, name, getattr(module, name)) for module, name in _PATCHED]
+    original_embedding_dir = db_utils.EMBEDDING_DIR
+    with tempfile.TemporaryDirectory() as embedding_dir:
+        try:
+            for module, name in _PATCHED:
+                setattr(module, name, getattr(storage, name))
+            db_utils.EMBEDDING_DIR = embedding_dir
+            _reset_recommendation_state()
+            yield storage
+        finally:
+            for module, name, original in originals:
+                setattr(module, name, original)
+            db_utils.EMBEDDING_DIR = original_embedding_dir
+            set_clock(None)
+            _reset_recommendation_state()
+
+
+def percentiles(samples_s) -> dict:
+    samples_ms = np.asarray(samples_s, dtype=np.float64) * 1e3
+    if len(samples_ms) == 0:
+        return {"calls": 0}
+    return {
+        "calls": len(samples_ms),
+        "mean_ms": float(samples_ms.mean()),
+        **{f"p{q}_ms": float(np.percentile(samples_ms, q)) for q in (50, 95, 99)},
+    }
+
+
+def replay(storage: InMemoryStorage, page_size: int = 10, eval_every: int = 50, shop_every: int = 0,
+           shop_size: int = 50, seed: int = 0, progress_every: int = 0) -> dict:
+    """
+    Streams storage's log through the recommenders (see module docstring)
+
+    :param eval_every: a feed page is recommended before every eval_every'th interaction
+    :param shop_every: a shop page is recommended before every shop_every'th interaction, 0 = never
+    :param progress_every: print progress every N interactions, 0 = quiet
+    """
+    n_events = storage.n_events
+    seed_recommendation_rng(seed)
+
+    with installed(storage):
+        # catalog / embedding / co-engagement indexes are built once up front, not inside the first timed call
+        start = time.perf_counter()
+        videos, products = get_catalog_index("video"), get_catalog_index("product")
+        for item_type, space in EMBEDDING_SPACES:
+            get_embedding_index(item_type, space)
+        get_co_engagement_index()
+        setup_s = time.perf_counter() - start
+
+        video_primary = videos.primary_buckets(np.arange(videos.n_items))
+        product_primary = products.primary_buckets(np.arange(products.n_items))
+        popularity = np.zeros(videos.n_items, dtype=np.int64)
+
+        feed = {"latency_s": [], "hits": 0, "category_hits": 0, "evaluated": 0, "novelty": 0.0, "items": 0,
+                "page_categories": 0}
+        shop = {"latency_s": [], "page_categories": 0}
+        recommended_videos = np.zeros(videos.n_items, dtype=bool)
+        recommended_products = np.zeros(products.n_items, dtype=bool)
+
+        start = time.perf_counter()
+        for row in range(n_events):
+            event = storage.event(row)
+            user_id = event["user_id"]
+            if not np.isnan(storage.epoch_s[row]):
+                set_clock(storage.epoch_s[row])
+
+            if eval_every and row % eval_every == 0:
+                call_start = time.perf_counter()
+                page = video_recommendation(page_size, user_id)
+                feed["latency_s"].append(time.perf_counter() - call_start)
+
+                positions = np.array([videos.position[video["video_id"]] for video in page], dtype=np.int64)
+                target = videos.position.get(event["video_id"], -1)
+                feed["evaluated"] += 1
+                feed["hits"] += int(target in positions)
+                feed["category_hits"] += int(target >= 0 and video_primary[target] in video_primary[positions])
+                feed["page_categories"] += len(np.unique(video_primary[positions]))
+                # add-one smoothed popularity of the items among the interactions replayed so far
+                p = (popularity[positions] + 1) / (row + videos.n_items)
+                feed["novelty"] += float(-np.log2(p).sum())
+                feed["items"] += len(positions)
+                recommended_videos[positions] = True
+
+            if shop_every and row % shop_every == 0:
+                call_start = time.perf_counter()
+                page = product_recommendation(shop_size, user_id)
+                shop["latency_s"].append(time.perf_counter() - call_start)
+                positions = np.array([products.position[product["product_id"]] for product in page], dtype=np.int64)
+                shop["page_categories"] += len(np.unique(product_primary[positions]))
+                recommended_products[positions] = True
+
+            # the interaction is "written", then the same hooks as update_user_interaction_service
+            storage.n_applied = row + 1
+            record_interaction(event)
+            record_co_engagement(event)
+            invalidate_user_products_cache(user_id)
+            target = videos.position.get(event["video_id"], -1)
+            if target >= 0:
+                popularity[target] += 1
+
+            if progress_every and (row + 1) % progress_every == 0:
+                elapsed_s = time.perf_counter() - start
+                print(f"  {row + 1:>10} / {n_events} interactions | {elapsed_s:7.1f}s | {(row + 1) / elapsed_s:8.0f} /s")
+        replay_s = time.perf_counter() - start
+
+    video_categories = np.unique(video_primary[video_primary >= 0])
+    product_categories = np.unique(product_primary[product_primary >= 0])
+    evaluated = max(feed["evaluated"], 1)
+    return {
+        "events": n_events,
+        "setup_s": setup_s,
+        "replay_s": replay_s,
+        "events_per_s": n_events / max(replay_s, 1e-9),
+        "video": {
+            "hit_rate": feed["hits"] / evaluated,
+            "category_hit_rate": feed["category_hits"] / evaluated,
+            "catalog_coverage": float(recommended_videos.mean()) if videos.n_items else 0.0,
+            "category_coverage": len(np.intersect1d(np.unique(video_primary[recommended_videos]), video_categories))
+                                 / max(len(video_categories), 1),
+            "categories_per_page": feed["page_categories"] / evaluated,
+            "novelty_bits": feed["novelty"] / max(feed["items"], 1),
+            "latency": percentiles(feed["latency_s"]),
+        },
+        "product": {
+            "catalog_coverage": float(recommended_products.mean()) if products.n_items else 0.0,
+            "category_coverage": len(np.intersect1d(np.unique(product_primary[recommended_products]), product_categories))
+                                 / max(len(product_categories), 1),
+            "categories_per_page": shop["page_categories"] / max(len(shop["latency_s"]), 1),
+            "latency": percentiles(shop["latency_s"]),
+        },
+    }
+
+
+def synthetic_log(n_events: int, n_users: int = 5000, n_videos: int = 20000, n_products: int = 5000,
+                  days: float = 30.0, seed: int = 0):
+    """
+    Catalog plus a log of users who mostly watch 2-3 liked categories, videos inside a category drawn with Zipf
+    popularity and user activity Zipf skewed. Liked categories are watched past halfway more and skipped less.
+
+    :return: (videos_df, products_df, interactions_df) in the db_utils column layout
+    """
+    rng = np.random.default_rng(seed)
+    videos_df = make_catalog(n_videos, rng)
+    products_df = pd.DataFrame({
+        "product_id": [f"prod-{i}" for i in range(n_products)],
+        "title": [f"product {i}" for i in range(n_products)],
+        "bucket_num": [f"{b:02d}" for b in rng.integers(1, N_BUCKETS, size=n_products)],
+        "price": 10.0,
+    })
+
+    # videos grouped by primary category, every group in a random popularity order
+    primary = np.array([int(buckets[0]) for buckets in videos_df["bucket_num"]])
+    by_category = rng.permutation(n_videos)
+    by_category = by_category[np.argsort(primary[by_category], kind="stable")]
+    category_ptr = np.searchsorted(primary[by_category], np.arange(N_BUCKETS + 1))
+    category_size = np.diff(category_ptr)
+
+    activity = 1.0 / np.arange(1, n_users + 1) ** 0.8
+    user = rng.choice(n_users, size=n_events, p=activity / activity.sum())
+    likes = np.stack([rng.choice(np.arange(1, N_BUCKETS), size=3, replace=False) for _ in range(n_users)])
+    liked = rng.random(n_events) < 0.8
+    category = np.where(liked, likes[user, rng.integers(0, 3, size=n_events)], rng.integers(1, N_BUCKETS, size=n_events))
+    # categories without videos fall back to the largest one
+    category = np.where(category_size[category] > 0, category, int(np.argmax(category_size)))
+    rank = (rng.zipf(1.5, size=n_events) - 1) % category_size[category]
+    video = by_category[category_ptr[category] + rank]
+
+    start_s = pd.Timestamp.now().floor("s").value // 10**9 - int(days * 86400)
+    epoch_s = start_s + np.sort(rng.integers(0, int(days * 86400), size=n_events))
+    interactions_df = pd.DataFrame({
+        "user_id": np.array([f"user-{u}" for u in range(n_users)], dtype=object)[user],
+        "video_id": videos_df["video_id"].to_numpy()[video],
+        "watch_time_ms": rng.integers(500, 90000, size=n_events),
+        "skipped_quickly": rng.random(n_events) < np.where(liked, 0.1, 0.4),
+        "watched_50_pct": rng.random(n_events) < np.where(liked, 0.6, 0.2),
+        "interaction_timestamp": np.datetime_as_string(epoch_s.astype("datetime64[s]"), unit="s"),
+    })
+    return videos_df, products_df, interactions_df
+
+
+def load_data_dir(data_dir: str):
+    """ Catalogs and the interaction log of a db_utils data directory, read once"""
+    use_data_dir(data_dir)
+    return (
+        db_utils.download_all_videos_metadata(),
+        db_utils.download_all_products_metadata(),
+        db_utils.download_user_interactions(),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an interaction log through the recommenders offline.")
+    parser.add_argument("--data-dir", help="db_utils data directory to replay, a synthetic log if not given")
+    parser.add_argument("--events", type=int, default=100_000, help="Synthetic log size / replay at most this many")
+    parser.add_argument("--users", type=int, default=5000, help="Synthetic users")
+    parser.add_argument("--videos", type=int, default=20_000, help="Synthetic video catalog size")
+    parser.add_argument("--products", type=int, default=5000, help="Synthetic product catalog size")
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--eval-every", type=int, default=50, help="Recommend a feed page before every Nth interaction")
+    parser.add_argument("--shop-every", type=int, default=0, help="Recommend a shop page before every Nth interaction")
+    parser.add_argument("--shop-size", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the metrics to this file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.data_dir:
+        data = load_data_dir(args.data_dir)
+    else:
+        data = synthetic_log(args.events, args.users, args.videos, args.products, seed=args.seed)
+    storage = InMemoryStorage(*data, max_events=args.events)
+    del data
+    print(f"loaded {storage.n_events} interactions of {len(storage.user_ids)} users in {time.perf_counter() - start:.1f}s")
+
+    results = replay(
+        storage, args.page_size, args.eval_every, args.shop_every, args.shop_size,
+        seed=args.seed, progress_every=max(storage.n_events // 20, 1),
+    )
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Checks for the incremental item-item co-engagement index.
+
+- recording a log interaction by interaction gives the same neighbour rows as the vectorized replay of the whole log
+- a compaction (also one in the middle of the stream) changes nothing a lookup returns
+- only positives of the same session are paired, a gap longer than SESSION_GAP_S starts a new session
+- a replay merged in small chunks gives the same counts as one in a single chunk
+- interactions recorded while the index is being built are applied once, after the build
+
+to run: python recommendation_evaluation/test_co_engagement.py   (or via pytest)
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Add parent directory to path so we can import backend module
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.src.product_recommendation import co_engagement
+from backend.src.product_recommendation.co_engagement import CoEngagementIndex, SESSION_GAP_S, get_co_engagement_index, \
+    record_co_engagement, reset_co_engagement
+
+
+def make_random_log(seed: int, n_rows: int = 3000, n_videos: int = 60, n_users: int = 8):
+    rng = np.random.default_rng(seed)
+    # a few sessions per user: mostly short gaps, now and then a long break
+    gaps = np.where(rng.random(n_rows) < 0.05, 4 * SESSION_GAP_S, rng.integers(5, 600, size=n_rows))
+    return {
+        "user_ids": np.array([f"user-{u}" for u in rng.integers(0, n_users, size=n_rows)], dtype=object),
+        "video_idx": np.where(rng.random(n_rows) < 0.03, -1, rng.integers(0, n_videos, size=n_rows)),
+        "epoch_s": 1.7e9 + np.cumsum(gaps).astype(np.float64),
+        "positive": rng.random(n_rows) < 0.5,
+    }
+
+
+def neighbour_counts(index, n_videos):
+    """ {video: {neighbour: count}}, ties make the order inside a row arbitrary so rows are compared as dicts"""
+    return {v: dict(zip(*(a.tolist() for a in index.neighbours(v)))) for v in range(n_videos)}
+
+
+def assert_same_rows(left, right):
+    for v in left:
+        # rows may pick different videos among neighbours tied at the cut, their counts must agree
+        assert sorted(left[v].values()) == sorted(right[v].values()), (v, left[v], right[v])
+        shared = set(left[v]) & set(right[v])
+        assert all(left[v][u] == right[v][u] for u in shared), v
+
+
+def replay(log, compact_at=()):
+    index = CoEngagementIndex(n_neighbours=10)
+    for i, args in enumerate(zip(log["user_ids"], log["video_idx"], log["epoch_s"], log["positive"])):
+        index.record(*args)
+        if i in compact_at:
+            index.compact()
+    return index
+
+
+def test_incremental_matches_vectorized_replay():
+    for seed in range(3):
+        log = make_random_log(seed)
+        batch = CoEngagementIndex.from_log(log["user_ids"], log["video_idx"], log["epoch_s"], log["positive"], n_neighbours=10)
+        assert_same_rows(neighbour_counts(replay(log), 60), neighbour_counts(batch, 60))
+
+
+def test_compaction_keeps_lookups():
+    log = make_random_log(7)
+    plain = neighbour_counts(replay(log), 60)
+    compacted = replay(log, compact_at={500, 1500, 2999})
+    assert_same_rows(neighbour_counts(compacted, 60), plain)
+    # after a final compaction every row comes from the CSR arrays
+    assert not compacted._top_rows
+
+
+def test_sessions_and_negatives():
+    index = CoEngagementIndex()
+    t = 1.7e9
+    index.record("a", 1, t, True)
+    index.record("a", 2, t + 60, False)          # not watched past 50%: not paired
+    index.record("a", 3, t + 120, True)          # paired with 1
+    index.record("b", 4, t + 130, True)          # other user
+    index.record("a", 5, t + 120 + 2 * SESSION_GAP_S, True)   # new session
+
+    assert index.neighbours(1)[0].tolist() == [3]
+    assert index.neighbours(3)[0].tolist() == [1]
+    assert len(index.neighbours(2)[0]) == 0 and len(index.neighbours(4)[0]) == 0 and len(index.neighbours(5)[0]) == 0
+
+    positions, scores = index.expand([1, 3], 5, excluded=({1},))
+    assert positions.tolist() == [3] and scores.tolist() == [1.0]
+
+
+def test_chunked_replay_matches_single_chunk():
+    log = make_random_log(3)
+    whole = CoEngagementIndex.from_log(log["user_ids"], log["video_idx"], log["epoch_s"], log["positive"])
+    chunk_pairs = co_engagement.REPLAY_CHUNK_PAIRS
+    try:
+        for co_engagement.REPLAY_CHUNK_PAIRS in (1, 500):
+            chunked = CoEngagementIndex.from_log(log["user_ids"], log["video_idx"], log["epoch_s"], log["positive"])
+            for left, right in zip(chunked._counts, whole._counts):
+                assert np.array_equal(left, right)
+    finally:
+        co_engagement.REPLAY_CHUNK_PAIRS = chunk_pairs
+
+
+class _Catalog:
+    position = {"v0": 0, "v1": 1, "v2": 2}
+
+    def id_index(self):
+        return pd.Index(["v0", "v1", "v2"])
+
+
+def test_interactions_during_build():
+    def interaction(video_id, timestamp, user_id="a"):
+        return {"user_id": user_id, "video_id": video_id, "watch_time_ms": 9000, "skipped_quickly": False,
+                "watched_50_pct": True, "interaction_timestamp": timestamp}
+
+    # user b was active last: with a single cached session the replay keeps no session state of a
+    logged = [interaction("v0", "2026-01-01T12:00:00"), interaction("v1", "2026-01-01T12:01:00"),
+              interaction("v0", "2026-01-01T12:05:00", "b")]
+
+    def download_during_requests():
+        # hooks of requests running during the build: the last logged row of a and a newer one not in the download
+        record_co_engagement(logged[1])
+        record_co_engagement(interaction("v2", "2026-01-01T12:02:00"))
+        return pd.DataFrame(logged)
+
+    def build(max_cached_users):
+        patched = {"download_user_interactions": download_during_requests, "get_catalog_index": lambda item_type: _Catalog(),
+                   "MAX_CACHED_USERS": max_cached_users}
+        originals = {name: getattr(co_engagement, name) for name in patched}
+        try:
+            for name, value in patched.items():
+                setattr(co_engagement, name, value)
+            reset_co_engagement()
+            index = get_co_engagement_index()
+            assert co_engagement._pending_interactions is None
+            return [dict(zip(*(a.tolist() for a in index.neighbours(v)))) for v in range(3)]
+        finally:
+            for name, value in originals.items():
+                setattr(co_engagement, name, value)
+            reset_co_engagement()
+
+    # the logged row is not replayed again, the new one joins a's session
+    assert build(co_engagement.MAX_CACHED_USERS) == [{1: 1.0, 2: 1.0}, {0: 1.0, 2: 1.0}, {0: 1.0, 1: 1.0}]
+    # without a's session state the logged row is still recognized: replaying it would pair v1 with v2
+    assert build(1) == [{1: 1.0}, {0: 1.0}, {}]
+
+
+def run_all_tests():
+    print("\n" + "=" * 70)
+    print("TEST: co-engagement index")
+    print("=" * 70)
+    for test in (
+        test_incremental_matches_vectorized_replay,
+        test_compaction_keeps_lookups,
+        test_sessions_and_negatives,
+        test_chunked_replay_matches_single_chunk,
+        test_interactions_during_build,
+    ):
+        test()
+        print(f"✅ {test.__name__}")
+    print("✅ ALL TESTS PASSED")
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,116 @@
+"""
+Checks for the diversity re-ranking of recommendation pages.
+
+- the re-ranked order is a permutation, without conflicts it keeps the (shuffled) input order
+- buckets are interleaved when the lookahead holds enough other buckets, embeddings keep similar items apart
+- with mmr_lambda = 1 relevance alone decides
+- on random pages from a skewed bucket mix both re-rankers beat the plain shuffle (printed as a comparison table)
+
+to run: python recommendation_evaluation/test_diversity_rerank.py   (or via pytest)
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Add parent directory to path so we can import backend module
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.src.product_recommendation.diversity import diversify, page_diversity
+
+
+def test_permutation_and_input_order_without_conflicts():
+    order = diversify(np.arange(20))
+    assert order.tolist() == list(range(20))
+
+    rng = np.random.default_rng(0)
+    buckets = rng.integers(0, 3, size=200)
+    order = diversify(buckets, window=3, lookahead=8)
+    assert sorted(order.tolist()) == list(range(200))
+
+    # items without a bucket never conflict
+    assert diversify(np.full(10, -1)).tolist() == list(range(10))
+
+
+def test_buckets_are_interleaved():
+    # three blocks of five: a plain order would serve five of a kind in a row
+    buckets = np.repeat([1, 2, 3], 5)
+    order = diversify(buckets, window=2, lookahead=15)
+    assert buckets[order].tolist() == [1, 2, 3] * 5
+
+    # the lookahead bounds how far ahead another bucket is searched for
+    assert buckets[diversify(buckets, window=2, lookahead=3)].tolist()[:3] == [1, 1, 1]
+
+
+def test_embeddings_keep_similar_items_apart():
+    # one bucket, two clusters of near duplicates
+    a, b = np.eye(8, dtype=np.float32)[:2]
+    embeddings = np.stack([a] * 4 + [b] * 4)
+    order = diversify(np.full(8, -1), embeddings, window=1, lookahead=8)
+    clusters = (embeddings[order] @ a > 0.5).astype(int).tolist()
+    assert clusters == [1, 0, 1, 0, 1, 0, 1, 0], clusters
+
+
+def test_relevance_only():
+    relevance = np.array([0.1, 0.9, 0.5, 0.7])
+    order = diversify(np.zeros(4, dtype=np.int64), relevance=relevance, lookahead=4, mmr_lambda=1.0)
+    assert order.tolist() == [1, 3, 2, 0]
+
+
+def compare_strategies(n_pages: int = 200, page_size: int = 50, seed: int = 0) -> dict:
+    """ mean page diversity of shuffle / interleave / mmr on random pages from a skewed bucket and topic mix"""
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(30, 32)).astype(np.float32)
+    results = {"shuffle": [], "interleave": [], "mmr": []}
+    for _ in range(n_pages):
+        buckets = rng.choice(13, size=page_size, p=np.r_[0.4, np.full(12, 0.05)])
+        # items of a bucket mostly share a few topics
+        vectors = topics[(buckets * 2 + rng.integers(0, 2, size=page_size) + rng.integers(0, 3, size=page_size) // 2 * 7) % 30]
+        vectors = vectors + 0.3 * rng.normal(size=vectors.shape).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        shuffled = rng.permutation(page_size)
+        orders = {
+            "shuffle": shuffled,
+            "interleave": shuffled[diversify(buckets[shuffled])],
+            "mmr": shuffled[diversify(buckets[shuffled], vectors[shuffled])],
+        }
+        for name, order in orders.items():
+            results[name].append(page_diversity(buckets[order], vectors[order]))
+    return {name: {key: float(np.mean([p[key] for p in pages])) for key in pages[0]} for name, pages in results.items()}
+
+
+def test_rerankers_beat_shuffle():
+    stats = compare_strategies(n_pages=50)
+    assert stats["interleave"]["adjacent_same_bucket"] < stats["shuffle"]["adjacent_same_bucket"] / 2, stats
+    # mmr trades bucket spacing for content spacing
+    for name in ("interleave", "mmr"):
+        assert stats[name]["adjacent_same_bucket"] < stats["shuffle"]["adjacent_same_bucket"], stats
+        assert stats[name]["longest_bucket_run"] < stats["shuffle"]["longest_bucket_run"], stats
+    assert stats["mmr"]["window_similarity"] < stats["shuffle"]["window_similarity"] / 2, stats
+
+
+def run_all_tests():
+    print("\n" + "=" * 70)
+    print("TEST: diversity re-ranking")
+    print("=" * 70)
+    for test in (
+        test_permutation_and_input_order_without_conflicts,
+        test_buckets_are_interleaved,
+        test_embeddings_keep_similar_items_apart,
+        test_relevance_only,
+        test_rerankers_beat_shuffle,
+    ):
+        test()
+        print(f"✅ {test.__name__}")
+
+    print(f"\n{'strategy':>10} | {'same bucket neighbours':>22} | {'longest run':>11} | {'window similarity':>17}")
+    for name, stats in compare_strategies().items():
+        print(f"{name:>10} | {stats['adjacent_same_bucket']:>22.3f} | {stats['longest_bucket_run']:>11.2f} | {stats['window_similarity']:>17.3f}")
+    print("✅ ALL TESTS PASSED")
+
+
+if __name__ == "__main__":
+    run_all_tests()
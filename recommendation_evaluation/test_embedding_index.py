@@ -0,0 +1,218 @@
+"""
+Checks for the content embedding index behind the similarity share of the recommendations.
+
+- items whose pipeline text matches the query rank first, excluded positions are skipped
+- rows are persisted by item id: a reload reuses them, uploads are encoded and appended once
+- the inverted file used for big catalogs finds the same nearest items as the full scan on clustered rows
+- image embeddings are only stored by the upload hook, a re-upload replaces the item's row
+- the user's content profile kept up to date interaction by interaction equals the one built from the whole log
+- requests never load an index: peek_embedding_index hands out None until the background load is done
+
+to run: python recommendation_evaluation/test_embedding_index.py   (or via pytest)
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Add parent directory to path so we can import backend module
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.src.database import db_utils
+from backend.src.product_recommendation import catalog_index, embedding_index
+from backend.src.product_recommendation.catalog_index import CatalogIndex
+from backend.src.product_recommendation.scoring import encode_interactions
+from backend.src.product_recommendation.user_state import UserState
+
+VIDEOS = [
+    {"video_id": "v0", "caption": "morning run", "vid_caption": "a man running on a track", "ocr_text": "marathon training",
+     "detected_objects": ["person", "sneakers"], "bucket_name": ["sports"], "bucket_num": ["09"]},
+    {"video_id": "v1", "caption": "pasta night", "vid_caption": "a woman cooking pasta in a kitchen", "ocr_text": None,
+     "detected_objects": ["bowl", "knife"], "bucket_name": ["kitchen"], "bucket_num": ["05"]},
+    {"video_id": "v2", "caption": "new lipstick shades", "vid_caption": "a woman applying makeup", "ocr_text": "matte lipstick",
+     "detected_objects": None, "bucket_name": ["beauty"], "bucket_num": ["03"]},
+    {"video_id": "v3", "caption": "trail running shoes review", "vid_caption": None, "ocr_text": "running shoes",
+     "detected_objects": ["sneakers"], "bucket_name": ["sports"], "bucket_num": ["09"]},
+]
+
+
+def with_video_catalog(records, test):
+    """ Runs test() against an in memory video catalog with embeddings stored in a temporary directory"""
+    original_dir = db_utils.EMBEDDING_DIR
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_utils.EMBEDDING_DIR = tmp_dir
+        catalog_index._catalog_indexes["video"] = CatalogIndex.from_records([dict(r) for r in records], "video_id")
+        embedding_index.reset_embedding_indexes()
+        try:
+            test()
+        finally:
+            # waits for background loads, they write into the temporary directory
+            embedding_index.reset_embedding_indexes()
+            db_utils.EMBEDDING_DIR = original_dir
+            catalog_index._catalog_indexes.pop("video", None)
+
+
+def test_matching_text_ranks_first():
+    def test():
+        index = embedding_index.get_embedding_index("video")
+        query = embedding_index.encode_texts(["running sneakers"])[0]
+
+        positions, scores = index.search(query, 2)
+        assert set(positions.tolist()) == {0, 3}, positions
+        assert scores[0] >= scores[1]
+
+        positions, _ = index.search(query, 2, excluded=({3},))
+        assert positions[0] == 0 and 3 not in positions.tolist()
+
+    with_video_catalog(VIDEOS, test)
+
+
+def test_rows_persist_and_uploads_are_appended():
+    def test():
+        index = embedding_index.get_embedding_index("video")
+        assert index.n_rows == len(VIDEOS)
+        before = index.vectors(range(len(VIDEOS)))
+
+        catalog_index.add_to_catalog_index("video", {
+            "video_id": "v4", "caption": "cast iron skillet", "bucket_name": ["kitchen"], "bucket_num": ["05"]
+        })
+        assert embedding_index.get_embedding_index("video").n_rows == len(VIDEOS) + 1
+
+        # a new process maps the stored rows by id and encodes nothing
+        embedding_index.reset_embedding_indexes()
+        reloaded = embedding_index.get_embedding_index("video")
+        assert reloaded.n_rows == len(VIDEOS) + 1
+        assert np.array_equal(reloaded.vectors(range(len(VIDEOS))), before)
+        assert len(db_utils.download_embedding_ids(reloaded.name, reloaded.dim)) == len(VIDEOS) + 1
+
+    with_video_catalog(VIDEOS, test)
+
+
+def test_inverted_file_matches_full_scan():
+    rng = np.random.default_rng(0)
+    # 40 tight topics of 100 videos each
+    vocab = [f"w{i}" for i in range(2000)]
+    topics = [rng.choice(len(vocab), 8, replace=False) for _ in range(40)]
+    records = [
+        {"video_id": f"v{i}", "caption": " ".join(vocab[w] for w in rng.choice(topics[i % 40], 6)), "bucket_num": ["13"]}
+        for i in range(4000)
+    ]
+
+    original = (embedding_index.EXACT_SEARCH_MAX_BYTES, embedding_index.IVF_LISTS, embedding_index.IVF_PROBE_LISTS)
+    # anything above 1000 text rows probes the inverted file
+    dim = embedding_index.load_text_encoder().dim
+    embedding_index.EXACT_SEARCH_MAX_BYTES, embedding_index.IVF_LISTS, embedding_index.IVF_PROBE_LISTS = 1000 * dim * 4, 32, 4
+
+    def test():
+        index = embedding_index.get_embedding_index("video")
+        hits = 0
+        for topic in range(40):
+            query = embedding_index.encode_texts([" ".join(vocab[w] for w in topics[topic])])[0]
+            approx, _ = index.search(query, 1)
+            exact, _ = index.search(query, 1, exact=True)
+            hits += int(approx[0] % 40 == exact[0] % 40 == topic)
+        assert hits >= 36, hits
+
+    try:
+        with_video_catalog(records, test)
+    finally:
+        embedding_index.EXACT_SEARCH_MAX_BYTES, embedding_index.IVF_LISTS, embedding_index.IVF_PROBE_LISTS = original
+
+
+def test_visual_rows_are_only_added_by_uploads():
+    def test():
+        index = embedding_index.get_embedding_index("video", "visual")
+        assert index.n_rows == 0 and not index.has_vectors([0]).any()
+
+        dim = embedding_index.VISUAL_EMBEDDING_DIM
+        frames = np.eye(dim, dtype=np.float32)[:3]
+        for video_id, vector in zip(("v0", "v1", "v2"), frames):
+            embedding_index.add_visual_embedding("video", video_id, 2.0 * vector)
+        # a re-upload replaces the row
+        embedding_index.add_visual_embedding("video", "v2", frames[0] + frames[2])
+
+        assert index.has_vectors(range(4)).tolist() == [True, True, True, False]
+        (first, first_scores), (second, _) = index.search_many(frames[[0, 1]], 2)
+        assert first.tolist() == [0, 2] and np.isclose(first_scores[0], 1.0), (first, first_scores)
+        assert second[0] == 1 and 2 not in second.tolist()
+
+        embedding_index.reset_embedding_indexes()
+        assert embedding_index.get_embedding_index("video", "visual").has_vectors(range(4)).tolist() == [True, True, True, False]
+
+    with_video_catalog(VIDEOS, test)
+
+
+def test_content_profile_kept_up_to_date():
+    def interaction(video, timestamp, watch_time_ms=20000, skipped=False):
+        return {"user_id": "u", "video_id": f"v{video}", "watch_time_ms": watch_time_ms, "skipped_quickly": skipped,
+                "watched_50_pct": not skipped, "interaction_timestamp": timestamp}
+
+    def test():
+        videos = catalog_index.get_catalog_index("video")
+        history = [interaction(0, "2026-01-01T10:00:00"), interaction(1, "2026-01-02T10:00:00", 3000, True)]
+        arriving = [
+            interaction(3, "2026-01-09T10:00:00"),
+            interaction(2, None, 5000),
+            interaction(1, "2026-01-03T10:00:00"),  # out of order
+            interaction(3, "2026-01-10T10:00:00", 60000),
+        ]
+        state = UserState("u", encode_interactions(pd.DataFrame(history), videos.id_index()), videos.n_items)
+        # no profile before the index is loaded (the app loads it at startup)
+        assert state.content_profile() is None
+        embedding_index.get_embedding_index("video")
+        assert state.content_profile() is not None
+        for row in arriving:
+            state.append(row)
+
+        full = UserState("u", encode_interactions(pd.DataFrame(history + arriving), videos.id_index()), videos.n_items)
+        now_s = pd.Timestamp("2026-01-20T00:00:00").value / 1e9
+        assert np.allclose(state.content_profile(now_s), full.content_profile(now_s), atol=1e-6)
+        # mostly running videos, closest to the running ones
+        profile = full.content_profile(now_s)
+        scores = embedding_index.get_embedding_index("video").vectors(range(len(VIDEOS))) @ profile
+        assert np.argmax(scores) in (0, 3), scores
+
+    with_video_catalog(VIDEOS, test)
+
+
+def test_requests_leave_loading_to_the_background():
+    def test():
+        assert embedding_index.peek_embedding_index("video") is None
+        embedding_index._builds[("video", "text")].result()
+        index = embedding_index.peek_embedding_index("video")
+        assert index is not None and index.n_rows == len(VIDEOS)
+
+        # an upload is synced in the background as well, until then it has no embedding
+        catalog_index.add_to_catalog_index("video", {
+            "video_id": "v4", "caption": "cast iron skillet", "bucket_name": ["kitchen"], "bucket_num": ["05"]
+        })
+        assert embedding_index.peek_embedding_index("video") is index
+        embedding_index._builds[("video", "text")].result()
+        assert index.has_vectors([len(VIDEOS)]).tolist() == [True] and not index.needs_sync()
+
+    with_video_catalog(VIDEOS, test)
+
+
+def run_all_tests():
+    print("\n" + "=" * 70)
+    print("TEST: content embedding index")
+    print("=" * 70)
+    for test in (
+        test_matching_text_ranks_first,
+        test_rows_persist_and_uploads_are_appended,
+        test_inverted_file_matches_full_scan,
+        test_visual_rows_are_only_added_by_uploads,
+        test_content_profile_kept_up_to_date,
+        test_requests_leave_loading_to_the_background,
+    ):
+        test()
+        print(f"✅ {test.__name__}")
+    print("✅ ALL TESTS PASSED")
+
+
+if __name__ == "__main__":
+    run_all_tests()
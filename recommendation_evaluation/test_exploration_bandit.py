@@ -0,0 +1,226 @@
+"""
+Checks for the Thompson sampling exploration policy, and an offline replay comparing it with the fixed split.
+
+- the posterior built from a whole log equals the one updated interaction by interaction
+- a fresh user explores more than one whose known categories have consistent outcomes, a user who has seen every
+  category still explores
+- replay: the interaction log is streamed in time order, before every logged interaction each policy says which share
+  of a page it would give the interaction's category. Inverse propensity weighting against the logging policy's
+  category shares estimates the halfway-watch rate each policy would have had.
+
+to run: python recommendation_evaluation/test_exploration_bandit.py            (synthetic log, logged uniformly)
+        python recommendation_evaluation/test_exploration_bandit.py --real-log (user interaction parquet)
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Add parent directory to path so we can import backend module
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.src.product_recommendation.bandit import BucketBandit, interaction_outcomes
+from backend.src.product_recommendation.personalized_recommendation import PROFILE_SATURATION_POINT
+
+N_BUCKETS = 14
+CATALOG_BUCKETS = np.arange(1, N_BUCKETS)
+
+
+def bucket_csr(video_buckets):
+    """ bucket_ptr / bucket_ids of videos with one bucket each"""
+    return np.arange(len(video_buckets) + 1), np.asarray(video_buckets, dtype=np.int64)
+
+
+def test_log_matches_updates():
+    rng = np.random.default_rng(0)
+    bucket_ptr, bucket_ids = bucket_csr(rng.integers(1, N_BUCKETS, size=50))
+    n = 300
+    log = {
+        "video_idx": rng.integers(0, 50, size=n),
+        "skipped_quickly": rng.random(n) < 0.3,
+        "watched_50_pct": rng.random(n) < 0.5,
+        "interaction_epoch_s": rng.permutation(n).astype(np.float64),
+    }
+    batch = BucketBandit.from_interactions(**log, bucket_ptr=bucket_ptr, bucket_ids=bucket_ids)
+
+    incremental = BucketBandit()
+    reward = interaction_outcomes(log["skipped_quickly"], log["watched_50_pct"])
+    for i in np.argsort(log["interaction_epoch_s"]):
+        pos = log["video_idx"][i]
+        incremental.update(bucket_ids[bucket_ptr[pos]:bucket_ptr[pos + 1]], bool(reward[i]))
+
+    for a, b in zip(batch._posterior, incremental._posterior):
+        assert np.allclose(a, b), (a, b)
+
+
+def test_budget_shrinks_with_consistent_outcomes():
+    rng = np.random.default_rng(1)
+    fresh = BucketBandit()
+    fresh.update([3], True)
+
+    settled = BucketBandit()
+    for bucket in (1, 2, 3):
+        settled.update([bucket], True)
+        for _ in range(15):
+            settled.update([bucket], True)
+    # and exploring went badly twice
+    settled.update([7], False)
+    settled.update([8], False)
+
+    fresh_budget = np.mean([len(fresh.explore_slots(10, CATALOG_BUCKETS, rng)) for _ in range(200)])
+    settled_slots = [settled.explore_slots(10, CATALOG_BUCKETS, rng) for _ in range(200)]
+    settled_budget = np.mean([len(s) for s in settled_slots])
+    assert fresh_budget > 3 * settled_budget > 0, (fresh_budget, settled_budget)
+
+
+def test_long_tenured_user_keeps_exploring():
+    rng = np.random.default_rng(2)
+    tenured = BucketBandit()
+    # every category seen a few times with mixed outcomes
+    for bucket in CATALOG_BUCKETS:
+        for reward in (bucket % 3 != 0, True, False, False):
+            tenured.update([bucket], reward)
+
+    budgets = []
+    for _ in range(2):
+        # two categories keep being liked
+        for _ in range(10):
+            tenured.update([1], True)
+            tenured.update([2], True)
+        slots = [tenured.explore_slots(10, CATALOG_BUCKETS, rng) for _ in range(200)]
+        budgets.append(np.mean([len(s) for s in slots]))
+        if len(budgets) == 1:
+            assert len(np.unique(np.concatenate(slots))) > len(CATALOG_BUCKETS) // 2
+
+    # shrinks with the evidence, every category seen does not stop it
+    assert budgets[0] > budgets[1] > 0, budgets
+
+
+def _page_shares(policy, bandit, preference, rng, page_size=10, draws=50):
+    """ Expected share of a page per bucket under the policy, given the user's state"""
+    shares = np.zeros(N_BUCKETS)
+    total = preference.sum()
+    preferred = preference / total if total > 0 else np.zeros(N_BUCKETS)
+    uniform = np.zeros(N_BUCKETS)
+    uniform[CATALOG_BUCKETS] = 1.0 / len(CATALOG_BUCKETS)
+    if total == 0:
+        return uniform
+
+    if policy == "fixed":
+        ratio = 0.7 * min(1.0, np.count_nonzero(preference) / PROFILE_SATURATION_POINT)
+        return ratio * preferred + (1 - ratio) * uniform
+
+    for _ in range(draws):
+        explore = bandit.explore_slots(page_size, CATALOG_BUCKETS, rng)
+        shares += np.bincount(explore, minlength=N_BUCKETS)[:N_BUCKETS] / page_size
+        shares += (1 - len(explore) / page_size) * preferred
+    return shares / draws
+
+
+def replay(user_ids, buckets, rewards, logging_shares, policies=("fixed", "thompson"), seed=0) -> dict:
+    """
+    Streams the log in the given (time) order. Per event and policy: weight = policy share of the event's bucket /
+    logging share, the self-normalized weighted reward estimates the policy's halfway-watch rate.
+
+    :param logging_shares: bucket shares of the pages the log was collected with
+    """
+    rng = np.random.default_rng(seed)
+    bandits, preferences = {}, {}
+    totals = {policy: {"weighted_reward": 0.0, "weight": 0.0, "explore_share": 0.0} for policy in policies}
+
+    for user_id, bucket, reward in zip(user_ids, buckets, rewards):
+        bandit = bandits.setdefault(user_id, BucketBandit())
+        preference = preferences.setdefault(user_id, np.zeros(N_BUCKETS))
+        for policy in policies:
+            shares = _page_shares(policy, bandit, preference, rng)
+            weight = shares[bucket] / logging_shares[bucket]
+            totals[policy]["weighted_reward"] += weight * reward
+            totals[policy]["weight"] += weight
+            totals[policy]["explore_share"] += shares[preference == 0].sum()
+
+        bandit.update([bucket], bool(reward))
+        # long-term preference like the scoring core: skips count a tenth, halfway watches 1.5x
+        preference[bucket] += 1.5 if reward else 0.1
+
+    n_events = len(buckets)
+    return {
+        policy: {
+            "estimated_halfway_rate": t["weighted_reward"] / max(t["weight"], 1e-12),
+            "mean_share_of_unseen_categories": t["explore_share"] / max(n_events, 1),
+        }
+        for policy, t in totals.items()
+    }
+
+
+def synthetic_log(n_users=200, events_per_user=60, seed=0):
+    """ Users who like 2-3 categories, pages logged by a uniform random policy (known propensities)"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for user in range(n_users):
+        like = np.full(N_BUCKETS, 0.1)
+        like[rng.choice(CATALOG_BUCKETS, size=rng.integers(2, 4), replace=False)] = 0.8
+        for t in range(events_per_user):
+            bucket = int(rng.choice(CATALOG_BUCKETS))
+            rows.append((t, f"user-{user}", bucket, rng.random() < like[bucket]))
+    rows.sort()
+    _, user_ids, buckets, rewards = zip(*rows)
+    uniform = np.zeros(N_BUCKETS)
+    uniform[CATALOG_BUCKETS] = 1.0 / len(CATALOG_BUCKETS)
+    return list(user_ids), np.array(buckets), np.array(rewards), uniform
+
+
+def real_log():
+    """ The user interaction parquet table, primary category per video, empirical category shares as logging policy"""
+    from backend.src.database.db_utils import download_user_interactions
+    from backend.src.product_recommendation.catalog_index import get_catalog_index
+    from backend.src.product_recommendation.scoring import encode_interactions
+
+    df = download_user_interactions()
+    videos = get_catalog_index("video")
+    coded = encode_interactions(df, videos.id_index())
+    keep = coded["video_idx"] >= 0
+    order = np.argsort(np.nan_to_num(coded["interaction_epoch_s"][keep], nan=-np.inf), kind="stable")
+    buckets = np.minimum(videos.primary_buckets(coded["video_idx"][keep]), N_BUCKETS - 1)[order]
+    rewards = interaction_outcomes(coded["skipped_quickly"], coded["watched_50_pct"])[keep][order]
+    user_ids = df["user_id"].to_numpy(dtype=object)[keep][order]
+    logging_shares = np.bincount(buckets[buckets >= 0], minlength=N_BUCKETS) / max(np.count_nonzero(buckets >= 0), 1)
+    valid = buckets >= 0
+    return list(user_ids[valid]), buckets[valid], rewards[valid], np.maximum(logging_shares, 1e-6)
+
+
+def test_replay_prefers_thompson_on_synthetic_log():
+    results = replay(*synthetic_log(n_users=60, events_per_user=40))
+    assert results["thompson"]["estimated_halfway_rate"] > results["fixed"]["estimated_halfway_rate"], results
+
+
+def run_all_tests():
+    print("\n" + "=" * 70)
+    print("TEST: exploration bandit")
+    print("=" * 70)
+    for test in (
+        test_log_matches_updates,
+        test_budget_shrinks_with_consistent_outcomes,
+        test_long_tenured_user_keeps_exploring,
+        test_replay_prefers_thompson_on_synthetic_log,
+    ):
+        test()
+        print(f"✅ {test.__name__}")
+    print("✅ ALL TESTS PASSED")
+
+
+if __name__ == "__main__":
+    if "--real-log" in sys.argv:
+        results = replay(*real_log())
+        title = "user interaction parquet"
+    else:
+        run_all_tests()
+        results = replay(*synthetic_log())
+        title = "synthetic log, uniform logging policy"
+
+    print(f"\nReplay ({title}):")
+    print(f"{'policy':>10} | {'est. halfway rate':>17} | {'share on unseen categories':>26}")
+    for policy, r in results.items():
+        print(f"{policy:>10} | {r['estimated_halfway_rate']:>17.3f} | {r['mean_share_of_unseen_categories']:>26.3f}")
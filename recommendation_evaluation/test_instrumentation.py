@@ -0,0 +1,170 @@
+"""
+Checks for the latency instrumentation.
+
+- spans land in cumulative Prometheus histograms (buckets, +Inf, sum and count agree)
+- disabled instrumentation records nothing and costs about a plain function call
+- a sampled request logs its spans as one JSON line, including spans from worker threads running in a copied context
+- a recommendation on a synthetic catalog records the recommender and storage steps
+
+to run: python recommendation_evaluation/test_instrumentation.py   (or via pytest)
+"""
+
+import contextvars
+import json
+import logging
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Add parent directory to path so we can import backend module
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.src import instrumentation
+from backend.src.database import db_utils
+from backend.src.instrumentation import instrumented, span, start_request, finish_request, render_prometheus, \
+    get_span_stats, reset_metrics
+from benchmarks.run_suite import reset_recommendation_state
+from benchmarks.synthetic_data import generate, use_data_dir
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_prometheus_histograms():
+    reset_metrics()
+
+    @instrumented("test.sleep")
+    def sleep(seconds):
+        time.sleep(seconds)
+
+    sleep(0.0)
+    sleep(0.003)
+    with span("test.block"):
+        pass
+
+    lines = render_prometheus().splitlines()
+    assert "# TYPE viscart_span_duration_seconds histogram" in lines
+    buckets = [line for line in lines if line.startswith('viscart_span_duration_seconds_bucket{span="test.sleep"')]
+    counts = [int(line.rsplit(" ", 1)[1]) for line in buckets]
+    assert len(buckets) == len(instrumentation.LATENCY_BUCKETS_S) + 1
+    assert counts == sorted(counts) and buckets[-1].startswith('viscart_span_duration_seconds_bucket{span="test.sleep",le="+Inf"}')
+    assert counts[-1] == 2 and counts[0] == 1  # the 0s sleep is under 0.5ms, the 3ms one is not
+    assert 'viscart_span_duration_seconds_count{span="test.sleep"} 2' in lines
+    assert get_span_stats()["test.block"]["calls"] == 1
+    assert get_span_stats()["test.sleep"]["mean_ms"] >= 1.5
+    reset_metrics()
+
+
+def test_disabled_spans_cost_near_zero():
+    reset_metrics()
+
+    def plain():
+        return 1
+
+    wrapped = instrumented("test.disabled")(plain)
+    n_calls = 200_000
+    instrumentation.METRICS_ENABLED = False
+    try:
+        start = time.perf_counter()
+        for _ in range(n_calls):
+            plain()
+        plain_s = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(n_calls):
+            wrapped()
+            with span("test.disabled"):
+                pass
+        disabled_s = time.perf_counter() - start
+    finally:
+        instrumentation.METRICS_ENABLED = True
+
+    assert get_span_stats() == {}
+    # a wrapper call, a span() call and an empty with block, well under a microsecond each on any machine we run on
+    overhead_us = (disabled_s - plain_s) / n_calls * 1e6
+    assert overhead_us < 2.0, overhead_us
+
+
+def test_sampled_request_log():
+    reset_metrics()
+    records = _Records()
+    instrumentation.request_logger.addHandler(records)
+    sample_rate = instrumentation.REQUEST_LOG_SAMPLE_RATE
+    instrumentation.REQUEST_LOG_SAMPLE_RATE = 1.0
+    try:
+        sampled = start_request()
+        with span("test.outer"):
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                pool.submit(contextvars.copy_context().run, instrumented("test.worker")(lambda: None)).result()
+        finish_request("GET", "/feed/videos", 200, 0.012, sampled)
+
+        instrumentation.REQUEST_LOG_SAMPLE_RATE = 0.0
+        assert start_request() is None
+        with span("test.unsampled"):
+            pass
+        finish_request("GET", "/feed/videos", 200, 0.010, None)
+    finally:
+        instrumentation.REQUEST_LOG_SAMPLE_RATE = sample_rate
+        instrumentation.request_logger.removeHandler(records)
+
+    assert len(records.messages) == 1
+    logged = json.loads(records.messages[0])
+    assert logged["route"] == "/feed/videos" and logged["status"] == 200 and logged["ms"] == 12.0
+    assert [s["span"] for s in logged["spans"]] == ["test.worker", "test.outer"]
+    assert 'viscart_request_duration_seconds_count{method="GET",route="/feed/videos",status="200"} 2' in render_prometheus()
+    reset_metrics()
+
+
+def test_recommendation_steps_recorded():
+    from backend.src.product_recommendation.personalized_recommendation import video_recommendation
+
+    data_dirs = {attr: getattr(db_utils, attr) for attr in (
+        "VIDEO_DIR", "PRODUCT_DIR", "VIDEO_PARQUET_DIR", "PRODUCT_PARQUET_DIR", "USER_INTERACTION_PARQUET_DIR", "EMBEDDING_DIR",
+    )}
+    try:
+        with tempfile.TemporaryDirectory() as data_dir:
+            generate(data_dir, 300, 50, 20, 2000, seed=0, verbose=False)
+            use_data_dir(data_dir)
+            reset_recommendation_state()
+            reset_metrics()
+            user_id = db_utils.download_user_interactions()["user_id"].iloc[0]
+            assert len(video_recommendation(10, user_id)) == 10
+            stats = get_span_stats()
+            reset_recommendation_state()
+    finally:
+        for attr, path in data_dirs.items():
+            setattr(db_utils, attr, path)
+
+    for name in ("recommendation.video", "recommendation.user_state", "recommendation.bucket_preferences",
+                 "storage.download_user_interactions", "storage.download_all_videos_metadata"):
+        assert stats.get(name, {}).get("calls", 0) >= 1, (name, stats)
+    # the whole recommendation includes its steps
+    assert stats["recommendation.video"]["mean_ms"] >= stats["recommendation.user_state"]["mean_ms"]
+    reset_metrics()
+
+
+def run_all_tests():
+    print("\n" + "=" * 70)
+    print("TEST: latency instrumentation")
+    print("=" * 70)
+    for test in (
+        test_prometheus_histograms,
+        test_disabled_spans_cost_near_zero,
+        test_sampled_request_log,
+        test_recommendation_steps_recorded,
+    ):
+        test()
+        print(f"✅ {test.__name__}")
+    print("✅ ALL TESTS PASSED")
+
+
+if __name__ == "__main__":
+    run_all_tests()
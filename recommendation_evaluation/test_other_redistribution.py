@@ -0,0 +1,136 @@
+"""
+Regression test: closed form "other" redistribution vs the previous row replication implementation.
+
+bucket_preference_vector applies the "other" (bucket 13) redistribution to the aggregated bucket vector.
+This checks it against the pandas pipeline the recommenders ran before (join -> explode -> copy "other" rows once
+per category -> engagement -> recency -> bincount) on randomized interaction logs.
+
+to run: python recommendation_evaluation/test_other_redistribution.py   (or via pytest)
+"""
+
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Add parent directory to path so we can import backend module
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.src.product_recommendation.scoring import (
+    encode_video_buckets,
+    encode_interactions,
+    other_categories_from,
+    bucket_preference_vector,
+)
+from benchmarks.bench_scoring import pandas_bucket_preference_vector
+
+N_RANDOM_LOGS = 25
+
+
+def make_random_log(seed: int):
+    """
+    Random catalog + interaction log. Each log picks its own share of "other" videos (including none and all),
+    catalog categories, skip / half watch rates and timestamp spread.
+    """
+    rng = np.random.default_rng(seed)
+    now = datetime.now()
+
+    n_videos = int(rng.integers(5, 60))
+    other_share = rng.choice([0.0, 0.2, 0.5, 1.0])
+    available = rng.choice(np.arange(1, 13), size=int(rng.integers(1, 13)), replace=False)
+
+    bucket_num = []
+    for _ in range(n_videos):
+        k = int(rng.integers(1, min(3, len(available)) + 1))
+        buckets = [int(b) for b in rng.choice(available, size=k, replace=False)]
+        if rng.random() < other_share:
+            buckets = buckets[: k - 1] + [13]
+        bucket_num.append([f"{b:02d}" for b in buckets])
+    videos_df = pd.DataFrame({"video_id": [f"vid-{i}" for i in range(n_videos)], "bucket_num": bucket_num})
+
+    n_interactions = int(rng.integers(1, 150))
+    days_ago = rng.integers(0, 45, size=n_interactions)
+    interactions_df = pd.DataFrame({
+        "video_id": videos_df["video_id"].to_numpy()[rng.integers(0, n_videos, size=n_interactions)],
+        "watch_time_ms": rng.integers(0, 120000, size=n_interactions),
+        "skipped_quickly": rng.random(n_interactions) < rng.random(),
+        "watched_50_pct": rng.random(n_interactions) < rng.random(),
+        "interaction_timestamp": [
+            (now - timedelta(days=int(d), seconds=int(s))).isoformat()
+            for d, s in zip(days_ago, rng.integers(0, 86400, size=n_interactions))
+        ],
+    })
+    return videos_df, interactions_df, now
+
+
+def compare_on_log(seed: int):
+    videos_df, interactions_df, now = make_random_log(seed)
+
+    video_index, bucket_ptr, bucket_ids = encode_video_buckets(videos_df)
+    other_categories = other_categories_from(bucket_ids)
+
+    expected = pandas_bucket_preference_vector(interactions_df, videos_df, other_categories, now)
+    actual = bucket_preference_vector(
+        **encode_interactions(interactions_df, video_index),
+        bucket_ptr=bucket_ptr,
+        bucket_ids=bucket_ids,
+        other_categories=other_categories,
+        n_buckets=int(bucket_ids.max()) + 1,
+        now_s=pd.Timestamp(now).value / 1e9,
+    )
+    return expected, actual
+
+
+def test_closed_form_matches_row_replication():
+    for seed in range(N_RANDOM_LOGS):
+        expected, actual = compare_on_log(seed)
+        assert actual.shape == expected.shape, f"seed {seed}: shape {actual.shape} != {expected.shape}"
+        assert np.allclose(actual, expected, rtol=1e-9, atol=1e-6), f"seed {seed}: {actual} != {expected}"
+
+
+def test_other_only_log_keeps_retention_share():
+    # every watched video is "other": 10% stays on bucket 13 and the rest is spread equally
+    videos_df = pd.DataFrame({"video_id": ["a", "b"], "bucket_num": [["13"], ["13"]]})
+    interactions_df = pd.DataFrame({
+        "video_id": ["a", "b"],
+        "watch_time_ms": [1000, 3000],
+        "skipped_quickly": [False, False],
+        "watched_50_pct": [False, False],
+    })
+    video_index, bucket_ptr, bucket_ids = encode_video_buckets(videos_df)
+    weights = bucket_preference_vector(
+        **encode_interactions(interactions_df, video_index),
+        bucket_ptr=bucket_ptr,
+        bucket_ids=bucket_ids,
+        other_categories=np.array([2, 5]),
+        n_buckets=14,
+    )
+    assert np.isclose(weights[13], 400.0)
+    assert np.isclose(weights[2], 1800.0) and np.isclose(weights[5], 1800.0)
+    assert np.isclose(weights.sum(), 4000.0)
+
+
+def run_all_tests():
+    print("\n" + "=" * 70)
+    print("TEST: closed form 'other' redistribution vs row replication")
+    print("=" * 70)
+
+    max_abs_diff = 0.0
+    for seed in range(N_RANDOM_LOGS):
+        expected, actual = compare_on_log(seed)
+        ok = actual.shape == expected.shape and np.allclose(actual, expected, rtol=1e-9, atol=1e-6)
+        if actual.shape == expected.shape:
+            max_abs_diff = max(max_abs_diff, float(np.max(np.abs(actual - expected), initial=0.0)))
+        print(f"{'✅' if ok else '❌'} seed {seed:2d}: {len(expected)} buckets, total weight {expected.sum():.1f}")
+
+    test_other_only_log_keeps_retention_share()
+    print(f"\n📊 Max absolute difference across {N_RANDOM_LOGS} logs: {max_abs_diff:.3e}")
+    test_closed_form_matches_row_replication()
+    print("✅ ALL TESTS PASSED")
+
+
+if __name__ == "__main__":
+    run_all_tests()
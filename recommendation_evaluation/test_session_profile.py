@@ -0,0 +1,151 @@
+"""
+Checks for the short-term session profile blended into the long-term bucket preference.
+
+- the profile kept up to date interaction by interaction equals the one computed from the whole log, and halves
+  every SESSION_HALF_LIFE_S
+- the last minute of swipes moves the blended shares towards its buckets, an old session leaves them as they were
+- an interaction recorded while the user's state loads is applied once, whether or not the load read its row
+
+to run: python recommendation_evaluation/test_session_profile.py   (or via pytest)
+"""
+
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Add parent directory to path so we can import backend module
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.src.product_recommendation import catalog_index, user_state
+from backend.src.product_recommendation.catalog_index import CatalogIndex
+from backend.src.product_recommendation.scoring import (
+    encode_interactions,
+    bucket_preference_vector,
+    blend_session_profile,
+    other_categories_from,
+    SESSION_HALF_LIFE_S,
+)
+from backend.src.product_recommendation.user_state import UserState, get_user_state, record_interaction, reset_user_states
+
+# video i is in bucket i % 4 + 1, every tenth one is also "other"
+VIDEOS = [{"video_id": f"v{i}", "bucket_num": [f"{i % 4 + 1:02d}"] + (["13"] if i % 10 == 0 else [])} for i in range(40)]
+NOW = datetime(2026, 1, 5, 12, 0, 0)
+
+
+def interaction(video: int, seconds_ago: float, watch_time_ms: int = 30000, skipped: bool = False) -> dict:
+    return {
+        "user_id": "u",
+        "video_id": f"v{video}",
+        "watch_time_ms": watch_time_ms,
+        "skipped_quickly": skipped,
+        "watched_50_pct": not skipped,
+        "interaction_timestamp": (NOW - timedelta(seconds=seconds_ago)).isoformat(),
+    }
+
+
+def with_video_catalog(test):
+    catalog_index._catalog_indexes["video"] = CatalogIndex.from_records([dict(r) for r in VIDEOS], "video_id")
+    try:
+        test(catalog_index._catalog_indexes["video"])
+    finally:
+        catalog_index._catalog_indexes.pop("video", None)
+
+
+def now_s(seconds_later: float = 0.0) -> float:
+    return pd.Timestamp(NOW + timedelta(seconds=seconds_later)).value / 1e9
+
+
+def test_incremental_profile_matches_log():
+    def test(videos):
+        rng = np.random.default_rng(0)
+        log = [interaction(int(v), float(s), int(w), bool(k)) for v, s, w, k in zip(
+            rng.integers(0, 40, 60), np.sort(rng.uniform(0, 3600, 60))[::-1], rng.integers(1000, 60000, 60), rng.random(60) < 0.3
+        )]
+        # a day old history plus 40 rows arriving one by one, one of them out of order
+        history = [interaction(1, 86400), interaction(2, 90000)]
+        state = UserState("u", encode_interactions(pd.DataFrame(history + log[:20]), videos.id_index()), videos.n_items)
+        for row in log[20:30] + log[31:] + [log[30]]:
+            state.append(row)
+
+        full = UserState("u", encode_interactions(pd.DataFrame(history + log), videos.id_index()), videos.n_items)
+        assert np.allclose(state.session_profile(now_s()), full.session_profile(now_s()))
+
+        halved = state.session_profile(now_s(SESSION_HALF_LIFE_S))
+        assert np.allclose(halved, state.session_profile(now_s()) / 2)
+
+    with_video_catalog(test)
+
+
+def test_last_minute_moves_the_blend():
+    def test(videos):
+        # earlier today bucket 1 (same day: no long-term recency difference), then the last minute in bucket 3
+        history = [interaction(4 * (i % 10), 3600 * (2 + i % 8)) for i in range(20)]
+        recent = [interaction(2, 50), interaction(6, 30), interaction(10, 10)]
+        state = UserState("u", encode_interactions(pd.DataFrame(history + recent), videos.id_index()), videos.n_items)
+
+        other_categories = other_categories_from(videos.buckets())
+        long_term = bucket_preference_vector(
+            **state.interactions, bucket_ptr=videos.bucket_ptr, bucket_ids=videos.bucket_ids,
+            other_categories=other_categories, n_buckets=14, now_s=now_s(),
+        )
+        blended = blend_session_profile(long_term, state.session_profile(now_s()), other_categories)
+        assert np.isclose(blended.sum(), 1.0)
+        assert blended[3] > 2 * long_term[3] / long_term.sum(), (blended, long_term / long_term.sum())
+
+        # an hour later the session has faded out
+        faded = blend_session_profile(long_term, state.session_profile(now_s(3600)), other_categories)
+        assert np.allclose(faded, long_term / long_term.sum(), atol=1e-6)
+
+    with_video_catalog(test)
+
+
+def test_interactions_during_load():
+    def test(videos):
+        logged = [interaction(1, 600), interaction(2, 300)]
+
+        def download_during_requests(user_id):
+            # hooks of requests running during the load: the last logged row and a newer one not in the read
+            record_interaction(logged[1])
+            record_interaction(interaction(3, 60))
+            return pd.DataFrame(logged)
+
+        original = user_state.download_user_interactions
+        user_state.download_user_interactions = download_during_requests
+        reset_user_states()
+        try:
+            state = get_user_state("u")
+        finally:
+            user_state.download_user_interactions = original
+        try:
+            assert state.n_interactions == 3
+            assert state.watched.contains(np.array([1, 2, 3])).all()
+            assert not user_state._loading_users
+            # once cached the state takes interactions directly
+            record_interaction(interaction(4, 0))
+            assert get_user_state("u") is state and state.n_interactions == 4
+        finally:
+            reset_user_states()
+
+    with_video_catalog(test)
+
+
+def run_all_tests():
+    print("\n" + "=" * 70)
+    print("TEST: session profile")
+    print("=" * 70)
+    for test in (
+        test_incremental_profile_matches_log,
+        test_last_minute_moves_the_blend,
+        test_interactions_during_load,
+    ):
+        test()
+        print(f"✅ {test.__name__}")
+    print("✅ ALL TESTS PASSED")
+
+
+if __name__ == "__main__":
+    run_all_tests()
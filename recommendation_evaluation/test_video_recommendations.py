@@ -24,6 +24,9 @@ from backend.src.product_recommendation.personalized_recommendation import (
     video_recommendation,
     product_recommendation,
 )
+from backend.src.product_recommendation.user_state import reset_user_states
+from backend.src.product_recommendation import personalized_recommendation
+from backend.src.product_recommendation.diversity import page_diversity
 
 # Configuration (relative to project root)
 TEST_DIR = project_root / "data" / "test_interactions"
@@ -42,11 +45,12 @@ def test_actual_user_history_videos(original_download_func):
     print("Scenario: Generating recommendations using your REAL app usage data. (User interaction parquet)\n")
     
     from backend.src.database import db_utils
-    import backend.src.product_recommendation.personalized_recommendation as rec_module
+    import backend.src.product_recommendation.user_state as user_state_module
     
     # 1. Restore the original download function to hit the real data
     db_utils.download_user_interactions = original_download_func
-    rec_module.download_user_interactions = original_download_func
+    user_state_module.download_user_interactions = original_download_func
+    reset_user_states()
     
     try:
         # 2. Get recommendations
@@ -208,6 +212,8 @@ def save_mock_interaction(interaction: dict):
     file_key = f"{interaction['video_id']}-{int(datetime.now().timestamp() * 1000000)}"
     out_path = os.path.join(TEST_DIR, f"part-{file_key}.parquet")
     df.to_parquet(out_path, engine="pyarrow", index=False)
+    # per-user state caches the interaction log, drop it so the next recommendation reads the new row
+    reset_user_states()
     
     return out_path
 
@@ -217,30 +223,32 @@ def setup_test_directory():
     if os.path.exists(TEST_DIR):
         shutil.rmtree(TEST_DIR)
     os.makedirs(TEST_DIR, exist_ok=True)
+    reset_user_states()
     print(f"✅ Created test directory: {TEST_DIR}\n")
 
 
 def monkey_patch_download_interactions():
     """Monkey-patch the download function to use test directory - must patch both modules!"""
     from backend.src.database import db_utils
-    import backend.src.product_recommendation.personalized_recommendation as rec_module
+    import backend.src.product_recommendation.user_state as user_state_module
     
     original_download = db_utils.download_user_interactions
     
-    def test_download():
+    def test_download(user_id=None):
         """Load interactions from test directory"""
         if not os.path.exists(TEST_DIR):
-            return pd.DataFrame()
+            return pd.DataFrame(columns=list(create_mock_interaction("").keys()))
         
         parquet_files = list(Path(TEST_DIR).glob("*.parquet"))
         if not parquet_files:
-            return pd.DataFrame()
+            return pd.DataFrame(columns=list(create_mock_interaction("").keys()))
         
         dfs = [pd.read_parquet(f) for f in parquet_files]
         return pd.concat(dfs, ignore_index=True)
     
     db_utils.download_user_interactions = test_download
-    rec_module.download_user_interactions = test_download
+    user_state_module.download_user_interactions = test_download
+    reset_user_states()
     return original_download
 
 
@@ -535,6 +543,41 @@ def test_scenario_5_other_category_distribution(videos_by_category: dict):
     plot_histogram(categories, f"Test 5: 'Other' Category Distribution")
 
 
+def test_scenario_6_rerank_strategies(videos_by_category: dict, n_pages: int = 20):
+    """
+    Test 6: Page Order
+    Same balanced history as Test 4, pages ordered by each re-ranking strategy
+    Expected: interleave / mmr serve fewer same category neighbours than the plain shuffle
+    """
+    print("\n" + "="*70)
+    print(f"TEST 6: Re-ranking Strategies")
+    print("="*70)
+    print(f"Scenario: User watches 4 videos in each of up to 4 categories, {n_pages} pages of 10 per strategy")
+    print(f"Expected: fewer same category neighbours and shorter runs than the plain shuffle\n")
+
+    for cat in sorted(videos_by_category.keys())[3:7]:
+        for video_id in videos_by_category[cat][:4]:
+            save_mock_interaction(create_mock_interaction(video_id=video_id, watch_time_ms=50000, watched_50_pct=True))
+
+    original_strategy = personalized_recommendation.RERANK_STRATEGY
+    try:
+        print(f"{'strategy':>10} | {'same category neighbours':>24} | {'longest run':>11}")
+        for strategy in personalized_recommendation.RERANK_STRATEGIES:
+            personalized_recommendation.RERANK_STRATEGY = strategy
+            personalized_recommendation.seed_recommendation_rng(0)
+            pages = []
+            for _ in range(n_pages):
+                recs = video_recommendation(n_recommended=10)
+                categories = [int(rec["bucket_num"][0] if isinstance(rec["bucket_num"], list) else rec["bucket_num"])
+                              if rec.get("bucket_num") else -1 for rec in recs]
+                pages.append(page_diversity(categories))
+            same = np.mean([p["adjacent_same_bucket"] for p in pages])
+            longest = np.mean([p["longest_bucket_run"] for p in pages])
+            print(f"{strategy:>10} | {same:>24.3f} | {longest:>11.2f}")
+    finally:
+        personalized_recommendation.RERANK_STRATEGY = original_strategy
+
+
 def clear_cache():
     """Clear the cached videos data"""
     if os.path.exists(CACHE_FILE):
@@ -591,6 +634,11 @@ def run_all_tests():
         setup_test_directory()
         test_scenario_5_other_category_distribution(videos_by_category)
         
+        
+        # Test 6
+        setup_test_directory()
+        test_scenario_6_rerank_strategies(videos_by_category)
+        
         print("\n" + "="*70)
         print("✅ ALL TESTS COMPLETED")
         print("="*70)
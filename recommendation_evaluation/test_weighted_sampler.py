@@ -0,0 +1,177 @@
+"""
+Statistical checks for candidate sampling: the alias table and CatalogIndex.sample_weighted.
+
+- alias draws follow the float64 weights, including weights float32 normalization cannot represent
+- sample_weighted picks items proportionally to their bucket weight, also when most of them are excluded and
+  it has to finish with the exhaustive walk
+- a seeded RNG reproduces the same recommendations
+- records of a catalog read back from parquet (list columns arrive as numpy arrays) are JSON serializable
+
+to run: python recommendation_evaluation/test_weighted_sampler.py   (or via pytest)
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+
+# Add parent directory to path so we can import backend module
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.src.product_recommendation.sampling import AliasSampler
+from backend.src.database import db_utils
+from backend.src.product_recommendation import catalog_index
+from backend.src.product_recommendation.catalog_index import CatalogIndex, get_catalog_index
+from backend.src.product_recommendation.personalized_recommendation import video_recommendation
+from benchmarks.run_suite import reset_recommendation_state
+
+N_DRAWS = 200_000
+
+
+def make_index():
+    # bucket 1: 3 items, bucket 2: 1 item, bucket 3: 2 items, bucket 4: 500 items
+    buckets = [1, 1, 1, 2, 3, 3] + [4] * 500
+    return CatalogIndex.from_records(
+        [{"id": i, "bucket_num": [f"{b:02d}"]} for i, b in enumerate(buckets)], "id"
+    )
+
+
+def test_alias_matches_weights():
+    rng = np.random.default_rng(0)
+    weights = np.array([1e-30, 3.0, 0.0, 1e30, 2e30, 5.0])
+    counts = np.bincount(AliasSampler(weights).draw(rng, N_DRAWS), minlength=len(weights))
+    expected = weights / weights.sum() * N_DRAWS
+    assert counts[2] == 0
+    assert np.all(np.abs(counts - expected) < 5 * np.sqrt(expected) + 1), f"{counts} vs {expected}"
+
+
+def test_first_draw_proportional_to_bucket_weight():
+    rng = np.random.default_rng(1)
+    index = make_index()
+    bucket_weights = np.array([0.0, 1.0, 2.0, 3.0, 0.0])
+
+    counts = np.zeros(index.n_items)
+    for _ in range(20_000):
+        counts[index.sample_weighted(bucket_weights, 1, rng)[0]] += 1
+
+    # items of bucket 4 have weight 0, the other 6 items have their bucket's weight
+    item_weights = np.array([1, 1, 1, 2, 3, 3], dtype=np.float64)
+    expected = item_weights / item_weights.sum() * 20_000
+    assert counts[6:].sum() == 0
+    assert np.all(np.abs(counts[:6] - expected) < 5 * np.sqrt(expected)), f"{counts[:6]} vs {expected}"
+
+
+def test_heavy_exclusion_falls_back_and_stays_exact():
+    rng = np.random.default_rng(2)
+    index = make_index()
+    bucket_weights = np.array([0.0, 0.0, 0.0, 0.0, 1.0])
+    # all but 3 items of the only weighted bucket are excluded, rejection alone would rarely find them
+    allowed = {6, 200, 505}
+    excluded = set(range(6, 506)) - allowed
+
+    for _ in range(200):
+        picked = index.sample_weighted(bucket_weights, 5, rng, excluded=(excluded,))
+        assert sorted(picked) == sorted(allowed), picked
+
+
+def test_seeded_rng_is_reproducible():
+    index = make_index()
+    bucket_weights = np.array([0.0, 1.0, 2.0, 3.0, 0.5])
+    first = index.sample_weighted(bucket_weights, 20, np.random.default_rng(42))
+    second = index.sample_weighted(bucket_weights, 20, np.random.default_rng(42))
+    assert first == second and len(set(first)) == 20
+
+
+def test_records_from_parquet_are_json_safe():
+    data_dirs = {attr: getattr(db_utils, attr) for attr in ("VIDEO_PARQUET_DIR", "USER_INTERACTION_PARQUET_DIR", "EMBEDDING_DIR")}
+    try:
+        with tempfile.TemporaryDirectory() as data_dir:
+            for attr in data_dirs:
+                setattr(db_utils, attr, str(Path(data_dir) / attr.lower()))
+            for i in range(30):
+                db_utils.update_parquet_table({
+                    "video_id": f"v{i:03d}",
+                    "video_path": f"data/videos/v{i:03d}.mp4",
+                    "duration_ms": 10000,
+                    "caption": "test video",
+                    "bucket_num": ["01", "03"] if i % 2 else ["02"],
+                    "bucket_name": ["fashion", "electronics"] if i % 2 else ["beauty"],
+                    "detected_objects": ["person", "bottle"],
+                }, "video")
+            db_utils.update_parquet_table({
+                "user_id": "u1", "video_id": "v001", "watch_time_ms": 9000, "skipped_quickly": False,
+                "watched_50_pct": True, "interaction_timestamp": "2026-01-01T12:00:00",
+            }, "user")
+            reset_recommendation_state()
+
+            records = get_catalog_index("video").get_records(range(30))
+            assert records[1]["bucket_name"] == ["fashion", "electronics"]
+            assert all(isinstance(r["detected_objects"], list) for r in records)
+            jsonable_encoder(records)
+            jsonable_encoder(video_recommendation(10, "u1"))
+            reset_recommendation_state()
+    finally:
+        for attr, path in data_dirs.items():
+            setattr(db_utils, attr, path)
+        catalog_index._catalog_indexes.clear()
+
+
+def test_small_catalog_skips_watched_videos():
+    from backend.src.product_recommendation.recommendation_pool import _VideoPool, _refill_video_pool
+
+    data_dirs = {attr: getattr(db_utils, attr) for attr in ("VIDEO_PARQUET_DIR", "USER_INTERACTION_PARQUET_DIR", "EMBEDDING_DIR")}
+    try:
+        with tempfile.TemporaryDirectory() as data_dir:
+            for attr in data_dirs:
+                setattr(db_utils, attr, str(Path(data_dir) / attr.lower()))
+            db_utils.update_parquet_table_batch([{
+                "video_id": f"v{i:03d}", "video_path": f"data/videos/v{i:03d}.mp4", "duration_ms": 10000,
+                "caption": "test video", "bucket_num": [f"{i % 5 + 1:02d}"], "bucket_name": [f"bucket {i % 5}"],
+                "detected_objects": ["person"],
+            } for i in range(30)], "video")
+            db_utils.update_parquet_table_batch([{
+                "user_id": "u1", "video_id": f"v{i:03d}", "watch_time_ms": 9000, "skipped_quickly": False,
+                "watched_50_pct": True, "interaction_timestamp": "2026-01-01T12:00:00",
+            } for i in range(10)], "user")
+            reset_recommendation_state()
+            watched = {f"v{i:03d}" for i in range(10)}
+
+            # the whole catalog path: every unwatched video once, not in catalog order
+            ids = [r["video_id"] for r in video_recommendation(100, "u1")]
+            assert sorted(ids) == [f"v{i:03d}" for i in range(10, 30)]
+            assert ids != sorted(ids)
+
+            # a pool refill on a catalog smaller than VIDEO_POOL_SIZE only pools unwatched videos
+            pool = _VideoPool()
+            _refill_video_pool("u1", pool)
+            pooled = [r["video_id"] for r in pool.records]
+            assert pooled and not watched & set(pooled) and len(set(pooled)) == len(pooled)
+            reset_recommendation_state()
+    finally:
+        for attr, path in data_dirs.items():
+            setattr(db_utils, attr, path)
+        catalog_index._catalog_indexes.clear()
+
+
+def run_all_tests():
+    print("\n" + "=" * 70)
+    print("TEST: weighted candidate sampling")
+    print("=" * 70)
+    for test in (
+        test_alias_matches_weights,
+        test_first_draw_proportional_to_bucket_weight,
+        test_heavy_exclusion_falls_back_and_stays_exact,
+        test_seeded_rng_is_reproducible,
+        test_records_from_parquet_are_json_safe,
+        test_small_catalog_skips_watched_videos,
+    ):
+        test()
+        print(f"✅ {test.__name__}")
+    print("✅ ALL TESTS PASSED")
+
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,307 @@
+"""
+Offline bulk categorization for large video backfills.
+
+Runs the same 5 signal categorization as /upload/video without the API:
+1. videos are decoded (duration + base frames) in a process pool
+2. frames from a whole batch of videos go through YOLO, EasyOCR and BLIP together
+3. every text signal of the batch (description, OCR, captions, objects) goes through BART in one call
+4. every video is hardlinked (or copied) into the video storage folder as <video_id><ext>, like uploads
+5. rows are written to the video parquet table in large parts, and a checkpoint of finished
+   video ids is saved after every part so an interrupted run resumes where it stopped
+
+to run: python scripts/batch_categorization.py /path/to/video/folder --workers 8 --batch-videos 16
+"""
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cv2
+
+try:
+    from backend.src.detection.detect_modules import ocr_read_frames_batched, combine_ocr_results, \
+        zero_shot_classification_batched, caption_frames_batched, detect_objects_per_frame
+    from backend.src.detection.detect_utils import load_json, get_video_duration_ms_from_path, get_base_frames, \
+        weighted_fusion, get_top3_objects_min_conf
+    from backend.src.database.db_utils import update_parquet_table_batch, store_video_file
+except ModuleNotFoundError:
+    import sys
+
+    repo_root = Path(__file__).resolve().parents[1]
+    if str(repo_root) not in sys.path:
+        sys.path.insert(0, str(repo_root))
+    from backend.src.detection.detect_modules import ocr_read_frames_batched, combine_ocr_results, \
+        zero_shot_classification_batched, caption_frames_batched, detect_objects_per_frame
+    from backend.src.detection.detect_utils import load_json, get_video_duration_ms_from_path, get_base_frames, \
+        weighted_fusion, get_top3_objects_min_conf
+    from backend.src.database.db_utils import update_parquet_table_batch, store_video_file
+
+repo_root = Path(__file__).resolve().parents[1]
+MAPPED_LABELS = load_json(str(repo_root / "backend" / "configs" / "mapped_labels_buckets.json"))
+BUCKETS = load_json(str(repo_root / "backend" / "configs" / "buckets.json"))
+BUCKET_KEYS = list(BUCKETS["buckets"].keys())
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".mkv", ".webm", ".avi")
+DEFAULT_CHECKPOINT = "data/batch_categorization_checkpoint.json"
+
+
+########################################## Decoding (worker processes) ##########################################
+def _decode_video(video_path, num_frames, sampling_mode, max_side):
+    """ Runs in a worker process: duration probe + frame sampling, frames shrunk so they are cheap to ship back"""
+    try:
+        duration_ms = get_video_duration_ms_from_path(video_path)
+        frames = get_base_frames(video_path, num_frames, sampling_mode)
+    except Exception as e:
+        return video_path, None, [], str(e)
+
+    resized = []
+    for frame in frames:
+        h, w = frame.shape[:2]
+        scale = max_side / max(h, w)
+        if scale < 1.0:
+            frame = cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        resized.append(frame)
+
+    return video_path, duration_ms, resized, None
+
+
+def decoded_videos(video_paths, workers, window, num_frames, sampling_mode, max_side):
+    """
+    Yields decode results in input order while keeping at most `window` videos in flight,
+    so decoding runs ahead of the models without holding the whole backfill's frames in memory.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        paths = iter(video_paths)
+
+        for video_path in paths:
+            pending.append(pool.submit(_decode_video, video_path, num_frames, sampling_mode, max_side))
+            if len(pending) >= window:
+                break
+
+        while pending:
+            result = pending.popleft().result()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append(pool.submit(_decode_video, next_path, num_frames, sampling_mode, max_side))
+            yield result
+
+
+########################################## Batched inference ##########################################
+def categorize_batch(models, batch, descriptions, model_batch_size):
+    """
+    :param batch: list of (video_path, duration_ms, frames) for successfully decoded videos
+    :return: list of video metadata rows in the same schema as upload_video_service writes, video_path is still
+             the source file, run_batch replaces it with the stored copy
+    """
+    genre_clf, ocr_reader, bart_mnli, caption_model, object_detector = models
+
+    # flatten frames across videos, frame_owner[i] is the batch position of frame i
+    all_frames = []
+    frame_owner = []
+    for pos, (_, _, frames) in enumerate(batch):
+        all_frames.extend(frames)
+        frame_owner.extend([pos] * len(frames))
+
+    # SIGNAL 1: classification (VideoMAE decodes from the path itself), whole batch through the pipeline
+    classify_payloads = genre_clf([video_path for video_path, _, _ in batch], top_k=3, batch_size=model_batch_size)
+
+    # SIGNAL 5: objects, SIGNAL 2: OCR, SIGNAL 4: captions, all frames of the batch at once
+    objects_per_frame = detect_objects_per_frame(all_frames, object_detector)
+    ocr_per_frame = ocr_read_frames_batched(all_frames, ocr_reader, model_batch_size)
+    captions_per_frame = caption_frames_batched(all_frames, caption_model, model_batch_size)
+
+    per_video_ocr = [[] for _ in batch]
+    per_video_captions = [[] for _ in batch]
+    per_video_objects = [([], []) for _ in batch]
+    for i, pos in enumerate(frame_owner):
+        per_video_ocr[pos].append(ocr_per_frame[i])
+        per_video_captions[pos].append(captions_per_frame[i])
+        per_video_objects[pos][0].extend(objects_per_frame[i][0])
+        per_video_objects[pos][1].extend(objects_per_frame[i][1])
+
+    # collect every text that needs zero shot classification, then one BART call for the whole batch
+    texts = []
+    text_slots = []
+    ocr_qualities = []
+    raw_texts = []
+    for pos, (video_path, _, _) in enumerate(batch):
+        ocr_text, ocr_quality = combine_ocr_results(per_video_ocr[pos])
+        ocr_qualities.append(ocr_quality)
+        # caption_mode="best": longest caption is usually the most descriptive
+        vid_caption = max(per_video_captions[pos], key=len) if per_video_captions[pos] else ""
+        top_objects = get_top3_objects_min_conf(tuple(per_video_objects[pos]))
+        raw_texts.append((ocr_text, vid_caption, [label for label, _ in top_objects]))
+
+        texts.extend([descriptions.get(Path(video_path).stem, ""), ocr_text, vid_caption])
+        text_slots.extend([(pos, "description", None), (pos, "ocr", None), (pos, "vid_caption", None)])
+        for label, conf in top_objects:
+            texts.append(label)
+            text_slots.append((pos, "object_detection", conf))
+
+    zero_shot_outputs = zero_shot_classification_batched(bart_mnli, BUCKET_KEYS, texts, model_batch_size)
+
+    signals = [[] for _ in batch]
+    for pos, payload in enumerate(classify_payloads):
+        for prediction in payload:
+            bucket_info = MAPPED_LABELS.get(prediction["label"], ["13", "other"])
+            signals[pos].append(("classification", bucket_info[1], float(prediction.get("score", 0.0))))
+
+    for (pos, signal_name, object_conf), (bucket, conf) in zip(text_slots, zero_shot_outputs):
+        if signal_name == "ocr":
+            conf = ocr_qualities[pos] * conf
+        elif signal_name == "object_detection":
+            conf = object_conf * conf
+        signals[pos].append((signal_name, bucket, conf))
+
+    rows = []
+    for pos, (video_path, duration_ms, _) in enumerate(batch):
+        final_buckets_list = weighted_fusion(signals[pos])
+        rows.append({
+            "video_id": Path(video_path).stem,
+            "video_path": video_path,
+            "duration_ms": duration_ms,
+            "caption": descriptions.get(Path(video_path).stem, ""),
+            "bucket_num": [BUCKETS["buckets"][b] for b in final_buckets_list],
+            "bucket_name": final_buckets_list,
+            "ocr_text": raw_texts[pos][0],
+            "vid_caption": raw_texts[pos][1],
+            "detected_objects": raw_texts[pos][2],
+        })
+    return rows
+
+
+########################################## Checkpoint ##########################################
+def load_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        return set(json.load(f).get("done", []))
+
+
+def save_checkpoint(checkpoint_path, done_ids):
+    os.makedirs(os.path.dirname(checkpoint_path) or ".", exist_ok=True)
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"done": sorted(done_ids)}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+########################################## Driver ##########################################
+def build_models(device: int = -1):
+    import easyocr
+    from transformers import pipeline
+    from ultralytics import YOLO
+
+    genre_clf = pipeline(task="video-classification", model="MCG-NJU/videomae-small-finetuned-kinetics", device=device)
+    ocr_reader = easyocr.Reader(["en"], gpu=device >= 0)
+    bart_mnli = pipeline(task="zero-shot-classification", model="facebook/bart-large-mnli", device=device)
+    caption_model = pipeline(task="image-text-to-text", model="Salesforce/blip-image-captioning-base", device=device)
+    object_detector = YOLO("yolo11n.pt")
+    return genre_clf, ocr_reader, bart_mnli, caption_model, object_detector
+
+
+def load_descriptions(csv_path):
+    """ Optional video_id,description csv; videos without a row get an empty description"""
+    if not csv_path:
+        return {}
+    import pandas as pd
+
+    df = pd.read_csv(csv_path, dtype=str).fillna("")
+    return dict(zip(df["video_id"], df["description"]))
+
+
+def run_backfill(args):
+    video_paths = sorted(
+        str(f) for f in Path(args.folder).iterdir() if f.is_file() and f.suffix.lower() in VIDEO_EXTENSIONS
+    )
+    done_ids = load_checkpoint(args.checkpoint)
+    todo = [p for p in video_paths if Path(p).stem not in done_ids]
+    print(f"batch_categorization: {len(video_paths)} videos, {len(done_ids)} already done, {len(todo)} to process")
+    if not todo:
+        return
+
+    models = build_models(args.device)
+    descriptions = load_descriptions(args.descriptions)
+
+    pending_rows = []
+    pending_ids = []
+    batch = []
+    n_done = 0
+    n_failed = 0
+    start = time.perf_counter()
+
+    def flush_rows():
+        if not pending_rows:
+            return
+        out_path = update_parquet_table_batch(pending_rows, "video")
+        # only mark videos done once their rows are safely on disk
+        done_ids.update(pending_ids)
+        save_checkpoint(args.checkpoint, done_ids)
+        print(f"batch_categorization: wrote {len(pending_rows)} rows to {out_path}")
+        pending_rows.clear()
+        pending_ids.clear()
+
+    def run_batch():
+        nonlocal n_done
+        if not batch:
+            return
+        rows = categorize_batch(models, batch, descriptions, args.model_batch_size)
+        # rows point at the stored copy so the videos are served from storage like uploaded ones
+        for row in rows:
+            row["video_path"] = store_video_file(row["video_id"], row["video_path"])
+        pending_rows.extend(rows)
+        pending_ids.extend(row["video_id"] for row in rows)
+        n_done += len(rows)
+        batch.clear()
+
+        elapsed = time.perf_counter() - start
+        print(f"batch_categorization: {n_done}/{len(todo)} videos, {n_done / elapsed:.2f} videos/s")
+        if len(pending_rows) >= args.write_every:
+            flush_rows()
+
+    window = max(args.batch_videos * 2, args.workers)
+    for video_path, duration_ms, frames, error in decoded_videos(
+        todo, args.workers, window, args.num_frames, args.sampling, args.max_side
+    ):
+        if error is not None:
+            n_failed += 1
+            print(f"batch_categorization: failed to decode {video_path}: {error}")
+            continue
+        batch.append((video_path, duration_ms, frames))
+        if len(batch) >= args.batch_videos:
+            run_batch()
+
+    run_batch()
+    flush_rows()
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"batch_categorization: finished {n_done} videos ({n_failed} failed) in {elapsed:.1f}s, "
+        f"{n_done / elapsed if elapsed else 0.0:.2f} videos/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline batch categorization of a folder of videos into the video parquet table.")
+    parser.add_argument("folder", help="Path to folder containing videos")
+    parser.add_argument("--device", type=int, default=-1, help="Device for models (default -1 CPU)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Decode processes")
+    parser.add_argument("--batch-videos", type=int, default=16, help="Videos whose frames go through the models together")
+    parser.add_argument("--model-batch-size", type=int, default=8, help="Batch size passed to OCR / BLIP / BART")
+    parser.add_argument("--write-every", type=int, default=512, help="Rows per parquet part (and checkpoint interval)")
+    parser.add_argument("--num-frames", type=int, default=10, help="Frames sampled per video")
+    parser.add_argument("--sampling", choices=["uniform", "scene"], default="uniform", help="Frame sampling mode")
+    parser.add_argument("--max-side", type=int, default=960, help="Frames are shrunk to this longest side after decoding")
+    parser.add_argument("--descriptions", default=None, help="Optional csv with video_id,description columns")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="Checkpoint of finished video ids for resuming")
+    args = parser.parse_args()
+
+    run_backfill(args)
+
+
+if __name__ == "__main__":
+    main()
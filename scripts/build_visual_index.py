@@ -0,0 +1,101 @@
+"""
+Visual embedding backfill for items stored without an image embedder: products imported by preprocess_products.py,
+videos from batch_categorization.py and anything uploaded before the visual index existed.
+
+Every product photo / video without a visual row is embedded with the model the API loads at startup
+(video: normalized mean over the sampled frames) and stored through the same hook the upload services use.
+Items that already have a row are skipped, so an interrupted run just continues.
+
+to run: python scripts/build_visual_index.py --items product video --batch-size 16
+"""
+import argparse
+import time
+
+import numpy as np
+from PIL import Image
+
+try:
+    from backend.src.detection.detect_modules import embed_images, embed_video_frames
+    from backend.src.detection.detect_utils import get_base_frames
+    from backend.src.product_recommendation.catalog_index import get_catalog_index
+    from backend.src.product_recommendation.embedding_index import get_embedding_index, add_visual_embedding
+except ModuleNotFoundError:
+    import sys
+    from pathlib import Path
+
+    repo_root = Path(__file__).resolve().parents[1]
+    if str(repo_root) not in sys.path:
+        sys.path.insert(0, str(repo_root))
+    from backend.src.detection.detect_modules import embed_images, embed_video_frames
+    from backend.src.detection.detect_utils import get_base_frames
+    from backend.src.product_recommendation.catalog_index import get_catalog_index
+    from backend.src.product_recommendation.embedding_index import get_embedding_index, add_visual_embedding
+
+
+def build_image_embedder(device: int = -1):
+    from transformers import pipeline
+
+    return pipeline(task="image-feature-extraction", model="facebook/dinov2-small", device=device)
+
+
+def _embed_products(records, image_embedder, batch_size):
+    ids, images = [], []
+    for record in records:
+        try:
+            images.append(Image.open(record["product_path"]).convert("RGB"))
+            ids.append(record["product_id"])
+        except Exception as e:
+            print(f"build_visual_index: failed to read {record.get('product_path')}: {e}")
+    return list(zip(ids, embed_images(images, image_embedder, batch_size)))
+
+
+def _embed_videos(records, image_embedder, batch_size, num_frames, sampling_mode):
+    embedded = []
+    for record in records:
+        try:
+            frames = get_base_frames(record["video_path"], num_frames, sampling_mode)
+            embedded.append((record["video_id"], embed_video_frames(frames, image_embedder, batch_size)))
+        except Exception as e:
+            print(f"build_visual_index: failed to embed {record.get('video_path')}: {e}")
+    return embedded
+
+
+def backfill(item_type, image_embedder, batch_size, num_frames, sampling_mode):
+    catalog = get_catalog_index(item_type)
+    missing = np.flatnonzero(~get_embedding_index(item_type, "visual").has_vectors(np.arange(catalog.n_items)))
+    print(f"build_visual_index: {catalog.n_items} {item_type}s, {len(missing)} without a visual embedding")
+
+    n_done = 0
+    start = time.perf_counter()
+    for batch_start in range(0, len(missing), batch_size):
+        records = catalog.get_records(missing[batch_start:batch_start + batch_size])
+        if item_type == "product":
+            embedded = _embed_products(records, image_embedder, batch_size)
+        else:
+            embedded = _embed_videos(records, image_embedder, batch_size, num_frames, sampling_mode)
+
+        for item_id, vector in embedded:
+            if vector is not None:
+                add_visual_embedding(item_type, item_id, vector)
+                n_done += 1
+
+        elapsed = time.perf_counter() - start
+        print(f"build_visual_index: {n_done}/{len(missing)} {item_type}s, {n_done / elapsed:.2f}/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed product photos and video frames missing from the visual index.")
+    parser.add_argument("--items", nargs="+", choices=["product", "video"], default=["product", "video"])
+    parser.add_argument("--batch-size", type=int, default=16, help="Images per embedder call")
+    parser.add_argument("--num-frames", type=int, default=10, help="Frames sampled per video, same as the upload")
+    parser.add_argument("--sampling", choices=["uniform", "scene"], default="uniform")
+    parser.add_argument("--device", type=int, default=-1, help="-1 for CPU, GPU index otherwise")
+    args = parser.parse_args()
+
+    image_embedder = build_image_embedder(args.device)
+    for item_type in args.items:
+        backfill(item_type, image_embedder, args.batch_size, args.num_frames, args.sampling)
+
+
+if __name__ == "__main__":
+    main()